@@ -7,8 +7,9 @@ Derek Huynh, James Yung, Andrew Xie, Amaan Khan
 
 This module is where we create our flask app which is responsible for serving all of our api endpoints
 and is used for all of flask modules and defining our SQLAlchemy database. Here we also generate a
-synthetic dataset of users and do a mass insertion into our database. You can edit the number of users
-inserted into the data base to scale your simulation. We found that 20,000 was a reasonable number.
+synthetic dataset of users and do a mass insertion into our database, if it has no users yet. You can edit the
+number of users inserted into the data base to scale your simulation. We found that 20,000 was a reasonable
+number. Delete the database (instance/suitemate.db) to generate a new set of users.
 
 Comment out check contracts to generate users more quickly.
 """
@@ -29,7 +30,14 @@ def create_app(test_config=None):
     # Setting configs
     app.config.from_mapping({
         "SECRET_KEY": "dev",
-        "SQLALCHEMY_DATABASE_URI": "sqlite:///suitemate.db"
+        "SQLALCHEMY_DATABASE_URI": "sqlite:///suitemate.db",
+        # Where matches.py saves the populated matching index so that restarts don't rebuild it from scratch
+        "MATCHING_SNAPSHOT": os.path.join(app.instance_path, "matching_index.snapshot"),
+        # Where matches.py keeps the social graph: "database" saves it to the suggestions, requests and matches
+        # tables, and "log" appends its changes to GRAPH_LOG and compacts them into GRAPH_SNAPSHOT
+        "GRAPH_STORAGE": "database",
+        "GRAPH_LOG": os.path.join(app.instance_path, "social_graph.log"),
+        "GRAPH_SNAPSHOT": os.path.join(app.instance_path, "social_graph.snapshot")
     })
 
     if test_config:
@@ -46,21 +54,33 @@ def create_app(test_config=None):
     db.init_app(app)
 
     from user import generate_random_users
+    import graph_store
 
     @app.before_first_request
     def generate_users_and_insert_into_db():
-        # Clear the db after opening up a new session
-        db.session.query(model.User).delete()
-        db.session.commit()
-
-        # Feel free to edit the number of users to generate
-        list_users = generate_random_users('csv_files/names.csv', 20000)
-        entry = []
-        for u in list_users:
-            converted = model.convert_to_model(u)
-            entry.append(converted)
-        db.session.add_all(entry)
-        db.session.commit()
+        # Only seed a database without users, so that restarting against an existing database keeps its users
+        # along with the matching index and social graph saved from them
+        if db.session.query(model.User).first() is None:
+            # Any social graph saved in the database is between users that no longer exist
+            graph_store.clear_network(db.session)
+
+            # Feel free to edit the number of users to generate
+            list_users = generate_random_users('csv_files/names.csv', 20000)
+            entry = []
+            for u in list_users:
+                converted = model.convert_to_model(u)
+                entry.append(converted)
+            db.session.add_all(entry)
+            db.session.commit()
+
+            # The users are new, so any matching index and social graph saved from earlier users are out of date
+            for saved_file in (app.config["MATCHING_SNAPSHOT"], app.config["GRAPH_LOG"],
+                               app.config["GRAPH_SNAPSHOT"]):
+                if os.path.exists(saved_file):
+                    os.remove(saved_file)
+
+        # Populate the matching index and the social graph now, rather than on the first visit to a matches page
+        matches.warm()
 
     import auth
     app.register_blueprint(auth.bp)
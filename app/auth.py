@@ -26,6 +26,10 @@ from functools import wraps
 
 bp = Blueprint("auth", __name__, url_prefix="/auth")
 
+# Functions called with every user who registers, once they are saved to the database. Other modules add to this
+# to keep their own copies of the users up to date, such as the matching index in matches.py.
+registration_hooks = []
+
 
 @bp.route("/register", methods=["GET", "POST"])
 def register():
@@ -69,6 +73,8 @@ def register():
             )
             db.session.add(user)
             db.session.commit()
+            for hook in registration_hooks:
+                hook(convert_to_user_single(user))
         except IntegrityError:
             error.append("That username/email was already taken")
 
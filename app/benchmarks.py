@@ -0,0 +1,811 @@
+"""
+CSC111 Winter 2023 Final Project: suitemate
+
+Derek Huynh, James Yung, Andrew Xie, Amaan Khan
+
+================================================
+
+Benchmarks comparing the data structures used for matching users. Run "python benchmarks.py" from the app
+folder to print the timings. The users are generated synthetically with the same distributions as
+user.generate_random_users, so no names file is needed.
+"""
+from __future__ import annotations
+import gc
+import os
+import tempfile
+import random
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Callable, Optional
+import numpy as np
+from python_ta.contracts import check_contracts
+from user import User
+import decision_tree
+import leaf_index
+import index_snapshot
+import graph_log
+import graph_export
+import graph_stats
+import scoring
+import social_graph
+
+PARAMETERS_FILE = "csv_files/decision_tree_parameters.csv"
+
+
+# @check_contracts
+def synthetic_users(num_user: int, seed: Optional[int] = 0) -> list[User]:
+    """
+    Generate a list of random users with ids 0 to num_user - 1. The rent of each user is a range,
+    like the users returned by user.generate_random_users.
+
+    >>> len(synthetic_users(5))
+    5
+    """
+    rng = random.Random(seed)
+    users = []
+    for i in range(num_user):
+        low_bound_rent = min(round(abs(rng.gauss(1100, 300))), 5000)
+        users.append(User(f"user {i}", f"user_{i}", i, rng.randint(17, 100),
+                          rng.choice(["Male", "Female", "other"]),
+                          gender_pref=rng.choice([True, False]),
+                          smoke=rng.choice([True, False]),
+                          rent=(low_bound_rent, round(low_bound_rent + rng.uniform(0, 200))),
+                          pets=rng.choice([True, False]),
+                          contact=f"user{i}@gmail.com",
+                          location=('Toronto', 'Ontario'),
+                          noise=rng.randint(1, 3),
+                          guests=rng.choice([True, False]),
+                          cleanliness=rng.randint(1, 3),
+                          num_roommates=rng.randint(1, 4)))
+    return users
+
+
+# @check_contracts
+def synthetic_network(num_user: int, num_match: int, seed: Optional[int] = 0, users: Optional[list[User]] = None,
+                      network: Optional[social_graph.Network] = None) -> social_graph.Network:
+    """
+    Generate a network of num_user synthetic users with num_match random matches between them, each made by
+    suggesting, requesting and accepting like in matches.get_matches. If users is given, the network is made of
+    those users instead, and if network is given, the users and matches are added to it instead of a new network.
+
+    Preconditions:
+        - num_user >= 2
+        - users is None or len(users) == num_user
+    """
+    rng = random.Random(seed)
+    if users is None:
+        users = synthetic_users(num_user, seed)
+    if network is None:
+        network = social_graph.Network()
+    for u in users:
+        network.add_user(u)
+
+    for _ in range(num_match):
+        u1, u2 = rng.sample(users, 2)
+        if not network.check_request(u2, u1):
+            network.add_suggestion(u1, u2)
+            network.send_request(u1, u2)
+            network.accept_request(u2, u1)
+    return network
+
+
+def timed(function: Callable, *args) -> tuple[float, object]:
+    """
+    Call function with args and return the time it took in seconds, along with its return value. Garbage is
+    collected beforehand so that earlier allocations are not billed to the function.
+    """
+    gc.collect()
+    start = time.perf_counter()
+    result = function(*args)
+    return (time.perf_counter() - start, result)
+
+
+def benchmark_leaf_index(num_user: int, num_query: Optional[int] = 1000) -> None:
+    """
+    Compare building, populating and querying the recursive DecisionTree against the flat LeafIndex.
+    """
+    parameters = decision_tree.read_file(PARAMETERS_FILE)
+    users = synthetic_users(num_user)
+    queries = users[:num_query]
+
+    build_tree, tree = timed(decision_tree.build_decision_tree, parameters, None)
+    build_index, index = timed(leaf_index.LeafIndex, parameters)
+
+    def populate(structure) -> None:
+        for u in users:
+            structure.add_user_to_tree(u)
+
+    def query(method: Callable) -> None:
+        for u in queries:
+            method(u)
+
+    fill_tree, _ = timed(populate, tree)
+    fill_index, _ = timed(populate, index)
+    exact_tree, _ = timed(query, tree.find_exact_matches)
+    exact_index, _ = timed(query, index.find_exact_matches)
+    closest_tree, _ = timed(query, tree.find_closest_matches)
+    closest_index, _ = timed(query, index.find_closest_matches)
+
+    print(f"{num_user} users, {len(queries)} queries")
+    print(f"  build:   tree {build_tree:.4f}s, index {build_index:.4f}s")
+    print(f"  insert:  tree {fill_tree:.4f}s, index {fill_index:.4f}s")
+    print(f"  exact:   tree {exact_tree:.4f}s, index {exact_index:.4f}s")
+    print(f"  closest: tree {closest_tree:.4f}s, index {closest_index:.4f}s")
+
+
+def benchmark_bulk_load(num_user: int) -> None:
+    """
+    Compare populating the DecisionTree and the LeafIndex one user at a time against bulk_load.
+    """
+    parameters = decision_tree.read_file(PARAMETERS_FILE)
+    users = synthetic_users(num_user)
+
+    def one_at_a_time(structure) -> None:
+        for u in users:
+            structure.add_user_to_tree(u)
+
+    def in_bulk(structure) -> None:
+        structure.bulk_load(iter(users))
+
+    tree_single, _ = timed(one_at_a_time, decision_tree.build_decision_tree(parameters, None))
+    tree_bulk, _ = timed(in_bulk, decision_tree.build_decision_tree(parameters, None))
+    index_single, _ = timed(one_at_a_time, leaf_index.LeafIndex(parameters))
+    index_bulk, _ = timed(in_bulk, leaf_index.LeafIndex(parameters))
+
+    print(f"{num_user} users")
+    print(f"  tree:  one at a time {tree_single:.4f}s, bulk {tree_bulk:.4f}s")
+    print(f"  index: one at a time {index_single:.4f}s, bulk {index_bulk:.4f}s")
+
+
+def measured(function: Callable, *args) -> tuple[int, object]:
+    """
+    Call function with args and return the amount of memory in bytes that is still allocated by the call once it
+    returns, along with its return value.
+    """
+    gc.collect()
+    tracemalloc.start()
+    result = function(*args)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (size, result)
+
+
+def benchmark_sparse(num_user: int) -> None:
+    """
+    Compare the memory used by and the time taken to list the leaves of full and sparse decision trees and leaf
+    indexes holding the same users.
+    """
+    parameters = decision_tree.read_file(PARAMETERS_FILE)
+    users = synthetic_users(num_user)
+
+    def build_tree(sparse: bool) -> decision_tree.DecisionTree:
+        tree = decision_tree.build_decision_tree(parameters, None, sparse)
+        tree.bulk_load(users)
+        return tree
+
+    def build_index(sparse: bool) -> leaf_index.LeafIndex:
+        index = leaf_index.LeafIndex(parameters, sparse=sparse)
+        index.bulk_load(users)
+        return index
+
+    print(f"{num_user} users")
+    for name, build in [("tree", build_tree), ("index", build_index)]:
+        for sparse in [False, True]:
+            memory, structure = measured(build, sparse)
+            leaves_time, leaves = timed(structure.find_all_leaves)
+            print(f"  {name} (sparse={sparse}): {memory / 1000000:.2f}MB, {len(leaves)} leaves listed "
+                  f"in {leaves_time:.4f}s")
+
+
+def benchmark_snapshot(num_user: int) -> None:
+    """
+    Compare populating a LeafIndex from a list of users against loading it back from a snapshot.
+    """
+    parameters = decision_tree.read_file(PARAMETERS_FILE)
+    users = synthetic_users(num_user)
+    snapshot_file = os.path.join(tempfile.mkdtemp(), "benchmark.snapshot")
+
+    index = leaf_index.LeafIndex(parameters, sparse=True)
+    populate, _ = timed(index.bulk_load, users)
+    save, _ = timed(index_snapshot.save_snapshot, index, snapshot_file, PARAMETERS_FILE, num_user - 1)
+    load, _ = timed(index_snapshot.load_snapshot, leaf_index.LeafIndex(parameters, sparse=True), snapshot_file,
+                    PARAMETERS_FILE)
+
+    print(f"{num_user} users ({os.path.getsize(snapshot_file) / 1000000:.2f}MB snapshot)")
+    print(f"  bulk load {populate:.4f}s, save {save:.4f}s, load {load:.4f}s")
+    os.remove(snapshot_file)
+
+
+def benchmark_top_k(num_user: int, k: Optional[int] = 10, num_query: Optional[int] = 1000) -> None:
+    """
+    Time LeafIndex.find_top_k, reporting the average time per query.
+    """
+    index = leaf_index.LeafIndex(decision_tree.read_file(PARAMETERS_FILE))
+    users = synthetic_users(num_user)
+    for u in users:
+        index.add_user_to_tree(u)
+
+    def query() -> None:
+        for u in users[:num_query]:
+            index.find_top_k(u, k)
+
+    total, _ = timed(query)
+    print(f"{num_user} users: top {k} in {total / num_query * 1000000:.1f}us per query")
+
+
+def benchmark_scoring(num_user: int, num_query: Optional[int] = 100) -> None:
+    """
+    Compare the closest matches of a group of query users from the recursive DecisionTree against the
+    ScoringEngine, whose first query also groups the rows of the engine for the later ones. Also times scoring
+    the whole population against the queries one at a time and as a single matrix, which the tree cannot do.
+    """
+    parameters = decision_tree.read_file(PARAMETERS_FILE)
+    users = synthetic_users(num_user)
+    queries = users[:num_query]
+
+    tree = decision_tree.build_decision_tree(parameters, None)
+    for u in users:
+        tree.add_user_to_tree(u)
+    engine = scoring.ScoringEngine(parameters)
+    pack, _ = timed(engine.add_users, users)
+    first_query, _ = timed(engine.find_closest_matches, queries[0])
+
+    def closest(method: Callable) -> None:
+        for query in queries:
+            method(query)
+
+    def score_one_at_a_time() -> None:
+        for query in queries:
+            engine.score(query)
+
+    closest_tree, _ = timed(closest, tree.find_closest_matches)
+    closest_engine, _ = timed(closest, engine.find_closest_matches)
+    vector_scores, _ = timed(score_one_at_a_time)
+    matrix_scores, _ = timed(engine.score_batch, queries)
+
+    print(f"{num_user} users, {len(queries)} queries (packing took {pack:.4f}s, the first query {first_query:.4f}s)")
+    print(f"  closest: tree {closest_tree:.4f}s, engine {closest_engine:.4f}s")
+    print(f"  scores:  vector {vector_scores:.4f}s, matrix {matrix_scores:.4f}s")
+
+
+def benchmark_closest_batch(num_user: int, processes: Optional[int] = 4) -> None:
+    """
+    Compare finding the closest matches of every user in a sparse LeafIndex one user at a time against
+    find_closest_matches_batch, in this process and split between worker processes.
+    """
+    index = leaf_index.LeafIndex(decision_tree.read_file(PARAMETERS_FILE), sparse=True)
+    users = synthetic_users(num_user)
+    index.bulk_load(users)
+
+    def one_at_a_time() -> None:
+        for u in users:
+            index.find_closest_matches(u)
+
+    single, _ = timed(one_at_a_time)
+    batch, _ = timed(index.find_closest_matches_batch, users)
+    pooled, _ = timed(index.find_closest_matches_batch, users, processes)
+
+    print(f"{num_user} users")
+    print(f"  one at a time {single:.4f}s, batch {batch:.4f}s, batch with {processes} processes {pooled:.4f}s")
+
+
+def benchmark_closest_cache(num_user: int, num_query: Optional[int] = 20000) -> None:
+    """
+    Compare finding closest matches with and without the LeafIndex closest match cache, while new users keep
+    being added between the queries like they are through registration. The cache is off by default, since it
+    only helps while most leaves have at most one user.
+    """
+    parameters = decision_tree.read_file(PARAMETERS_FILE)
+    users = synthetic_users(num_user + num_query // 10)
+    queries = [users[i % num_user] for i in range(num_query)]
+
+    def query_and_register(index: leaf_index.LeafIndex) -> None:
+        for i, u in enumerate(queries):
+            if i % 10 == 0:
+                index.add_user_to_tree(users[num_user + i // 10])
+            index.find_closest_matches(u)
+
+    print(f"{num_user} users, {num_query} queries")
+    for cache_size in [0, 4096]:
+        index = leaf_index.LeafIndex(parameters, sparse=True, cache_size=cache_size)
+        index.bulk_load(users[:num_user])
+        total, _ = timed(query_and_register, index)
+        print(f"  cache size {cache_size}: {total:.4f}s, {index.cache_info()}")
+
+
+def benchmark_rent_buckets(num_user: int) -> None:
+    """
+    Compare the time taken by get_user_preferences and by the vectorized RentBuckets.bucket_positions to sort
+    users into 10, 50 and 100 rent ranges between 0 and 3200, read from generated parameters files.
+    """
+    users = synthetic_users(num_user)
+    rents = np.array([u.rent for u in users])
+    with open(PARAMETERS_FILE) as file:
+        other_rows = file.readlines()[1:]
+
+    def preferences_of_all(buckets: decision_tree.RentBuckets) -> None:
+        for u in users:
+            decision_tree.get_user_preferences(u, buckets)
+
+    print(f"{num_user} users")
+    for num_ranges in [10, 50, 100]:
+        width = 3200 // (num_ranges - 1)
+        bounds = [f"{i * width + (i > 0)},{(i + 1) * width}" for i in range(num_ranges - 1)]
+        parameters_file = os.path.join(tempfile.mkdtemp(), "parameters.csv")
+        with open(parameters_file, 'w') as file:
+            file.write(",".join(["rent ranges"] + bounds) + "\n")
+            file.writelines(other_rows)
+        buckets = decision_tree.RentBuckets(decision_tree.read_file(parameters_file)[0][1])
+        os.remove(parameters_file)
+
+        one_at_a_time, _ = timed(preferences_of_all, buckets)
+        vectorized, _ = timed(buckets.bucket_positions, rents)
+        print(f"  {num_ranges} ranges: get_user_preferences {one_at_a_time:.4f}s, "
+              f"bucket_positions {vectorized:.4f}s")
+
+
+def benchmark_communities(num_user: int, num_match: int) -> None:
+    """
+    Time finding every community in a synthetic network, and compare finding the size of the community of a
+    user by searching the network against looking it up in the communities kept by the network.
+    """
+    build, network = timed(synthetic_network, num_user, num_match)
+    components, (_, members) = timed(network.find_components)
+    communities, _ = timed(network.find_connected_communities)
+    users = [network.get_user(u_id).item for u_id in range(0, num_user, max(num_user // 10, 1))]
+
+    def sizes_by_search() -> None:
+        for u in users:
+            len(network.get_user(u.id).find_all_connected_matches(set())[1])
+
+    def sizes_by_lookup() -> None:
+        for u in users:
+            network.community_size(u)
+
+    search, _ = timed(sizes_by_search)
+    lookup, _ = timed(sizes_by_lookup)
+
+    print(f"{num_user} users, {num_match} matches ({len(members)} communities, built in {build:.2f}s)")
+    print(f"  find_components {components:.4f}s, find_connected_communities {communities:.4f}s")
+    print(f"  {len(users)} community sizes: search {search:.4f}s, lookup {lookup:.6f}s")
+
+
+def benchmark_friend_of_friend(num_user: int, num_match: int, num_query: Optional[int] = 200) -> None:
+    """
+    Compare finding the users with at least two matches in common with a group of users by intersecting the
+    matches of every pair of their matches, like find_new_suggestion used to, against counting them with
+    Network.count_common_matches.
+    """
+    network = synthetic_network(num_user, num_match)
+    users = [network.get_item(u_id) for u_id in range(num_query)]
+    match_sets = {u_id: set(network.match_ids(u_id)) for u_id in range(num_user)}
+
+    def by_pairs() -> None:
+        for u in users:
+            common_matches = set()
+            for u1 in match_sets[u.id]:
+                for u2 in match_sets[u.id]:
+                    if u1 != u2:
+                        common_matches.update(match_sets[u1].intersection(match_sets[u2]))
+            common_matches.discard(u.id)
+
+    def by_counting() -> None:
+        for u in users:
+            [u_id for u_id, count in network.count_common_matches(u).items() if count >= 2]
+
+    pairs, _ = timed(by_pairs)
+    counting, _ = timed(by_counting)
+    print(f"{num_user} users, {num_match} matches, {num_query} queries")
+    print(f"  pairs {pairs:.4f}s, counting {counting:.4f}s")
+
+
+def benchmark_suggestion_refresh(num_user: int, num_match: int) -> None:
+    """
+    Compare suggesting every user with at least two matches in common to each other one user at a time with
+    Network.find_all_new_suggestions against Network.find_all_new_suggestions_batch.
+    """
+    one_at_a_time, _ = timed(synthetic_network(num_user, num_match).find_all_new_suggestions)
+    batch, _ = timed(synthetic_network(num_user, num_match).find_all_new_suggestions_batch)
+    print(f"{num_user} users, {num_match} matches")
+    print(f"  one at a time {one_at_a_time:.4f}s, batch {batch:.4f}s")
+
+
+def benchmark_network_memory(num_user: int) -> None:
+    """
+    Measure the memory used by a synthetic network with two matches and two more suggestions per user, not
+    counting the User objects themselves.
+    """
+    users = synthetic_users(num_user)
+    rng = random.Random(1)
+
+    def build() -> social_graph.Network:
+        network = synthetic_network(num_user, 2 * num_user, users=users)
+        for _ in range(2 * num_user):
+            network.add_suggestion(*rng.sample(users, 2))
+        return network
+
+    memory, _ = measured(build)
+    print(f"{num_user} users: {memory / 1000000:.1f}MB, {memory / num_user:.0f} bytes per user")
+
+
+def benchmark_edge_checks(leaf_size: int, num_user: Optional[int] = 20000) -> None:
+    """
+    Time Network.create_network_single_community on a leaf of leaf_size users, which checks for a suggestion
+    and a request between every pair of them, in a network where every user already has about 20 suggestions.
+    """
+    users = synthetic_users(num_user)
+    network = synthetic_network(num_user, num_user, users=users)
+    rng = random.Random(2)
+    for _ in range(10 * num_user):
+        network.add_suggestion(*rng.sample(users, 2))
+
+    random.seed(0)
+    total, _ = timed(network.create_network_single_community, users[:leaf_size], users[0])
+    print(f"leaf of {leaf_size} users: {total:.4f}s")
+
+
+def benchmark_random_suggestions(num_user: int, num_suggestion: int) -> None:
+    """
+    Compare making random suggestions by rebuilding the list of user ids for every suggestion, like
+    Network.random_suggestions used to, against drawing random pairs across communities with
+    Network.random_cross_community_pairs. Only 100 suggestions are made the old way.
+    """
+    users = synthetic_users(num_user)
+    network = synthetic_network(num_user, num_user // 2, users=users)
+
+    def rebuilding_ids() -> None:
+        for _ in range(100):
+            keys = [u.id for u in users]
+            network.add_suggestion(network.get_item(random.choice(keys)), network.get_item(random.choice(keys)))
+
+    old, _ = timed(rebuilding_ids)
+    new, _ = timed(network.random_suggestions, num_suggestion)
+    print(f"{num_user} users: 100 suggestions rebuilding ids {old:.4f}s, "
+          f"{num_suggestion} cross community suggestions {new:.4f}s")
+
+
+def benchmark_group_edges(group_size: int, num_groups: Optional[int] = 10) -> None:
+    """
+    Compare building the edges within num_groups groups of group_size users one pair at a time, with every pair
+    looked at from both sides like Network.create_network_single_community used to, against
+    Network.create_network_all, which looks at each pair once and adds the edges in batches. Also check that
+    building a network twice from the same seed gives the same edges.
+    """
+    users = synthetic_users(group_size * num_groups)
+    groups = [users[i:i + group_size] for i in range(0, len(users), group_size)]
+
+    def one_pair_at_a_time() -> None:
+        network = social_graph.Network()
+        for group in groups:
+            visited = set()
+            for u1 in group:
+                for u2 in group:
+                    if u1.id != u2.id and (u2.id, u1.id) not in visited:
+                        if not network.check_suggestion(u1, u2):
+                            network.add_suggestion(u1, u2)
+                        if u1.id != users[0].id and u2.id != users[0].id and not network.check_request(u1, u2):
+                            network.send_request(u1, u2)
+                            if random.choice([True, False]):
+                                network.accept_request(u2, u1)
+                    visited.add((u1.id, u2.id))
+
+    def in_batches(seed: int) -> social_graph.Network:
+        network = social_graph.Network()
+        network.create_network_all(groups, users[0], 0, seed)
+        return network
+
+    old, _ = timed(one_pair_at_a_time)
+    new, first = timed(in_batches, 0)
+    second = in_batches(0)
+    same = all(first.match_ids(u.id) == second.match_ids(u.id) and first.request_ids(u.id) == second.request_ids(u.id)
+               for u in users)
+    print(f"{num_groups} groups of {group_size} users: one pair at a time {old:.4f}s, in batches {new:.4f}s, "
+          f"same edges from the same seed: {same}")
+
+
+def benchmark_graph_log(num_user: int, num_match: int) -> None:
+    """
+    Compare restarting a network of num_user users and num_match matches by playing back the log of every change
+    ever made to it, against loading a snapshot and playing back a log of only the last 1000 matches.
+    """
+    users = synthetic_users(num_user)
+    directory = tempfile.mkdtemp()
+    snapshot_file, log_file = os.path.join(directory, "graph.snapshot"), os.path.join(directory, "graph.log")
+
+    network = social_graph.Network()
+    log = graph_log.open_graph(network, snapshot_file, log_file)
+    synthetic_network(num_user, num_match, users=users, network=network)
+    log.flush()
+    full_log_size = os.path.getsize(log_file)
+    whole_log, reopened = timed(graph_log.open_graph, social_graph.Network(), snapshot_file, log_file)
+    reopened.close()
+
+    log.compact(network)
+    synthetic_network(num_user, 1000, seed=1, users=users, network=network)
+    log.close()
+    tail, reopened = timed(graph_log.open_graph, social_graph.Network(), snapshot_file, log_file)
+    reopened.close()
+
+    print(f"{num_user} users, {num_match} matches ({full_log_size / 1000000:.2f}MB log, "
+          f"{os.path.getsize(snapshot_file) / 1000000:.2f}MB snapshot): whole log {whole_log:.4f}s, "
+          f"snapshot and tail {tail:.4f}s")
+    os.remove(snapshot_file)
+    os.remove(log_file)
+
+
+def benchmark_stats(num_user: int, num_match: int) -> None:
+    """
+    Compare collecting the statistics of a network of num_user users and num_match matches and its index by
+    walking find_connected_communities and find_all_leaves, against graph_stats.collect_stats and against a
+    StatsCache that was already filled.
+    """
+    users = synthetic_users(num_user)
+    network = synthetic_network(num_user, num_match, users=users)
+    index = leaf_index.LeafIndex(decision_tree.read_file(PARAMETERS_FILE), sparse=True)
+    index.bulk_load(users)
+
+    def walking() -> None:
+        for kind in social_graph.EDGE_KINDS:
+            graph_stats.summarize([len(getattr(network.get_user(u.id), kind)) for u in users])
+        graph_stats.summarize([len(community) for community in network.find_connected_communities()])
+        graph_stats.summarize([len(leaf) for leaf in index.find_all_leaves() if leaf != []])
+
+    cache = graph_stats.StatsCache(60.0)
+    cache.get(network, index)
+    walk, _ = timed(walking)
+    collect, _ = timed(graph_stats.collect_stats, network, index)
+    cached, _ = timed(cache.get, network, index)
+    print(f"{num_user} users, {num_match} matches: walking {walk:.4f}s, collect_stats {collect:.4f}s, "
+          f"cached {cached:.6f}s")
+
+
+def benchmark_match_paths(num_user: int, num_match: int, num_query: Optional[int] = 1000) -> None:
+    """
+    Time Network.shortest_match_path between num_query pairs of users at most 4 matches apart, in a network of
+    num_user users and num_match matches, against a breadth first search from one end, and against asking the
+    same pairs again from the cache.
+    """
+    users = synthetic_users(num_user)
+    network = synthetic_network(num_user, num_match, users=users)
+    rng = random.Random(3)
+    pairs = []
+    while len(pairs) < num_query:
+        # The end of a random walk of up to 4 matches is at most 4 matches away
+        path = [rng.choice(users).id]
+        for _ in range(rng.randint(1, 4)):
+            if len(network.match_ids(path[-1])) > 0:
+                path.append(rng.choice(network.match_ids(path[-1])))
+        pairs.append((network.get_item(path[0]), network.get_item(path[-1])))
+
+    def one_end() -> None:
+        for u1, u2 in pairs:
+            depth_of = {u1.id: 0}
+            found = [u1.id]
+            for u_id in found:
+                if u_id == u2.id or depth_of[u_id] == 4:
+                    break
+                for v_id in network.match_ids(u_id):
+                    if v_id not in depth_of:
+                        depth_of[v_id] = depth_of[u_id] + 1
+                        found.append(v_id)
+
+    def both_ends() -> None:
+        for u1, u2 in pairs:
+            network.shortest_match_path(u1, u2, 4)
+
+    old, _ = timed(one_end)
+    new, _ = timed(both_ends)
+    cached, _ = timed(both_ends)
+    print(f"{num_user} users, {num_match} matches, {num_query} paths of at most 4 matches: "
+          f"one end {old / num_query * 1000:.3f}ms, both ends {new / num_query * 1000:.3f}ms, "
+          f"cached {cached / num_query * 1000:.4f}ms per path")
+
+
+def benchmark_export(num_user: int, num_match: int) -> None:
+    """
+    Compare writing out a network of num_user users and num_match matches two lines per user, like
+    Network.print_graph used to, against exporting its edges with graph_export as CSV and in the binary format,
+    and time loading the binary edge list back by memory-mapping it.
+    """
+    users = synthetic_users(num_user)
+    network = synthetic_network(num_user, num_match, users=users)
+    directory = tempfile.mkdtemp()
+    text_file, csv_file = os.path.join(directory, "graph.txt"), os.path.join(directory, "graph.csv")
+    binary_file = os.path.join(directory, "graph.edges")
+
+    def printing() -> None:
+        with open(text_file, 'w') as file:
+            for u in users:
+                print(f"suggestions: {u.id}, {list(network.suggestion_ids(u.id))}", file=file)
+                print(f"matches: {u.id}, {list(network.match_ids(u.id))}", file=file)
+
+    old, _ = timed(printing)
+    as_csv, _ = timed(graph_export.export_edges, network, csv_file)
+    as_binary, _ = timed(graph_export.export_edges, network, None, binary_file)
+    mapped, edges = timed(graph_export.load_edges, binary_file)
+    loaded, _ = timed(graph_export.load_network, social_graph.Network(), binary_file, users)
+
+    print(f"{num_user} users, {num_match} matches: print_graph {old:.4f}s, CSV {as_csv:.4f}s "
+          f"({os.path.getsize(csv_file) / 1000000:.2f}MB), binary {as_binary:.4f}s "
+          f"({os.path.getsize(binary_file) / 1000000:.2f}MB), memory-map {mapped:.6f}s, "
+          f"load into a network {loaded:.4f}s")
+    del edges
+    for name in (text_file, csv_file, binary_file):
+        os.remove(name)
+
+
+def benchmark_visits(num_user: int, num_visit: Optional[int] = 20) -> None:
+    """
+    Compare the work done on a visit to the matches page when every leaf of the index is connected on every
+    visit, like matches.get_matches used to, against only connecting the leaf of the visitor once every leaf was
+    connected when the app started, for num_visit visits to an index and network of num_user users.
+    """
+    users = synthetic_users(num_user)
+    for u in users:
+        u.rent = (u.rent[0], u.rent[0])
+    index = leaf_index.LeafIndex(decision_tree.read_file(PARAMETERS_FILE), sparse=True)
+    index.bulk_load(users)
+    network = social_graph.Network()
+    warm, _ = timed(network.create_network_all, index.find_all_leaves(), None, 100, 0)
+    visitors = random.Random(4).sample(users, num_visit)
+
+    def every_leaf() -> None:
+        for u in visitors:
+            index.add_user_to_tree(u)
+            network.create_network_all(index.find_all_leaves(), u, 100, 0)
+
+    def own_leaf() -> None:
+        for u in visitors:
+            index.add_user_to_tree(u)
+            network.create_network_all([index.find_exact_matches(u) + [u]], u, 100, 0)
+
+    new, _ = timed(own_leaf)
+    old, _ = timed(every_leaf)
+    print(f"{num_user} users ({warm:.4f}s to connect every leaf once), {num_visit} visits: every leaf "
+          f"{old / num_visit * 1000:.3f}ms, own leaf {new / num_visit * 1000:.3f}ms per visit")
+
+
+def stress_threads(num_user: int, num_pair: int, num_threads: Optional[int] = 8) -> None:
+    """
+    Check that a Network and a LeafIndex shared by num_threads threads end up the same as if one thread had made
+    all of the changes. Each thread adds its share of num_user users to the index and searches it, and matches its
+    share of num_pair random pairs of users: one user of every pair is suggested to the other and sends them a
+    request, which every other pair accepts. The pairs share users, so the threads keep changing the edges of the
+    same users at the same time, and threads are switched as often as possible to make that likelier.
+
+    Every pair is only changed by one thread, so the only difference the order the threads run in can make is the
+    order of the edges of each user. Raise an AssertionError unless the network and the index end up with the same
+    edges, communities and leaves as with one thread, the edges of every kind agree with each other, the size of
+    every community is the number of users connected to its members, and every representation invariant of _User
+    holds for every user.
+    """
+    users = synthetic_users(num_user)
+    rng = random.Random(1)
+    pairs = list({tuple(sorted(rng.sample(range(num_user), 2))) for _ in range(num_pair)})
+    rng.shuffle(pairs)
+    parameters = decision_tree.read_file(PARAMETERS_FILE)
+
+    def make_changes(network: social_graph.Network, index: leaf_index.LeafIndex, thread: int,
+                     barrier: Optional[threading.Barrier] = None) -> None:
+        if barrier is not None:
+            barrier.wait()
+        for u in users[thread::num_threads]:
+            index.add_user_to_tree(u)
+            index.find_closest_matches(u)
+        for i in range(thread, len(pairs), num_threads):
+            u1, u2 = users[pairs[i][0]], users[pairs[i][1]]
+            network.add_suggestion(u1, u2)
+            network.send_request(u1, u2)
+            if i % 2 == 0:
+                network.accept_request(u2, u1)
+            network.community_size(u1)
+
+    one_network, one_index = social_graph.Network(), leaf_index.LeafIndex(parameters, sparse=True)
+    for thread in range(num_threads):
+        make_changes(one_network, one_index, thread)
+
+    network, index = social_graph.Network(), leaf_index.LeafIndex(parameters, sparse=True)
+    barrier = threading.Barrier(num_threads)
+    threads = [threading.Thread(target=make_changes, args=(network, index, thread, barrier))
+               for thread in range(num_threads)]
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    sys.setswitchinterval(switch_interval)
+
+    def edge_sets(graph: social_graph.Network) -> list[set[tuple[int, int]]]:
+        return [{(u_id, v_id) for u_id, v_ids in graph.edges(kind).targets.items() for v_id in v_ids}
+                for kind in social_graph.EDGE_KINDS]
+
+    def communities(graph: social_graph.Network) -> set[frozenset[int]]:
+        return {frozenset(members) for members in graph.find_components()[1]}
+
+    same = edge_sets(network) == edge_sets(one_network) and communities(network) == communities(one_network) \
+        and {leaf: set(group) for leaf, group in index.leaves.items()} \
+        == {leaf: set(group) for leaf, group in one_index.leaves.items()}
+
+    consistent = all(len(edges.pairs) == sum(len(v_ids) for v_ids in edges.targets.values())
+                     and all(edges.has(u_id, v_id) for u_id, v_ids in edges.targets.items() for v_id in v_ids)
+                     for edges in (network.edges(kind) for kind in social_graph.EDGE_KINDS))
+    broken = []
+    for u in users:
+        node = network.get_user(u.id)
+        if node is not None and not (node not in node.suggestions and node not in node.matches
+                                     and node not in node.requests
+                                     and all(node in other.matches for other in node.matches)
+                                     and network.community_size(u) == len(node.find_all_connected_matches(set())[1])):
+            broken.append(u.id)
+
+    print(f"{num_threads} threads, {len(pairs)} pairs of {num_user} users: {elapsed:.4f}s, same as one thread: "
+          f"{same}, invariants hold: {consistent and broken == []}")
+    if not same:
+        raise AssertionError("the threads did not make the same changes as one thread")
+    if not consistent:
+        raise AssertionError("the edges of a kind do not agree with each other")
+    if broken != []:
+        raise AssertionError(f"the invariants of _User do not hold for the users with the ids {broken[:10]}")
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'max-line-length': 120,
+        'extra-imports': ['gc', 'numpy', 'os', 'tempfile', 'random', 'sys', 'threading', 'time', 'tracemalloc',
+                          'user', 'decision_tree', 'leaf_index', 'index_snapshot', 'graph_log', 'graph_export',
+                          'graph_stats', 'scoring', 'social_graph'],
+        'disable': ['unused-import', 'E9998'],
+        'allowed-io': ['benchmark_leaf_index', 'benchmark_bulk_load', 'benchmark_sparse', 'benchmark_top_k',
+                       'benchmark_snapshot', 'benchmark_scoring', 'benchmark_closest_batch',
+                       'benchmark_closest_cache', 'benchmark_rent_buckets', 'benchmark_communities',
+                       'benchmark_friend_of_friend', 'benchmark_suggestion_refresh', 'benchmark_network_memory',
+                       'benchmark_edge_checks', 'benchmark_random_suggestions', 'benchmark_group_edges',
+                       'benchmark_graph_log', 'benchmark_stats', 'benchmark_match_paths', 'benchmark_export',
+                       'benchmark_visits', 'stress_threads']
+    })
+
+    benchmark_leaf_index(20000)
+    benchmark_leaf_index(1000000)
+    benchmark_bulk_load(20000)
+    benchmark_sparse(1000)
+    benchmark_sparse(20000)
+    benchmark_snapshot(20000)
+    benchmark_top_k(20000)
+    benchmark_scoring(20000)
+    benchmark_scoring(200000, 10)
+    benchmark_closest_batch(2000)
+    benchmark_closest_batch(200000)
+    benchmark_closest_cache(20000)
+    benchmark_closest_cache(2000)
+    benchmark_closest_cache(300)
+    benchmark_rent_buckets(200000)
+    benchmark_communities(20000, 10000)
+    benchmark_communities(200000, 1000000)
+    benchmark_friend_of_friend(20000, 100000)
+    benchmark_friend_of_friend(2000, 100000)
+    benchmark_suggestion_refresh(20000, 100000)
+    benchmark_suggestion_refresh(100000, 500000)
+    benchmark_network_memory(20000)
+    benchmark_network_memory(200000)
+    benchmark_network_memory(1000000)
+    benchmark_edge_checks(300)
+    benchmark_edge_checks(1000)
+    benchmark_random_suggestions(20000, 1000)
+    benchmark_random_suggestions(200000, 10000)
+    benchmark_group_edges(100)
+    benchmark_group_edges(1000, 2)
+    benchmark_graph_log(20000, 100000)
+    benchmark_stats(20000, 100000)
+    benchmark_stats(200000, 1000000)
+    benchmark_match_paths(200000, 1000000)
+    benchmark_export(20000, 100000)
+    benchmark_export(200000, 1000000)
+    benchmark_visits(2000)
+    benchmark_visits(20000)
+    stress_threads(200, 20000)
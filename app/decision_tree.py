@@ -12,17 +12,28 @@ The preferences of the users are nodes in the tree in order of most to least imp
 from the node to the leaves, where the users with the corresponding preferences are stored.
 
 This module also includes functions that returns the preferences of the users in order of importance
-and the csv read for the parameters decision tree.
+and the csv read for the parameters decision tree. The rent ranges that users are sorted into are the ones
+read from the parameters file, and the range of a rent is found by binary search over their bounds.
 
 Comment out check contracts to generate users more quickly.
 """
 from __future__ import annotations
+import bisect
+import itertools
 import math
 import csv
-from typing import Optional
+from typing import Iterable, Optional
+import numpy as np
 from python_ta.contracts import check_contracts
 from user import User
 
+# The upper bound of the last rent range, which covers every rent above the ranges in the parameters file
+MAX_RENT = 12000
+
+# The rent ranges that users are sorted into before a parameters file is read
+DEFAULT_RENT_RANGES = ((0, 800), (801, 1100), (1101, 1400), (1401, 1700), (1701, 2000),
+                       (2001, 2300), (2301, 2600), (2601, 2900), (2901, 3200), (3201, MAX_RENT))
+
 
 # @check_contracts
 class DecisionTree:
@@ -35,8 +46,15 @@ class DecisionTree:
     ---
     category: the category that each child will split up
     decision: the decision made from the parent if applicable
-    users: an optional list of users that have the same combination of preferences to end up in that leaf
+    users: an optional dict of users that have the same combination of preferences to end up in that leaf, keyed
+        by their id
     partitions: the segmentations of the population based on the current particular category.
+    leaf_of: for the root of the tree, the leaf each user in the tree is stored in, keyed by their id
+    parameters: for sparse trees, the parameters of this node's category and of every category below it, which are
+        used to create partitions the first time a user is added to them. None for trees built in full.
+    rent_buckets: for the root of a tree built by build_decision_tree, the rent ranges of its parameters, which
+        the rents of the users added to it are sorted into. None for every other node, which uses the default
+        rent ranges.
 
     Representation Invariants:
         - (len(self.partitions) == 0 and len(self.users) >= 0) or (len(self.partitions) > 0 and len(self.users) == 0)
@@ -45,8 +63,11 @@ class DecisionTree:
     """
     category: Optional[str]
     decision: Optional[str | int | tuple[int, ...] | bool]
-    users: Optional[list[User]]
+    users: Optional[dict[int, User]]
     partitions: dict[str | int | tuple[int, ...] | bool, DecisionTree]
+    leaf_of: Optional[dict[int, DecisionTree]]
+    parameters: Optional[list[tuple[str, tuple[int | str | tuple[int, ...] | bool, ...]]]]
+    rent_buckets: Optional[RentBuckets]
 
     # @check_contracts
     def __init__(self, category: str, initial_users: Optional[list[User]] = None) -> None:
@@ -58,7 +79,13 @@ class DecisionTree:
         self.category = category
         self.decision = None
         self.partitions = {}
-        self.users = initial_users
+        self.leaf_of = None
+        self.parameters = None
+        self.rent_buckets = None
+        if initial_users is None:
+            self.users = None
+        else:
+            self.users = {u.id: u for u in initial_users}
 
     # @check_contracts
     def get_partitions(self) -> list[DecisionTree]:
@@ -71,17 +98,59 @@ class DecisionTree:
         """
         return list(self.partitions.values())
 
+    # @check_contracts
+    def is_leaf(self) -> bool:
+        """
+        Return whether this node of the tree is a leaf, which stores users instead of partitions.
+        """
+        if self.parameters is None:
+            return len(self.partitions) == 0
+        else:
+            return self.parameters == []
+
+    # @check_contracts
+    def get_partition(self, decision: str | int | tuple[int, ...] | bool,
+                      create: bool = False) -> Optional[DecisionTree]:
+        """
+        Return the partition of this tree for the given decision. For sparse trees, None is returned if no user
+        has been added to that partition yet, unless create is True, in which case the partition is created.
+
+        Raises a KeyError if decision is not one of the choices of this tree's category.
+        """
+        if decision in self.partitions:
+            return self.partitions[decision]
+        elif self.parameters is None or decision not in self.parameters[0][1]:
+            raise KeyError(decision)
+        elif not create:
+            return None
+        else:
+            subtree = build_decision_tree(self.parameters[1:], decision, sparse=True)
+            self.partitions[decision] = subtree
+            return subtree
+
+    # @check_contracts
+    def get_decisions_in_order(self) -> list[str | int | tuple[int, ...] | bool]:
+        """
+        Return the decisions that this tree has partitions for, in the order of the choices of its category.
+        """
+        if self.parameters is None:
+            return list(self.partitions)
+        else:
+            return [choice for choice in self.parameters[0][1] if choice in self.partitions]
+
     # @check_contracts
     def count_leaves(self) -> int:
         """
-        Counts and returns the amount of leaves in the tree.
+        Counts and returns the amount of leaves in the tree. For sparse trees, only the leaves with users in them
+        are counted.
 
         Preconditions:
             - len(self.partitions) <= 10
         """
         count = 0
-        if len(self.partitions) == 0:
-            count += 1
+        if self.is_leaf():
+            if self.parameters is None or self.users:
+                count += 1
         else:
             for subtree in self.partitions.values():
                 count += subtree.count_leaves()
@@ -91,22 +160,92 @@ class DecisionTree:
     def add_user_to_tree(self, user_to_add: User) -> None:
         """
         This method takes a user and finds their preferences, and then adds them to a leaf that is at the end of a path
-        from the root node by calling a helper function that recurses into the tree
+        from the root node by calling a helper function that recurses into the tree. If the user is already in the
+        tree, they are moved to the leaf matching their current preferences instead, so adding a user again never
+        creates a duplicate.
 
         Preconditions:
             - len(get_user_preferences(user_to_add)) == 8
 
         """
-        preferences = get_user_preferences(user_to_add)
-        self.add_user_to_tree_recursively(user_to_add, preferences)
+        if self.leaf_of is None:
+            self.leaf_of = {}
+        self.remove_user_from_tree(user_to_add)
+
+        preferences = get_user_preferences(user_to_add, self.rent_buckets)
+        self.leaf_of[user_to_add.id] = self.add_user_to_tree_recursively(user_to_add, preferences)
+
+    # @check_contracts
+    def bulk_load(self, users: Iterable[User]) -> None:
+        """
+        Add every user in users to the tree, as if add_user_to_tree was called on each one in order. users can be
+        any iterable, including a generator over the results of a database query.
+
+        Instead of recursing into the tree once per user, the rents of all of the users are sorted into their
+        ranges at once, the users are grouped by their decisions in a single pass, and then the tree is walked
+        once per distinct combination of decisions to attach each group to its leaf.
+
+        Preconditions:
+            - all(len(get_user_preferences(u)) == 8 for u in users)
+        """
+        users = list(users)
+        if len({u.id for u in users}) != len(users):
+            # Only the last appearance of a user should count, which adding them one at a time takes care of
+            for u in users:
+                self.add_user_to_tree(u)
+            return
+
+        if self.leaf_of is None:
+            self.leaf_of = {}
+        elif self.leaf_of != {}:
+            for u in users:
+                self.remove_user_from_tree(u)
+
+        groups = {}
+        for u, decisions in zip(users, get_users_decisions(users, self.rent_buckets)):
+            if decisions in groups:
+                groups[decisions][u.id] = u
+            else:
+                groups[decisions] = {u.id: u}
+
+        for decisions, group in groups.items():
+            leaf = self
+            for decision in decisions:
+                leaf = leaf.get_partition(decision, create=True)
+            if leaf.users is None:
+                leaf.users = group
+            else:
+                leaf.users.update(group)
+            self.leaf_of.update(dict.fromkeys(group, leaf))
+
+    # @check_contracts
+    def remove_user_from_tree(self, user_to_remove: User) -> None:
+        """
+        Remove the user with the same id as the given user from the tree, if they are in the tree. The user is
+        removed from the leaf they were added to, even if their preferences have changed since.
+        """
+        if self.leaf_of is not None and user_to_remove.id in self.leaf_of:
+            leaf = self.leaf_of.pop(user_to_remove.id)
+            leaf.users.pop(user_to_remove.id)
+
+    # @check_contracts
+    def update_user_in_tree(self, updated_user: User) -> None:
+        """
+        Replace the user with the same id as the given user with the given user, moving them to the leaf that
+        matches their new preferences. Used when a user edits their profile.
+
+        Preconditions:
+            - len(get_user_preferences(updated_user)) == 8
+        """
+        self.add_user_to_tree(updated_user)
 
     # @check_contracts
     def add_user_to_tree_recursively(self,
                                      user_to_add: User,
-                                     user_preferences: list[int | str | tuple[int, ...] | bool]) -> None:
+                                     user_preferences: list[int | str | tuple[int, ...] | bool]) -> DecisionTree:
         """
         This helper method takes a list of user preferences in order (it will be assumed to always be in order)
-        and recurses into the tree to add them in a leaf
+        and recurses into the tree to add them in a leaf, returning the leaf they were added to
 
         Preconditions:
             - 0 <= len(user_preferences) <= 8
@@ -114,20 +253,20 @@ class DecisionTree:
         """
         if user_preferences == []:
             if self.users is None:
-                self.users = [user_to_add]
+                self.users = {user_to_add.id: user_to_add}
             else:
-                self.users.append(user_to_add)
-            return
+                self.users[user_to_add.id] = user_to_add
+            return self
         else:
             preference = user_preferences[0]
             if len(user_preferences) == 7:
                 if preference:
-                    gender = user_to_add.gender.lower()
-                    self.partitions[gender].add_user_to_tree_recursively(user_to_add, user_preferences[1:])
+                    subtree = self.get_partition(user_to_add.gender.lower(), create=True)
                 else:
-                    self.partitions["any"].add_user_to_tree_recursively(user_to_add, user_preferences[1:])
+                    subtree = self.get_partition("any", create=True)
             else:
-                self.partitions[preference].add_user_to_tree_recursively(user_to_add, user_preferences[1:])
+                subtree = self.get_partition(preference, create=True)
+            return subtree.add_user_to_tree_recursively(user_to_add, user_preferences[1:])
 
     # @check_contracts
     def find_exact_matches(self, user_: User) -> list[User]:
@@ -140,7 +279,7 @@ class DecisionTree:
             - len(get_user_preferences(user_)) == 8
 
         """
-        preferences = get_user_preferences(user_)
+        preferences = get_user_preferences(user_, self.rent_buckets)
         matches = self.find_exact_matches_recursively(user_, preferences)
         return matches
 
@@ -158,22 +297,20 @@ class DecisionTree:
 
         """
         if user_preferences == []:
-            if user_ in self.users:
-                copy_of_users = self.users.copy()
-                copy_of_users.remove(user_)
-                return copy_of_users
-            return self.users
+            return [u for u_id, u in self.users.items() if u_id != user_.id]
         else:
             preference = user_preferences[0]
             if len(user_preferences) == 7:
                 if preference:
-                    gender = user_.gender.lower()
-                    matches = self.partitions[gender].find_exact_matches_recursively(user_, user_preferences[1:])
+                    subtree = self.get_partition(user_.gender.lower())
                 else:
-                    matches = self.partitions["any"].find_exact_matches_recursively(user_, user_preferences[1:])
+                    subtree = self.get_partition("any")
             else:
-                matches = self.partitions[preference].find_exact_matches_recursively(user_, user_preferences[1:])
-            return matches
+                subtree = self.get_partition(preference)
+
+            if subtree is None:
+                return []
+            return subtree.find_exact_matches_recursively(user_, user_preferences[1:])
 
     # @check_contracts
     def find_closest_matches(self, user_: User) -> list[User]:
@@ -189,7 +326,7 @@ class DecisionTree:
             - len(get_user_preferences(user_)) == 8
 
         """
-        preferences = get_user_preferences(user_)
+        preferences = get_user_preferences(user_, self.rent_buckets)
         matches = self.closest_helper(user_, preferences)
         return matches
 
@@ -204,65 +341,81 @@ class DecisionTree:
             - 0 <= len(get_user_preferences(user_)) <= 8
         """
         if user_preferences == []:
-            if user_ in self.users:
-                copy_of_users = self.users.copy()
-                copy_of_users.remove(user_)
-                return copy_of_users
-            return self.users
+            return [u for u_id, u in self.users.items() if u_id != user_.id]
         else:
             preference = user_preferences[0]
             if len(user_preferences) == 7:
                 if preference:
-                    gender = user_.gender.lower()
-                    matches = self.partitions[gender].closest_helper(user_, user_preferences[1:])
+                    subtree = self.get_partition(user_.gender.lower())
                 else:
-                    matches = self.partitions["any"].closest_helper(user_, user_preferences[1:])
+                    subtree = self.get_partition("any")
+            else:
+                subtree = self.get_partition(preference)
+
+            if subtree is None:
+                matches = []
             else:
-                matches = self.partitions[preference].closest_helper(user_, user_preferences[1:])
+                matches = subtree.closest_helper(user_, user_preferences[1:])
             if matches == []:
                 if len(user_preferences) >= 7:
                     return matches
                 else:
-                    partitions_copy = self.partitions.copy()
-                    partitions_copy.pop(preference)
-                    for alt_pref in partitions_copy:
-                        matches = self.partitions[alt_pref].closest_helper(user_, user_preferences[1:])
-                        if matches != []:
-                            return matches
+                    for alt_pref in self.get_decisions_in_order():
+                        if alt_pref != preference:
+                            matches = self.partitions[alt_pref].closest_helper(user_, user_preferences[1:])
+                            if matches != []:
+                                return matches
         return matches
 
     # @check_contracts
     def find_all_leaves(self) -> list[list[User]]:
         """
-        Returns all the users in the tree, with each leaf grouped in a nested list
+        Returns all the users in the tree, with each leaf grouped in a nested list. For sparse trees, only the
+        leaves with users in them are visited.
 
         Preconditions:
             - (self.decision is None and self.count_leaves() = 11520) or \
             (self.decision is not None and self.count_leaves() < 11520)
         """
         all_users = []
-        if len(self.partitions) == 0:
-            all_users.append(self.users)
+        if self.is_leaf():
+            if self.parameters is None or self.users:
+                all_users.append(list(self.users.values()))
             return all_users
         else:
-            for choice in self.partitions:
+            for choice in self.get_decisions_in_order():
                 all_users.extend(self.partitions[choice].find_all_leaves())
             return all_users
 
 
 # @check_contracts
 def build_decision_tree(preferences: list[tuple[str, tuple[int | str | tuple[int, ...] | bool, ...]]],
-                        decision: Optional[str | int | tuple[int, ...] | bool]) -> DecisionTree:
+                        decision: Optional[str | int | tuple[int, ...] | bool],
+                        sparse: bool = False) -> DecisionTree:
     """
     A function that builds the decision tree for us by creating then recursing into its partitions (subtrees),
     following an already set order of choices starting from an empty root node that decies between rent range, then
     gender preferences, and then the following choices in order from most to least important: number of roommates,
     pets, cleanliness, guests, smoking, and finally noise.
 
+    If sparse is True, only the root is built, and each partition is created the first time a user is added to it,
+    so the size of the tree grows with the combinations of preferences that users actually have. The root of the
+    tree (where decision is None) keeps the rent ranges of preferences to sort the rents of its users into.
+
     Preconditions:
         - 0 <= len(preferences) <= 8
     """
-    if preferences == []:
+    if sparse:
+        if preferences == []:
+            curr_node = DecisionTree("users", [])
+        else:
+            curr_node = DecisionTree(preferences[0][0])
+        curr_node.decision = decision
+        curr_node.parameters = preferences
+        if decision is None and preferences != []:
+            curr_node.rent_buckets = RentBuckets(preferences[0][1])
+        return curr_node
+    elif preferences == []:
         subtree = DecisionTree("users", [])
         subtree.decision = decision
         return subtree
@@ -275,6 +428,8 @@ def build_decision_tree(preferences: list[tuple[str, tuple[int | str | tuple[int
         for choice in choices:
             subtree = build_decision_tree(preferences[1:], choice)
             curr_node.partitions[choice] = subtree
+        if decision is None:
+            curr_node.rent_buckets = RentBuckets(choices)
         return curr_node
 
 
@@ -285,6 +440,9 @@ def read_file(preferences_file: str) -> list[tuple[str, tuple[int | str | tuple[
     a tuple that stores the preference name, and the possible choices in a tuple as the choices and all
     possible preferences are concrete and should not be changed.
 
+    The rent ranges are the choices of the first category. Trees and indexes built from the preferences sort rents
+    into them with a RentBuckets of their own.
+
     Preconditions:
         - preferences_file refers to a valid CSV file in the format described on the submission
         - preferences_file has exactly 8 lines with data (parameters) on them
@@ -303,7 +461,7 @@ def read_file(preferences_file: str) -> list[tuple[str, tuple[int | str | tuple[
             rent_upper_bound = int(rent_row[i + 1])
             rent_range = (rent_lower_bound, rent_upper_bound)
             rent_ranges.append(rent_range)
-        rent_ranges = tuple(rent_ranges + [(3201, 12000)])
+        rent_ranges = tuple(rent_ranges + [(rent_ranges[-1][1] + 1, MAX_RENT)])
         preferences.append((category, rent_ranges))
 
         for row in reader:
@@ -324,27 +482,136 @@ def read_file(preferences_file: str) -> list[tuple[str, tuple[int | str | tuple[
 
 
 # @check_contracts
-def get_user_preferences(user_: User) -> list[int | str | tuple[int, ...] | bool]:
+class RentBuckets:
+    """
+    The rent ranges of the decision tree, with their bounds kept in sorted order so that the range a rent falls
+    in is found by binary search instead of by checking every range.
+
+    Instance Attributes
+    ---
+    ranges: the rent ranges, from lowest to highest
+    lows: the lower bound of each range, in the same order as ranges
+    highs: the upper bound of each range, in the same order as ranges
+
+    Representation Invariants:
+        - self.ranges != ()
+        - self.lows == sorted(self.lows)
+        - all(self.highs[i] < self.lows[i + 1] for i in range(len(self.ranges) - 1))
     """
-    Returns a list of the user's preferences in the same order as seen in the decision_tree
+    ranges: tuple[tuple[int, int], ...]
+    lows: list[int]
+    highs: list[int]
+    _low_array: np.ndarray
+    _high_array: np.ndarray
+
+    def __init__(self, ranges: Iterable[tuple[int, int]]) -> None:
+        """
+        Initialize the buckets with the given rent ranges.
+
+        Preconditions:
+            - ranges do not overlap
+        """
+        self.ranges = tuple(sorted(ranges))
+        self.lows = [low for low, _ in self.ranges]
+        self.highs = [high for _, high in self.ranges]
+        self._low_array = np.array(self.lows)
+        self._high_array = np.array(self.highs)
+
+    def bucket(self, rent: tuple[int, int]) -> Optional[tuple[int, int]]:
+        """
+        Return the range that the middle of the given rent range falls in, or None if it is in none of them. A
+        rent range starting above every range is put in the last range.
+
+        >>> buckets = RentBuckets(DEFAULT_RENT_RANGES)
+        >>> buckets.bucket((900, 1000))
+        (801, 1100)
+        >>> buckets.bucket((13000, 14000))
+        (3201, 12000)
+        """
+        if rent[0] > self.highs[-1]:
+            return self.ranges[-1]
+        mid = (rent[0] + rent[1]) // 2
+        i = bisect.bisect_right(self.lows, mid) - 1
+        if i >= 0 and mid <= self.highs[i]:
+            return self.ranges[i]
+        return None
+
+    def bucket_positions(self, rents: np.ndarray) -> np.ndarray:
+        """
+        Return the position in self.ranges of the bucket of every rent range in rents, which has one row per rent
+        range, or -1 where the rent range is in none of them. The same as calling bucket on every row, but done
+        for all of them at once, such as when loading many users in bulk.
+
+        >>> buckets = RentBuckets(DEFAULT_RENT_RANGES)
+        >>> buckets.bucket_positions(np.array([[900, 1000], [13000, 14000], [-50, -10]])).tolist()
+        [1, 9, -1]
+        """
+        rents = np.asarray(rents).reshape((-1, 2))
+        mids = rents.sum(axis=1) // 2
+        positions = np.searchsorted(self._low_array, mids, side='right') - 1
+        outside = (positions < 0) | (mids > self._high_array[positions.clip(0)])
+        positions[outside] = -1
+        positions[rents[:, 0] > self.highs[-1]] = len(self.ranges) - 1
+        return positions
+
+
+# The rent ranges used by get_user_preferences when it is not given any
+DEFAULT_RENT_BUCKETS = RentBuckets(DEFAULT_RENT_RANGES)
+
+
+# @check_contracts
+def get_user_preferences(user_: User,
+                         buckets: Optional[RentBuckets] = None) -> list[int | str | tuple[int, ...] | bool]:
+    """
+    Returns a list of the user's preferences in the same order as seen in the decision_tree. The user's rent
+    is replaced with the rent range it falls in out of buckets, or out of DEFAULT_RENT_RANGES if buckets is None.
+
+    Preconditions:
+        - user is unique to all other users
+    """
+    if buckets is None:
+        buckets = DEFAULT_RENT_BUCKETS
+    return [buckets.bucket(user_.rent), user_.gender_pref, user_.num_roommates, user_.pets,
+            user_.cleanliness, user_.guests, user_.smoke, user_.noise]
+
+
+# @check_contracts
+def get_user_decisions(user_: User, buckets: Optional[RentBuckets] = None) -> list[int | str | tuple[int, ...] | bool]:
+    """
+    Returns the user's preferences in the same order as get_user_preferences, except that the gender preference
+    is replaced with the gender partition the user belongs in: their own gender if they only want roommates of
+    the same gender, and "any" otherwise. Each decision is a key of the partitions at its level of the tree.
 
     Preconditions:
         - user is unique to all other users
     """
-    rent_ranges = ((0, 800), (801, 1100), (1101, 1400), (1401, 1700), (1701, 2000),
-                   (2001, 2300), (2301, 2600), (2601, 2900), (2901, 3200), (3201, 12000))
-    user_rent_range = None
-    mid = (user_.rent[0] + user_.rent[1]) // 2
-    if user_.rent[0] > 12000:
-        user_rent_range = rent_ranges[-1]
+    preferences = get_user_preferences(user_, buckets)
+    if preferences[1]:
+        preferences[1] = user_.gender.lower()
     else:
-        for low, high in rent_ranges:
-            if low <= mid <= high:
-                user_rent_range = (low, high)
-                break
+        preferences[1] = "any"
+    return preferences
 
-    return [user_rent_range, user_.gender_pref, user_.num_roommates, user_.pets,
-            user_.cleanliness, user_.guests, user_.smoke, user_.noise]
+
+# @check_contracts
+def get_users_decisions(users: list[User],
+                        buckets: Optional[RentBuckets] = None) -> list[tuple[int | str | tuple[int, ...] | bool, ...]]:
+    """
+    Returns get_user_decisions for every user in users as a tuple, in the same order. The rents of all of the
+    users are sorted into their ranges at once by RentBuckets.bucket_positions, such as when loading many users
+    in bulk.
+    """
+    if buckets is None:
+        buckets = DEFAULT_RENT_BUCKETS
+    # The rents are kept as floats, so that a rent that is not a whole number falls in the same range as in bucket
+    rents = np.fromiter(itertools.chain.from_iterable(u.rent for u in users), dtype=np.float64,
+                        count=2 * len(users))
+
+    # A position of -1 is a rent in none of the ranges, which picks the None at the end
+    ranges = buckets.ranges + (None,)
+    return [(ranges[position], u.gender.lower() if u.gender_pref else "any", u.num_roommates, u.pets,
+             u.cleanliness, u.guests, u.smoke, u.noise)
+            for u, position in zip(users, buckets.bucket_positions(rents).tolist())]
 
 
 # @check_contracts
@@ -366,7 +633,7 @@ if __name__ == '__main__':
     import python_ta
     python_ta.check_all(config={
         'max-line-length': 120,
-        'extra-imports': ['csv', 'user', 'math'],
+        'extra-imports': ['bisect', 'csv', 'itertools', 'numpy', 'user', 'math'],
         'disable': ['unused-import', 'R1702', 'E9998'],
         'allowed-io': ['read_packet_csv']
     })
@@ -0,0 +1,174 @@
+"""
+CSC111 Winter 2023 Final Project: suitemate
+
+Derek Huynh, James Yung, Andrew Xie, Amaan Khan
+
+================================================
+
+This module exports the suggestions, requests and matches of a Network as edge lists, so that a network can be
+moved between the app, notebooks and the benchmarks without going through the database. It replaces
+Network.print_graph, which printed two formatted lines per user.
+
+An edge list can be written as CSV, with a header row and then one row per edge made of the kind of the edge, the
+id of the user it is from and the id of the user it is to. It can also be written in a binary format that is
+read back by memory-mapping it, laid out as follows:
+    - a 32 byte header: the magic bytes b"SMGE", the format version and the number of edges of each kind in
+      EDGE_KINDS
+    - for each kind of edge in EDGE_KINDS, the id of the user every edge is from and the id of the user it is to,
+      next to each other, as 4 byte little-endian integers
+
+The edges are streamed out one lock stripe of the network at a time (see social_graph.NUM_STRIPES), so exporting
+only holds a small part of the edges in memory on top of the network. The edges of a stripe are copied while
+holding its lock, so the network can keep changing while it is exported. The export is then not a snapshot of a
+single moment unless the caller holds network.locked() around it.
+"""
+from __future__ import annotations
+from contextlib import ExitStack
+import csv
+import itertools
+import os
+import struct
+from typing import Iterator, Optional
+import numpy as np
+from python_ta.contracts import check_contracts
+from social_graph import EDGE_KINDS, Network, NUM_STRIPES
+from user import User
+
+MAGIC = b"SMGE"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<4sIqqq")
+CSV_HEADER = ('kind', 'user_id', 'other_id')
+EDGE_TYPE = np.dtype('<i4')
+
+
+# @check_contracts
+def export_edges(network: Network, csv_file: Optional[str] = None,
+                 binary_file: Optional[str] = None) -> dict[str, int]:
+    """
+    Write every edge of network to csv_file as CSV and to binary_file in the binary format, leaving out either
+    one if it is None, and return the number of edges of each kind written. Each file is written to a temporary
+    file first and then moved into place, so it is never partially written, and the temporary files are removed
+    if writing fails.
+
+    Raise a ValueError if the id of a user does not fit in 4 bytes and binary_file is given.
+    """
+    counts = {}
+    files = [name for name in (csv_file, binary_file) if name is not None]
+    try:
+        with ExitStack() as stack:
+            writer = binary = None
+            if csv_file is not None:
+                writer = csv.writer(stack.enter_context(open(csv_file + ".tmp", 'w', newline='')))
+                writer.writerow(CSV_HEADER)
+            if binary_file is not None:
+                binary = stack.enter_context(open(binary_file + ".tmp", 'wb'))
+                binary.write(HEADER.pack(MAGIC, FORMAT_VERSION, 0, 0, 0))
+
+            for kind in EDGE_KINDS:
+                counts[kind] = 0
+                for sources, targets in edge_chunks(network, kind):
+                    counts[kind] += len(sources)
+                    if writer is not None:
+                        writer.writerows(zip(itertools.repeat(kind), sources.tolist(), targets.tolist()))
+                    if binary is not None:
+                        binary.write(_to_pairs(sources, targets).tobytes())
+
+            if binary is not None:
+                binary.seek(0)
+                binary.write(HEADER.pack(MAGIC, FORMAT_VERSION, *[counts[kind] for kind in EDGE_KINDS]))
+
+        for name in files:
+            os.replace(name + ".tmp", name)
+    finally:
+        # Only left behind if writing failed before the file was moved into place
+        for name in files:
+            if os.path.exists(name + ".tmp"):
+                os.remove(name + ".tmp")
+    return counts
+
+
+# @check_contracts
+def edge_chunks(network: Network, kind: str) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+    """
+    Yield every edge of the given kind in network as the ids of the users the edges are from and the ids of the
+    users they are to, one lock stripe of users at a time. The edges of each stripe are copied while holding its
+    lock, and users that gain their first edge of the kind after this starts are left out.
+
+    Preconditions:
+        - kind in EDGE_KINDS
+    """
+    targets = network.edges(kind).targets
+    by_stripe = {}
+    for u_id in list(targets):
+        by_stripe.setdefault(u_id % NUM_STRIPES, []).append(u_id)
+
+    for u_ids in by_stripe.values():
+        with network.locked_users(u_ids[:1]):
+            copied = [(u_id, targets[u_id].tobytes()) for u_id in u_ids if u_id in targets]
+        lengths = [len(v_ids) // 8 for _, v_ids in copied]
+        sources = np.repeat(np.array([u_id for u_id, _ in copied], dtype=np.int64), lengths)
+        yield (sources, np.frombuffer(b"".join(v_ids for _, v_ids in copied), dtype=np.int64))
+
+
+# @check_contracts
+def load_edges(binary_file: str) -> dict[str, np.ndarray]:
+    """
+    Return the edges of each kind saved in binary_file, as an array of pairs of ids with one row per edge that is
+    memory-mapped from the file, so only the parts that are used are read from disk.
+
+    Raise a ValueError if binary_file was not written by export_edges with this version of the format.
+    """
+    with open(binary_file, 'rb') as file:
+        header = file.read(HEADER.size)
+    if len(header) < HEADER.size:
+        raise ValueError(f"{binary_file} is not an edge list")
+    magic, version, *counts = HEADER.unpack(header)
+    if magic != MAGIC or version != FORMAT_VERSION \
+            or os.path.getsize(binary_file) != HEADER.size + 2 * EDGE_TYPE.itemsize * sum(counts):
+        raise ValueError(f"{binary_file} is not an edge list of version {FORMAT_VERSION}")
+
+    edges = {}
+    offset = HEADER.size
+    for kind, count in zip(EDGE_KINDS, counts):
+        if count == 0:
+            edges[kind] = np.empty((0, 2), dtype=EDGE_TYPE)
+        else:
+            edges[kind] = np.memmap(binary_file, dtype=EDGE_TYPE, mode='r', offset=offset, shape=(count, 2))
+        offset += 2 * EDGE_TYPE.itemsize * count
+    return edges
+
+
+# @check_contracts
+def load_network(network: Network, binary_file: str, users: list[User]) -> None:
+    """
+    Add users to network along with the edges saved in binary_file, which only has the ids of the users.
+
+    Preconditions:
+        - network.is_empty()
+        - every id in binary_file is the id of a user in users
+    """
+    edges = load_edges(binary_file)
+    network.load_edges(users, *[list(zip(edges[kind][:, 0].tolist(), edges[kind][:, 1].tolist()))
+                                for kind in EDGE_KINDS])
+
+
+def _to_pairs(sources: np.ndarray, targets: np.ndarray) -> np.ndarray:
+    """
+    Return the edges from the users with the ids in sources to the users with the ids in targets as 4 byte pairs.
+    Raise a ValueError if an id does not fit in 4 bytes.
+    """
+    pairs = np.column_stack((sources, targets))
+    limits = np.iinfo(EDGE_TYPE)
+    if len(pairs) > 0 and (pairs.min() < limits.min or pairs.max() > limits.max):
+        raise ValueError("a user id does not fit in a 4 byte edge list")
+    return pairs.astype(EDGE_TYPE)
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'max-line-length': 120,
+        'extra-imports': ['contextlib', 'csv', 'itertools', 'os', 'struct', 'numpy', 'social_graph',
+                          'user'],
+        'disable': ['unused-import', 'E9998'],
+    })
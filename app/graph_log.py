@@ -0,0 +1,308 @@
+"""
+CSC111 Winter 2023 Final Project: suitemate
+
+Derek Huynh, James Yung, Andrew Xie, Amaan Khan
+
+================================================
+
+This module keeps a Network on disk as an append-only log of its changes together with a snapshot of the whole
+network, as an alternative to saving it to the database with graph_store.py.
+
+A GraphLog is set as the journal of the network, and appends a record to the log for every user added to the
+network and every edge added to or removed from it. Every so often, the log is compacted: a snapshot of the
+network is saved and the log is started over. Loading a network reads the snapshot and then plays back the
+records in the log after it, so the time it takes depends on how much has changed since the last compaction
+rather than on how much has ever changed. Copying the snapshot and the log to another machine copies the network.
+
+A log is laid out as follows:
+    - a 16 byte header: the magic bytes b"SMGL", the format version and the generation of the log
+    - the records, each made of a one byte type, the id of a user and a second integer, as 8 byte integers.
+      Type 0 is a user being added, where the second integer is the length of the user's data, which follows
+      the record as a JSON list of their fields. Types 1 to 3 are an edge of the kind EDGE_KINDS[type - 1] being
+      added, and types 4 to 6 are one being removed, where the second integer is the id of the other user.
+
+A snapshot is laid out as follows:
+    - a 56 byte header: the magic bytes b"SMGS", the format version, the generation of the snapshot, the number
+      of users, the length of the user data and the number of edges of each kind
+    - the data of each user, as a JSON list of their fields, in the order they were added to the network
+    - for each kind of edge in EDGE_KINDS, the id of the user every edge is from followed by the id of the user
+      every edge is to, as 8 byte integers in the machine's byte order
+
+Every compaction makes a snapshot one generation after the last one and starts a log of the same generation, so
+a log is only played back on top of the snapshot it continues from. If the process stops after the new snapshot
+is saved but before the log is started over, the old log is of an older generation and is ignored. A record that
+was only partly written when the process stopped is cut off the end of the log.
+
+A GraphLog can be shared by the threads of a threaded server. Each record is appended in a single write under a
+lock, and compacting holds every lock of the network, so the snapshot never misses a change that is left out of
+the new log.
+"""
+from __future__ import annotations
+from array import array
+import json
+import mmap
+import os
+import struct
+import threading
+from typing import BinaryIO
+import numpy as np
+from python_ta.contracts import check_contracts  # pylint: disable=unused-import
+from index_snapshot import USER_FIELDS, user_from_fields
+from social_graph import EDGE_KINDS, Network
+from user import User
+
+LOG_MAGIC = b"SMGL"
+SNAPSHOT_MAGIC = b"SMGS"
+FORMAT_VERSION = 1
+LOG_HEADER = struct.Struct("<4sIq")
+SNAPSHOT_HEADER = struct.Struct("<4sIqqqqqq")
+RECORD = struct.Struct("<Bqq")
+USER_RECORD = 0
+
+
+# @check_contracts
+class GraphLog:
+    """
+    The log of the changes to a network since its last snapshot.
+
+    Instance Attributes:
+        - snapshot_file: the file the snapshots of the network are saved to
+        - log_file: the file the log is appended to
+        - generation: the generation of the log, which is the generation of the snapshot it continues from
+        - records: the number of records in the log
+
+    Representation Invariants:
+        - self.generation >= 0
+        - self.records >= 0
+    """
+    snapshot_file: str
+    log_file: str
+    generation: int
+    records: int
+    _file: BinaryIO
+    _lock: threading.Lock
+
+    def __init__(self, snapshot_file: str, log_file: str, generation: int, records: int) -> None:
+        """
+        Initialize the log of a network whose snapshots are saved to snapshot_file, appending to log_file. If
+        records is 0, log_file is started over as an empty log of the given generation. Otherwise, it must
+        already be a log of that generation with that many records.
+
+        Preconditions:
+            - generation >= 0
+            - records >= 0
+        """
+        self.snapshot_file = snapshot_file
+        self.log_file = log_file
+        self.generation = generation
+        self.records = records
+        if records == 0:
+            _start_log(log_file, generation)
+        self._file = open(log_file, 'ab')
+        self._lock = threading.Lock()
+
+    def user_added(self, user: User) -> None:
+        """
+        Append the record of user being added to the network, or of their data being replaced.
+        """
+        user_data = json.dumps([getattr(user, name) for name in USER_FIELDS]).encode()
+        self._append(RECORD.pack(USER_RECORD, user.id, len(user_data)) + user_data)
+
+    def edge_added(self, kind: str, u_id: int, v_id: int) -> None:
+        """
+        Append the record of an edge of the given kind from the user with the id u_id to the user with the id
+        v_id being added.
+        """
+        self._append(RECORD.pack(1 + EDGE_KINDS.index(kind), u_id, v_id))
+
+    def edge_removed(self, kind: str, u_id: int, v_id: int) -> None:
+        """
+        Append the record of an edge of the given kind from the user with the id u_id to the user with the id
+        v_id being removed.
+        """
+        self._append(RECORD.pack(1 + len(EDGE_KINDS) + EDGE_KINDS.index(kind), u_id, v_id))
+
+    def _append(self, record: bytes) -> None:
+        """
+        Append record to the log.
+        """
+        with self._lock:
+            self._file.write(record)
+            self.records += 1
+
+    def flush(self) -> None:
+        """
+        Write the records that are still buffered in memory to the log file.
+        """
+        with self._lock:
+            self._file.flush()
+
+    def compact(self, network: Network) -> None:
+        """
+        Save a snapshot of network, which is the network this is the log of, and start the log over. No edge of
+        network can change until this is done.
+        """
+        with network.locked(), self._lock:
+            self._file.close()
+            save_graph_snapshot(network, self.snapshot_file, self.generation + 1)
+            self.generation += 1
+            self.records = 0
+            _start_log(self.log_file, self.generation)
+            self._file = open(self.log_file, 'ab')
+
+    def close(self) -> None:
+        """
+        Write the buffered records to the log file and close it.
+        """
+        with self._lock:
+            self._file.close()
+
+
+# @check_contracts
+def open_graph(network: Network, snapshot_file: str, log_file: str) -> GraphLog:
+    """
+    Load the network saved in snapshot_file and log_file into network, and return the log of network, which is
+    set as its journal. Either file may be missing, and the log is started over if it does not continue from
+    the snapshot.
+
+    Preconditions:
+        - network.is_empty()
+    """
+    generation = load_graph_snapshot(network, snapshot_file)
+    records = replay_log(network, log_file, generation)
+    graph_log = GraphLog(snapshot_file, log_file, generation, records)
+    network.set_journal(graph_log)
+    return graph_log
+
+
+# @check_contracts
+def save_graph_snapshot(network: Network, snapshot_file: str, generation: int) -> None:
+    """
+    Save every user and edge of network to snapshot_file as a snapshot of the given generation, replacing the
+    file if it exists. The snapshot is written to a temporary file first and then moved into place, so the file
+    is never partially written, and the temporary file is removed if writing fails.
+    """
+    users = network.users()
+    user_data = json.dumps([[getattr(user, name) for name in USER_FIELDS] for user in users]).encode()
+
+    edge_arrays = []
+    for kind in EDGE_KINDS:
+        sources, targets = array('q'), array('q')
+        for u_id, v_ids in network.edges(kind).targets.items():
+            sources.extend(array('q', [u_id]) * len(v_ids))
+            targets.extend(v_ids)
+        edge_arrays.append((sources, targets))
+
+    temporary_file = snapshot_file + ".tmp"
+    try:
+        with open(temporary_file, 'wb') as file:
+            file.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, FORMAT_VERSION, generation, len(users), len(user_data),
+                                            *[len(sources) for sources, _ in edge_arrays]))
+            file.write(user_data)
+            for sources, targets in edge_arrays:
+                file.write(sources.tobytes())
+                file.write(targets.tobytes())
+        os.replace(temporary_file, snapshot_file)
+    finally:
+        if os.path.exists(temporary_file):
+            os.remove(temporary_file)
+
+
+# @check_contracts
+def load_graph_snapshot(network: Network, snapshot_file: str) -> int:
+    """
+    Add every user and edge saved in snapshot_file to network, and return the generation of the snapshot.
+    Return 0 without changing network if there is no snapshot, if it is incomplete, or if it was saved by
+    another version of this module.
+
+    Preconditions:
+        - network.is_empty()
+    """
+    if not os.path.exists(snapshot_file) or os.path.getsize(snapshot_file) < SNAPSHOT_HEADER.size:
+        return 0
+
+    with open(snapshot_file, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as snapshot:
+        magic, version, generation, _, data_length, *num_edges = SNAPSHOT_HEADER.unpack_from(snapshot)
+        if magic != SNAPSHOT_MAGIC or version != FORMAT_VERSION \
+                or len(snapshot) != SNAPSHOT_HEADER.size + data_length + 16 * sum(num_edges):
+            return 0
+
+        users = [user_from_fields(fields) for fields in
+                 json.loads(snapshot[SNAPSHOT_HEADER.size:SNAPSHOT_HEADER.size + data_length])]
+
+        edges = []
+        offset = SNAPSHOT_HEADER.size + data_length
+        for count in num_edges:
+            pairs = np.frombuffer(snapshot, dtype=np.int64, count=2 * count, offset=offset).reshape((2, count))
+            edges.append(list(zip(pairs[0].tolist(), pairs[1].tolist())))
+            offset += 16 * count
+            del pairs
+
+    network.load_edges(users, *edges)
+    return generation
+
+
+# @check_contracts
+def replay_log(network: Network, log_file: str, generation: int) -> int:
+    """
+    Play back every record in log_file on network and return the number of records, if log_file is a log of the
+    given generation. Otherwise, return 0 without changing network.
+
+    A record at the end of the log that was only partly written is cut off the log file.
+    """
+    if not os.path.exists(log_file) or os.path.getsize(log_file) < LOG_HEADER.size:
+        return 0
+
+    with open(log_file, 'rb') as file:
+        magic, version, log_generation = LOG_HEADER.unpack(file.read(LOG_HEADER.size))
+        if magic != LOG_MAGIC or version != FORMAT_VERSION or log_generation != generation:
+            return 0
+        log = file.read()
+
+    records = 0
+    offset = 0
+    while offset + RECORD.size <= len(log):
+        record_type, u_id, value = RECORD.unpack_from(log, offset)
+        if record_type == USER_RECORD:
+            if offset + RECORD.size + value > len(log):
+                break
+            user_data = log[offset + RECORD.size:offset + RECORD.size + value]
+            network.add_user(user_from_fields(json.loads(user_data)))
+            offset += RECORD.size + value
+        else:
+            added = record_type <= len(EDGE_KINDS)
+            kind = EDGE_KINDS[(record_type - 1) % len(EDGE_KINDS)]
+            network.replay_change(kind, u_id, value, added)
+            offset += RECORD.size
+        records += 1
+
+    if offset < len(log):
+        os.truncate(log_file, LOG_HEADER.size + offset)
+    return records
+
+
+# @check_contracts
+def _start_log(log_file: str, generation: int) -> None:
+    """
+    Replace log_file with an empty log of the given generation. The new log is written to a temporary file first
+    and then moved into place, so the file is never partially written, and the temporary file is removed if
+    writing fails.
+    """
+    temporary_file = log_file + ".tmp"
+    try:
+        with open(temporary_file, 'wb') as file:
+            file.write(LOG_HEADER.pack(LOG_MAGIC, FORMAT_VERSION, generation))
+        os.replace(temporary_file, log_file)
+    finally:
+        if os.path.exists(temporary_file):
+            os.remove(temporary_file)
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'max-line-length': 120,
+        'extra-imports': ['array', 'json', 'mmap', 'os', 'struct', 'threading', 'numpy', 'index_snapshot',
+                          'social_graph', 'user'],
+        'disable': ['E9998'],
+    })
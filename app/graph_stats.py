@@ -0,0 +1,137 @@
+"""
+CSC111 Winter 2023 Final Project: suitemate
+
+Derek Huynh, James Yung, Andrew Xie, Amaan Khan
+
+================================================
+
+This module summarizes the shape of a Network and of the LeafIndex its users are matched with: how many users
+and edges of each kind there are, how the number of edges of each user is distributed, how large the
+communities are and how full the leaves are. It is served as JSON by the /matches/stats view, so that it can be
+watched for leaves or communities that are getting too big.
+
+Scraping the statistics every few seconds should not walk the whole graph every time, so a StatsCache keeps the
+last statistics and only collects them again once they are older than its refresh interval. The counts of users
+and edges are kept up to date by the network itself, so they are always read fresh. The sizes of the
+communities are kept by the network's union find and the sizes of the leaves by the index, so collecting the
+statistics never builds the lists of users that find_connected_communities and find_all_leaves return.
+"""
+from __future__ import annotations
+import threading
+import time
+from typing import Optional
+import numpy as np
+from python_ta.contracts import check_contracts
+from leaf_index import LeafIndex
+from social_graph import EDGE_KINDS, Network
+
+# The percentiles reported for every distribution
+PERCENTILES = (50, 90, 99)
+
+
+# @check_contracts
+class StatsCache:
+    """
+    The statistics of a network and its index, collected at most once per refresh interval.
+
+    Instance Attributes:
+        - refresh_interval: the number of seconds the statistics are kept before they are collected again
+        - stats: the statistics collected last, or None if they were never collected
+        - collected_at: the time the statistics were collected last, according to time.monotonic
+        - collections: the number of times the statistics were collected
+
+    Representation Invariants:
+        - self.refresh_interval >= 0
+        - self.collections >= 0
+    """
+    refresh_interval: float
+    stats: Optional[dict]
+    collected_at: float
+    collections: int
+    _lock: threading.Lock
+
+    def __init__(self, refresh_interval: Optional[float] = 5.0) -> None:
+        """
+        Initialize a cache that collects the statistics again once they are refresh_interval seconds old.
+
+        Preconditions:
+            - refresh_interval >= 0
+        """
+        self.refresh_interval = refresh_interval
+        self.stats = None
+        self.collected_at = 0.0
+        self.collections = 0
+
+        # Held while collecting, so that threads asking at the same time only collect the statistics once
+        self._lock = threading.Lock()
+
+    def get(self, network: Network, index: LeafIndex) -> dict:
+        """
+        Return the statistics of network and index, collecting them again if they are older than the refresh
+        interval. The counts of users and edges are always current, and the age of the rest is given under
+        "age_seconds".
+        """
+        with self._lock:
+            if self.stats is None or time.monotonic() - self.collected_at >= self.refresh_interval:
+                self.stats = collect_stats(network, index)
+                self.collected_at = time.monotonic()
+                self.collections += 1
+            stats = dict(self.stats)
+
+        stats.update(count_stats(network))
+        stats["age_seconds"] = round(time.monotonic() - self.collected_at, 3)
+        return stats
+
+
+# @check_contracts
+def count_stats(network: Network) -> dict:
+    """
+    Return the number of users in network and the number of edges of each kind, where a match counts once even
+    though it is an edge both ways.
+    """
+    edges = {kind: network.count_edges(kind) for kind in EDGE_KINDS}
+    edges["matches"] //= 2
+    return {"users": network.count_users(), "edges": edges}
+
+
+# @check_contracts
+def collect_stats(network: Network, index: LeafIndex) -> dict:
+    """
+    Return the distribution of the number of edges of each kind from every user in network, of the size of every
+    community of network and of the number of users in every occupied leaf of index.
+    """
+    return {
+        "degrees": {kind: summarize(network.degrees(kind)) for kind in EDGE_KINDS},
+        "communities": summarize(network.community_sizes()),
+        "leaves": summarize(index.leaf_sizes())
+    }
+
+
+# @check_contracts
+def summarize(values: np.ndarray | list[int]) -> dict:
+    """
+    Return the number, mean, PERCENTILES and maximum of values, or only their number if there are none.
+
+    >>> summarize([1, 2, 3, 4])
+    {'count': 4, 'mean': 2.5, 'p50': 2.5, 'p90': 3.7, 'p99': 3.97, 'max': 4}
+    >>> summarize([])
+    {'count': 0}
+    """
+    values = np.asarray(values)
+    if len(values) == 0:
+        return {"count": 0}
+
+    summary = {"count": len(values), "mean": round(float(values.mean()), 3)}
+    for percentile, value in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+        summary[f"p{percentile}"] = round(float(value), 3)
+    summary["max"] = int(values.max())
+    return summary
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'max-line-length': 120,
+        'extra-imports': ['threading', 'time', 'numpy', 'leaf_index', 'social_graph'],
+        'disable': ['unused-import', 'E9998'],
+    })
@@ -0,0 +1,184 @@
+"""
+CSC111 Winter 2023 Final Project: suitemate
+
+Derek Huynh, James Yung, Andrew Xie, Amaan Khan
+
+================================================
+
+This module saves the suggestions, requests and matches of a Network to the database, in the suggestions,
+requests and matches tables defined in model.py, and loads a Network back from them.
+
+Changes to the network are not written to the database as they happen. Instead, an EdgeBuffer is set as the
+journal of the network, and it collects every edge that was added or removed since it was last flushed. Flushing
+writes all of them in a single transaction, with one batched DELETE and one batched INSERT per table, so a
+request that sends or accepts a request to room together does not wait on the database. The changes that have
+not been flushed yet are lost if the process stops, which is at most the last flush_interval seconds of them.
+
+An EdgeBuffer can be shared by the threads of a threaded server. Changes are recorded under a lock that is only
+held to update the pending changes, and flushes are made one at a time, so the changes of two flushes never
+reach the database out of order.
+"""
+from __future__ import annotations
+import threading
+import time
+from typing import Optional
+from sqlalchemy import bindparam, select, union
+from sqlalchemy.orm import Session
+from python_ta.contracts import check_contracts
+from db_helpers import convert_to_user_flask
+from social_graph import Network
+from user import User
+import model
+
+# The table that stores each kind of edge of a Network
+EDGE_TABLES = {"suggestions": model.Suggestion, "requests": model.Request, "matches": model.Match}
+
+
+# @check_contracts
+class EdgeBuffer:
+    """
+    A write-behind buffer of the changes to the edges of a network that have not been saved to the database yet.
+
+    Instance Attributes:
+        - pending: the latest change to every edge that has changed since the last flush, keyed by the kind of
+          the edge, the id of the user it is from and the id of the user it is to. The change is True if the edge
+          was added and False if it was removed.
+        - max_pending: the number of pending changes at which the buffer should be flushed
+        - flush_interval: the number of seconds after the last flush at which the buffer should be flushed
+        - last_flush: the time of the last flush, according to time.monotonic
+        - flushed: the number of changes written to the database so far
+
+    Representation Invariants:
+        - all(kind in EDGE_TABLES for kind, _, _ in self.pending)
+        - self.max_pending > 0
+        - self.flush_interval >= 0
+    """
+    pending: dict[tuple[str, int, int], bool]
+    max_pending: int
+    flush_interval: float
+    last_flush: float
+    flushed: int
+    _lock: threading.Lock
+    _flush_lock: threading.Lock
+
+    def __init__(self, max_pending: Optional[int] = 5000, flush_interval: Optional[float] = 5.0) -> None:
+        """
+        Initialize an empty buffer that should be flushed once it has max_pending changes, or once flush_interval
+        seconds have passed since it was created or last flushed.
+
+        Preconditions:
+            - max_pending > 0
+            - flush_interval >= 0
+        """
+        self.pending = {}
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
+        self.last_flush = time.monotonic()
+        self.flushed = 0
+
+        # The lock guarding pending, and the lock held for the whole of each flush
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    def user_added(self, user: User) -> None:
+        """
+        Do nothing, since the users of the network are already saved in the users table.
+        """
+
+    def edge_added(self, kind: str, u_id: int, v_id: int) -> None:
+        """
+        Record that an edge of the given kind from the user with the id u_id to the user with the id v_id was
+        added.
+        """
+        with self._lock:
+            self.pending[(kind, u_id, v_id)] = True
+
+    def edge_removed(self, kind: str, u_id: int, v_id: int) -> None:
+        """
+        Record that an edge of the given kind from the user with the id u_id to the user with the id v_id was
+        removed.
+        """
+        with self._lock:
+            self.pending[(kind, u_id, v_id)] = False
+
+    def should_flush(self) -> bool:
+        """
+        Return whether there are pending changes and either there are at least max_pending of them or it has been
+        at least flush_interval seconds since the last flush.
+        """
+        return len(self.pending) >= self.max_pending or \
+            (self.pending != {} and time.monotonic() - self.last_flush >= self.flush_interval)
+
+    def flush(self, session: Session) -> int:
+        """
+        Write every pending change to the database in a single transaction of session and return the number of
+        changes written. An edge that was added and then removed before the flush is not written at all.
+
+        Every changed edge is deleted first and then the ones that were added are inserted, so adding an edge that
+        is already in the database does not break its primary key.
+        """
+        with self._flush_lock:
+            with self._lock:
+                changes, self.pending = self.pending, {}
+            self.last_flush = time.monotonic()
+            if changes == {}:
+                return 0
+
+            changed = {kind: [] for kind in EDGE_TABLES}
+            added = {kind: [] for kind in EDGE_TABLES}
+            for (kind, u_id, v_id), is_added in changes.items():
+                changed[kind].append({"u_id": u_id, "v_id": v_id})
+                if is_added:
+                    added[kind].append({"user_id": u_id, "other_id": v_id})
+
+            for kind, edge_model in EDGE_TABLES.items():
+                table = edge_model.__table__
+                if changed[kind] != []:
+                    session.execute(table.delete().where(table.c.user_id == bindparam("u_id"),
+                                                         table.c.other_id == bindparam("v_id")), changed[kind])
+                if added[kind] != []:
+                    session.execute(table.insert(), added[kind])
+            session.commit()
+
+            self.flushed += len(changes)
+            return len(changes)
+
+
+# @check_contracts
+def load_network(network: Network, session: Session) -> None:
+    """
+    Add every edge saved in the database to network, along with every user at either end of one, using one
+    query for each table and one for the users.
+
+    Preconditions:
+        - network.is_empty()
+    """
+    edges = {kind: [tuple(row) for row in session.execute(select(table.user_id, table.other_id))]
+             for kind, table in EDGE_TABLES.items()}
+
+    user_ids = union(*[select(column) for table in EDGE_TABLES.values() for column in (table.user_id, table.other_id)])
+    users = convert_to_user_flask(session.execute(select(model.User).where(model.User.id.in_(user_ids))).scalars())
+    for u in users:
+        u.rent = (u.rent, u.rent)
+
+    network.load_edges(users, edges["suggestions"], edges["requests"], edges["matches"])
+
+
+# @check_contracts
+def clear_network(session: Session) -> None:
+    """
+    Delete every edge saved in the database.
+    """
+    for table in EDGE_TABLES.values():
+        session.query(table).delete()
+    session.commit()
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'max-line-length': 120,
+        'extra-imports': ['threading', 'time', 'sqlalchemy', 'sqlalchemy.orm', 'db_helpers', 'social_graph', 'user',
+                          'model'],
+        'disable': ['unused-import', 'E9998'],
+    })
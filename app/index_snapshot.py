@@ -0,0 +1,135 @@
+"""
+CSC111 Winter 2023 Final Project: suitemate
+
+Derek Huynh, James Yung, Andrew Xie, Amaan Khan
+
+================================================
+
+This module saves a populated LeafIndex to a compact file on disk, and loads it back, so that a new process
+does not have to rebuild the index from the entire users table before it can serve its first request.
+
+A snapshot is laid out as follows:
+    - a 64 byte header: the magic bytes b"SMIX", the format version, the SHA-256 digest of the decision tree
+      parameters file the index was built from, the high water mark (the largest user id in the users table
+      when the snapshot was taken), the number of users and the length of the user data
+    - the leaf id of each user, as 8 byte integers in the machine's byte order
+    - the data of each user, as a JSON list of their fields, in the same order as the leaf ids
+
+The leaf ids are read straight out of a memory map of the file, so users are put back in their leaves without
+looking at their preferences again. A snapshot is only loaded if it was taken from the same parameters file,
+since leaf ids depend on the parameters. Users added after the snapshot was taken have ids above its high water
+mark, so only those rows need to be read from the database.
+"""
+from __future__ import annotations
+from array import array
+import dataclasses
+import hashlib
+import json
+import mmap
+import os
+import struct
+from typing import Optional
+from python_ta.contracts import check_contracts
+from user import User
+from leaf_index import LeafIndex
+
+MAGIC = b"SMIX"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<4sI32sqqq")
+USER_FIELDS = [field.name for field in dataclasses.fields(User)]
+
+
+# @check_contracts
+def parameters_digest(parameters_file: str) -> bytes:
+    """
+    Return the SHA-256 digest of the contents of the given decision tree parameters file.
+    """
+    with open(parameters_file, 'rb') as file:
+        return hashlib.sha256(file.read()).digest()
+
+
+# @check_contracts
+def save_snapshot(index: LeafIndex, snapshot_file: str, parameters_file: str, high_water_mark: int) -> None:
+    """
+    Save every user in index to snapshot_file, replacing it if it exists. parameters_file is the file the index
+    was built from, and high_water_mark is the largest user id in the users table that the index holds.
+
+    The snapshot is written to a temporary file first and then moved into place, so a process that is loading
+    the snapshot at the same time never sees a partially written file. The temporary file is removed if writing
+    fails.
+    """
+    # The users are copied while holding the lock of the index, so that the leaf ids and the users line up even
+    # if other threads are adding users, and are then turned into JSON without holding it
+    with index.locked():
+        leaf_ids = array('q', index.leaf_of.values())
+        users = [index.users[u_id] for u_id in index.leaf_of]
+    user_data = json.dumps([[getattr(u, name) for name in USER_FIELDS] for u in users])
+    user_data = user_data.encode()
+
+    temporary_file = snapshot_file + ".tmp"
+    try:
+        with open(temporary_file, 'wb') as file:
+            file.write(HEADER.pack(MAGIC, FORMAT_VERSION, parameters_digest(parameters_file), high_water_mark,
+                                   len(leaf_ids), len(user_data)))
+            file.write(leaf_ids.tobytes())
+            file.write(user_data)
+        os.replace(temporary_file, snapshot_file)
+    finally:
+        if os.path.exists(temporary_file):
+            os.remove(temporary_file)
+
+
+# @check_contracts
+def load_snapshot(index: LeafIndex, snapshot_file: str, parameters_file: str) -> Optional[int]:
+    """
+    Add every user saved in snapshot_file to index, and return the high water mark of the snapshot. Return None
+    without changing index if there is no snapshot, if it is incomplete, or if it was saved by another version of
+    this module or from a different parameters file.
+
+    Preconditions:
+        - index.is_empty()
+        - index was built from parameters_file
+    """
+    if not os.path.exists(snapshot_file) or os.path.getsize(snapshot_file) < HEADER.size:
+        return None
+
+    with open(snapshot_file, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as snapshot:
+        magic, version, digest, high_water_mark, num_users, data_length = HEADER.unpack_from(snapshot)
+        if magic != MAGIC or version != FORMAT_VERSION or digest != parameters_digest(parameters_file) \
+                or len(snapshot) != HEADER.size + 8 * num_users + data_length:
+            return None
+
+        leaf_ids_end = HEADER.size + 8 * num_users
+        user_data = json.loads(snapshot[leaf_ids_end:leaf_ids_end + data_length])
+
+        with memoryview(snapshot) as view:
+            leaf_ids = view[HEADER.size:leaf_ids_end].cast('q')
+            users = [user_from_fields(fields) for fields in user_data]
+            index.bulk_load_leaves(users, leaf_ids)
+            leaf_ids.release()
+
+    return high_water_mark
+
+
+# @check_contracts
+def user_from_fields(fields: list) -> User:
+    """
+    Return the user with the given fields, in the order they were saved by save_snapshot. JSON has no tuples, so
+    the fields that are tuples were saved as lists.
+    """
+    user_ = User(*fields)
+    if user_.rent is not None:
+        user_.rent = tuple(user_.rent)
+    if user_.location is not None and not isinstance(user_.location, str):
+        user_.location = tuple(user_.location)
+    return user_
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'max-line-length': 120,
+        'extra-imports': ['array', 'dataclasses', 'hashlib', 'json', 'mmap', 'os', 'struct', 'user',
+                          'leaf_index'],
+        'disable': ['unused-import', 'E9998'],
+    })
@@ -0,0 +1,744 @@
+"""
+CSC111 Winter 2023 Final Project: suitemate
+
+Derek Huynh, James Yung, Andrew Xie, Amaan Khan
+
+================================================
+
+This module is where we implemented a flat version of our decision tree. Instead of allocating a node for
+every possible combination of preferences, the preferences of a user are encoded into a single integer (the
+leaf id) and every leaf is stored as a bucket of users keyed by their id, with the buckets keyed by leaf id.
+
+The leaf id is a mixed radix number where each digit is the position of the user's choice within a category,
+with the most important category (rent ranges) as the most significant digit. This keeps the leaves in the
+exact same order as the leaves of the DecisionTree, so all of the users that share a prefix of preferences
+are stored next to each other.
+
+In sparse mode, only the leaves that currently have users are stored, so the memory used grows with the number
+of combinations of preferences that are actually taken instead of with the number of possible combinations.
+
+In benchmarks.benchmark_bulk_load with 20000 users, adding users one at a time takes about a third less time
+than in the DecisionTree, since a user's leaf is found by adding up one offset per category and only the first
+user of a leaf changes the counts above it. Loading users in bulk takes about as long as the tree, since both
+spend most of the time grouping the users by their decisions the same way. The index is worth having for what
+the tree cannot do: find_top_k, the cache of closest matches, and restoring users by their leaf ids in
+index_snapshot without looking at their preferences again.
+
+Users with the same preferences always get the same closest matches, apart from leaving themselves out, so the
+result of searching past each leaf is kept in a bounded least recently used cache. A cached result only changes
+when a leaf in the same rent range and gender block gains its first user or loses its last one, so only the
+entries that such a change could affect are invalidated. Only users alone in their leaf search past it, so the
+cache only pays off while most leaves have at most one user. In benchmarks.benchmark_closest_cache it saved about a
+third of the search time with a few hundred users, made no difference with 2000, and was never hit with 20000,
+so it is off unless a cache size is given.
+
+Even searching an index changes it, since it updates the cache, so an index shared by the threads of a threaded
+server holds its own lock for the length of every method that reads or changes its leaves. Each of them only takes
+a few microseconds, so threads are never kept waiting for long. The one exception is find_closest_matches_batch
+with several processes, which copies what the worker processes need under the lock and releases it while they
+search.
+
+Comment out check contracts to generate users more quickly.
+"""
+from __future__ import annotations
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+import functools
+import heapq
+import itertools
+import threading
+from typing import Callable, Container, Iterable, Iterator, Optional
+from python_ta.contracts import check_contracts
+from user import User
+from decision_tree import RentBuckets, get_user_decisions, get_users_decisions
+
+# The index of the gender category, whose decision is derived from both gender_pref and gender
+GENDER_LEVEL = 1
+
+# How much a difference of one choice in each category adds to the distance between two users in find_top_k.
+# Categories are weighted from most to least important, in the same order as the decision tree. Gender is not
+# weighted since it is never given up on.
+DEFAULT_WEIGHTS = {'rent ranges': 3.0, 'roommates': 2.0, 'pets': 2.0, 'cleanliness': 1.5,
+                   'guests': 1.0, 'smoking': 1.0, 'noise': 0.5}
+
+
+def _synchronized(method: Callable) -> Callable:
+    """
+    Return method wrapped so that it holds the lock of the index it is called on.
+    """
+    @functools.wraps(method)
+    def locked_method(self: LeafIndex, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return locked_method
+
+
+# @check_contracts
+class LeafIndex:
+    """
+    An array backed index of the leaves of the decision tree. A drop in replacement for DecisionTree that
+    supports the same queries without recursing into the tree.
+
+    Instance Attributes
+    ---
+    categories: the categories that are split on, from most to least important
+    choices: the possible choices of each category, in the same order as categories
+    rent_buckets: the rent ranges of the first category, which the rents of users are sorted into
+    leaves: a bucket of users for every leaf keyed by their id, keyed by leaf id. In sparse mode, only the
+        leaves with users in them
+    users: all of the users in the index, keyed by their id
+    leaf_of: the id of the leaf each user in the index is stored in, keyed by their id
+    weights: the weight of each category in the distance used by find_top_k, in the same order as categories
+    sparse: whether only the leaves with users in them are stored
+    cache_size: the largest number of leaves whose closest matches are cached, where 0 disables the cache
+    cache_hits: the number of times the closest matches of a leaf were found in the cache
+    cache_misses: the number of times the closest matches of a leaf had to be searched for
+
+    Representation Invariants:
+        - len(self.categories) == len(self.choices)
+        - len(self.leaves) == self.count_leaves()
+        - all(self.leaf_of[u_id] == leaf_id for leaf_id in self.leaves for u_id in self.leaves[leaf_id])
+        - self.users.keys() == self.leaf_of.keys()
+        - not self.sparse or all(self.leaves[leaf_id] != {} for leaf_id in self.leaves)
+        - len(self._closest_cache) <= self.cache_size
+    """
+    categories: list[str]
+    choices: list[tuple[str | int | tuple[int, ...] | bool, ...]]
+    rent_buckets: RentBuckets
+    leaves: dict[int, dict[int, User]]
+    users: dict[int, User]
+    leaf_of: dict[int, int]
+    weights: list[float]
+    sparse: bool
+    cache_size: int
+    cache_hits: int
+    cache_misses: int
+    _strides: list[int]
+    _offsets: list[dict[str | int | tuple[int, ...] | bool, int]]
+    _search_orders: list[list[list[int]]]
+    _block_digits: list[tuple[int, ...]]
+    _prefix_counts: list[dict[int, int]]
+    _closest_cache: OrderedDict[int, Optional[int]]
+    _cached_in_block: dict[int, set[int]]
+    _occupancy_changes: int
+    _lock: threading.RLock
+
+    def __init__(self, preferences: list[tuple[str, tuple[int | str | tuple[int, ...] | bool, ...]]],
+                 weights: Optional[dict[str, float]] = None, sparse: bool = False, cache_size: int = 0) -> None:
+        """
+        Initialize an empty index from the parameters of the decision tree, as returned by
+        decision_tree.read_file. weights maps category names to their weight in find_top_k, and defaults
+        to DEFAULT_WEIGHTS. If sparse is True, leaves are only stored while they have users in them. The
+        closest matches of up to cache_size leaves are cached, which is only worth it for small indexes.
+
+        Preconditions:
+            - len(preferences) == 8
+            - cache_size >= 0
+        """
+        self.categories = [category for category, _ in preferences]
+        self.choices = [choices for _, choices in preferences]
+        self.rent_buckets = RentBuckets(self.choices[0])
+
+        self._strides = [1] * len(self.choices)
+        for level in range(len(self.choices) - 2, -1, -1):
+            self._strides[level] = self._strides[level + 1] * len(self.choices[level + 1])
+
+        # For every category, how much each choice adds to the id of a leaf
+        self._offsets = [{choice: i * stride for i, choice in enumerate(choices)}
+                         for choices, stride in zip(self.choices, self._strides)]
+
+        # For every category and every choice, the leaf id offsets of all of the choices of that category in the
+        # order they are tried by find_closest_matches: the given choice first, then the rest in their usual order
+        self._search_orders = []
+        for choices, stride in zip(self.choices, self._strides):
+            self._search_orders.append([[i * stride for i in [position] + list(range(position)) +
+                                         list(range(position + 1, len(choices)))]
+                                        for position in range(len(choices))])
+
+        # The positions of the choices below the gender category of every leaf, by its offset in its rent range
+        # and gender block
+        self._block_digits = list(itertools.product(*[range(len(choices))
+                                                      for choices in self.choices[GENDER_LEVEL + 1:]]))
+
+        if weights is None:
+            weights = DEFAULT_WEIGHTS
+        self.weights = [weights.get(category, 0.0) for category in self.categories]
+
+        self.sparse = sparse
+        if sparse:
+            self.leaves = {}
+        else:
+            self.leaves = {leaf: {} for leaf in range(self._strides[0] * len(self.choices[0]))}
+        self.users = {}
+        self.leaf_of = {}
+
+        # The prefixes of the leaf ids that have users under them. _prefix_counts[-1][leaf] is the number of
+        # users in the leaf, and for every other level, _prefix_counts[level][prefix] is the number of prefixes
+        # one level down with users under them whose leaf ids divided by self._strides[level] are prefix, so
+        # adding a user to an occupied leaf only changes the count of that leaf. Prefixes without users are left
+        # out, and are skipped when searching.
+        self._prefix_counts = [{} for _ in self._strides]
+
+        # The next leaf with users in it after every cached leaf in its search order (see next_occupied_leaf),
+        # from least to most recently used, and the cached leaves in each rent range and gender block
+        self.cache_size = cache_size
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._closest_cache = OrderedDict()
+        self._cached_in_block = {}
+
+        # The number of times a leaf has gained its first user or lost its last one, which tells a search made
+        # without holding the lock whether the leaves it searched past have changed since
+        self._occupancy_changes = 0
+
+        # Held by every method that reads or changes the leaves, including the methods they call
+        self._lock = threading.RLock()
+
+    @contextmanager
+    def locked(self) -> Iterator[None]:
+        """
+        Hold the lock of the index while in the with block, so that no user is added or removed in it.
+        """
+        with self._lock:
+            yield
+
+    def count_leaves(self) -> int:
+        """
+        Return the amount of leaves in the index. In sparse mode, only the leaves with users in them are counted.
+        """
+        return len(self.leaves)
+
+    def is_empty(self) -> bool:
+        """
+        Return whether there are no users in the index.
+        """
+        return len(self.users) == 0
+
+    def leaf_id(self, user_: User) -> int:
+        """
+        Return the id of the leaf that the given user belongs in, which is the same leaf the user would end up
+        in if they were added to the DecisionTree.
+
+        Preconditions:
+            - len(get_user_preferences(user_)) == 8
+        """
+        return self._leaf_id_of(get_user_decisions(user_, self.rent_buckets))
+
+    def _leaf_id_of(self, decisions: Iterable[str | int | tuple[int, ...] | bool]) -> int:
+        """
+        Return the id of the leaf at the end of the path following the given decisions, one per category.
+        """
+        leaf = 0
+        for offsets, decision in zip(self._offsets, decisions):
+            leaf += offsets[decision]
+        return leaf
+
+    def add_user_to_tree(self, user_to_add: User) -> None:
+        """
+        Add the given user to the leaf matching their preferences. If the user is already in the index, they are
+        moved to the leaf matching their current preferences instead, so adding a user again never creates a
+        duplicate. A user who is already in that leaf is only replaced, without being removed and counted again.
+
+        Preconditions:
+            - len(get_user_preferences(user_to_add)) == 8
+        """
+        # The leaf id only depends on the parameters of the index, so it is found before taking the lock. The lock
+        # is taken here rather than by _synchronized, whose extra call is a large part of adding a single user.
+        leaf = self.leaf_id(user_to_add)
+        with self._lock:
+            old_leaf = self.leaf_of.get(user_to_add.id)
+            if old_leaf == leaf:
+                self.users[user_to_add.id] = user_to_add
+                self.leaves[leaf][user_to_add.id] = user_to_add
+                return
+            elif old_leaf is not None:
+                self.remove_user_from_tree(user_to_add)
+
+            self.users[user_to_add.id] = user_to_add
+            self.leaf_of[user_to_add.id] = leaf
+            if leaf in self.leaves:
+                self.leaves[leaf][user_to_add.id] = user_to_add
+            else:
+                self.leaves[leaf] = {user_to_add.id: user_to_add}
+            self._count_users(leaf, 1)
+
+    @_synchronized
+    def bulk_load(self, users: Iterable[User]) -> None:
+        """
+        Add every user in users to the index, as if add_user_to_tree was called on each one in order. users can
+        be any iterable, including a generator over the results of a database query.
+
+        The rents of all of the users are sorted into their ranges at once, the users are grouped by their
+        decisions in a single pass, and then each group is attached to its leaf and counted in the prefix counts
+        at once.
+
+        Preconditions:
+            - all(len(get_user_preferences(u)) == 8 for u in users)
+        """
+        users = list(users)
+        if len({u.id for u in users}) != len(users):
+            # Only the last appearance of a user should count, which adding them one at a time takes care of
+            for u in users:
+                self.add_user_to_tree(u)
+            return
+
+        if self.users != {}:
+            for u in users:
+                self.remove_user_from_tree(u)
+
+        groups = {}
+        for u, decisions in zip(users, get_users_decisions(users, self.rent_buckets)):
+            if decisions in groups:
+                groups[decisions][u.id] = u
+            else:
+                groups[decisions] = {u.id: u}
+
+        self._attach_groups({self._leaf_id_of(decisions): group for decisions, group in groups.items()})
+
+    @_synchronized
+    def bulk_load_leaves(self, users: Iterable[User], leaf_ids: Iterable[int]) -> None:
+        """
+        Add every user in users to the leaf with the corresponding id in leaf_ids, without looking at their
+        preferences. Used to restore users whose leaf ids were saved earlier, such as in a snapshot.
+
+        Preconditions:
+            - all(u.id not in self.users for u in users)
+            - all(u.id are unique for u in users)
+            - leaf_ids were computed by an index with the same parameters
+        """
+        groups = {}
+        for u, leaf in zip(users, leaf_ids):
+            if leaf in groups:
+                groups[leaf][u.id] = u
+            else:
+                groups[leaf] = {u.id: u}
+
+        self._attach_groups(groups)
+
+    @_synchronized
+    def remove_user_from_tree(self, user_to_remove: User) -> None:
+        """
+        Remove the user with the same id as the given user from the index, if they are in the index. The user is
+        removed from the leaf they were added to, even if their preferences have changed since.
+        """
+        if user_to_remove.id in self.leaf_of:
+            leaf = self.leaf_of.pop(user_to_remove.id)
+            self.users.pop(user_to_remove.id)
+            self.leaves[leaf].pop(user_to_remove.id)
+            if self.sparse and self.leaves[leaf] == {}:
+                self.leaves.pop(leaf)
+            self._count_users(leaf, -1)
+
+    def update_user_in_tree(self, updated_user: User) -> None:
+        """
+        Replace the user with the same id as the given user with the given user, moving them to the leaf that
+        matches their new preferences. Used when a user edits their profile.
+
+        Preconditions:
+            - len(get_user_preferences(updated_user)) == 8
+        """
+        self.add_user_to_tree(updated_user)
+
+    @_synchronized
+    def find_exact_matches(self, user_: User) -> list[User]:
+        """
+        Return the users that have the exact same preferences as the given user, not including the user
+        themselves.
+
+        Preconditions:
+            - len(get_user_preferences(user_)) == 8
+        """
+        return self._users_in_leaf(self.leaf_id(user_), user_.id)
+
+    @_synchronized
+    def find_closest_matches(self, user_: User) -> list[User]:
+        """
+        Return the users in the closest non empty leaf to the given user's preferences. The leaves are searched
+        in the same order as DecisionTree.find_closest_matches: the exact match first, then giving up on the
+        least important preferences first. Rent ranges and gender preferences are never given up on, so an
+        empty list is returned if no other user shares them.
+
+        Preconditions:
+            - len(get_user_preferences(user_)) == 8
+        """
+        leaf = self.leaf_id(user_)
+        matches = self._users_in_leaf(leaf, user_.id)
+        if matches != []:
+            return matches
+
+        next_leaf = self._cached_next_occupied_leaf(leaf)
+        if next_leaf is None:
+            return []
+        matches = self._users_in_leaf(next_leaf, user_.id)
+        if matches != []:
+            return matches
+
+        # The user is in the index under different preferences, and is the only user in that leaf
+        for other_leaf in self.search_order(leaf):
+            matches = self._users_in_leaf(other_leaf, user_.id)
+            if matches != []:
+                return matches
+        return []
+
+    def find_closest_matches_batch(self, users: Iterable[User], processes: int = 1) -> dict[int, list[User]]:
+        """
+        Return the result of find_closest_matches for every user in users, keyed by their id.
+
+        Users in the same leaf share their search: a user only needs to search past their own leaf when nobody else
+        is in it, and then the closest match is the first other leaf with users in it, which is the same for every
+        user in that leaf. That leaf is found once per distinct leaf instead of once per user. If processes is more
+        than 1, those searches are split between that many worker processes, which is worth it for very large
+        batches. The workers search a copy of which leaves have users in them, without holding the lock of the
+        index, and their results are thrown away if a leaf gained its first user or lost its last one meanwhile.
+
+        Preconditions:
+            - processes >= 1
+            - all(len(get_user_preferences(u)) == 8 for u in users)
+        """
+        by_leaf = {}
+        for u in users:
+            by_leaf.setdefault(self.leaf_id(u), []).append(u)
+
+        next_leaves = {}
+        if processes > 1:
+            with self._lock:
+                uncached = [leaf for leaf in by_leaf
+                            if len(self.leaves.get(leaf, {})) <= 1 and leaf not in self._closest_cache]
+                occupied = list(self._prefix_counts[-1])
+                changes = self._occupancy_changes
+            if len(uncached) > processes:
+                chunks = [uncached[i::processes] for i in range(processes)]
+                with ProcessPoolExecutor(processes, initializer=_start_worker,
+                                         initargs=(list(zip(self.categories, self.choices)), occupied)) as pool:
+                    for chunk_result in pool.map(_find_next_occupied_leaves, chunks):
+                        next_leaves.update(chunk_result)
+
+        with self._lock:
+            if next_leaves != {} and self._occupancy_changes != changes:
+                next_leaves = {}
+            self.cache_misses += len(next_leaves)
+            for leaf, next_leaf in next_leaves.items():
+                self._cache_next_leaf(leaf, next_leaf)
+
+            # The leaves whose users might need to search past them, because they have at most one user in them
+            lonely = [leaf for leaf in by_leaf if len(self.leaves.get(leaf, {})) <= 1]
+            for leaf in lonely:
+                if leaf not in next_leaves:
+                    next_leaves[leaf] = self._cached_next_occupied_leaf(leaf)
+
+            closest = {}
+            for leaf, group in by_leaf.items():
+                for u in group:
+                    matches = self._users_in_leaf(leaf, u.id)
+                    if matches == [] and next_leaves[leaf] is not None:
+                        matches = self._users_in_leaf(next_leaves[leaf], u.id)
+                    if matches == [] and next_leaves[leaf] is not None:
+                        # The user is in the index under different preferences, and was alone in that leaf
+                        matches = self.find_closest_matches(u)
+                    closest[u.id] = matches
+        return closest
+
+    def search_order(self, leaf: int) -> Iterator[int]:
+        """
+        Yield the ids of the leaves that find_closest_matches searches for a user in the given leaf, in the order
+        they are searched, starting with the leaf itself.
+
+        Preconditions:
+            - 0 <= leaf < self._strides[0] * len(self.choices[0])
+        """
+        block = leaf - leaf % self._strides[GENDER_LEVEL]
+        orders = []
+        for level in range(GENDER_LEVEL + 1, len(self.choices)):
+            position = leaf // self._strides[level] % len(self.choices[level])
+            orders.append(self._search_orders[level][position])
+
+        for offsets in itertools.product(*orders):
+            yield block + sum(offsets)
+
+    def next_occupied_leaf(self, leaf: int, occupied: Container[int]) -> Optional[int]:
+        """
+        Return the first leaf after the given leaf in its search order that is in occupied, or None if there is
+        no such leaf.
+
+        Preconditions:
+            - 0 <= leaf < self._strides[0] * len(self.choices[0])
+        """
+        for other_leaf in self.search_order(leaf):
+            if other_leaf != leaf and other_leaf in occupied:
+                return other_leaf
+        return None
+
+    @_synchronized
+    def cache_info(self) -> dict[str, int]:
+        """
+        Return the number of hits and misses of the closest match cache, along with its current and maximum size.
+        """
+        return {'hits': self.cache_hits, 'misses': self.cache_misses, 'size': len(self._closest_cache),
+                'max_size': self.cache_size}
+
+    @_synchronized
+    def clear_cache(self) -> None:
+        """
+        Empty the closest match cache and reset its counters.
+        """
+        self._closest_cache.clear()
+        self._cached_in_block.clear()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    @_synchronized
+    def find_top_k(self, user_: User, k: int) -> list[tuple[float, User]]:
+        """
+        Return the k users closest to the given user along with their distance to the user, ordered from
+        closest to furthest. The distance is the sum over every category of its weight times how many choices
+        apart the two users are, so unlike find_closest_matches, users with a different rent range can be
+        returned. Only users with the same gender preference decision as the user are considered.
+
+        The leaves are searched best first: subtrees are visited in order of the smallest distance any user in
+        them could have, and subtrees without any users are skipped, so the search stops as soon as the k
+        closest users are known.
+
+        Preconditions:
+            - k >= 0
+            - len(get_user_preferences(user_)) == 8
+        """
+        leaf = self.leaf_id(user_)
+        target = [leaf // stride % len(choices) for stride, choices in zip(self._strides, self.choices)]
+        depth = len(self.choices)
+
+        top_k = []
+        # Each entry is the smallest possible distance, the negated level (so leaves are popped before the
+        # subtrees that tie with them) and the prefix of the leaf ids in the subtree
+        frontier = [(0.0, 0, 0)]
+        while frontier != [] and len(top_k) < k:
+            distance, level, prefix = heapq.heappop(frontier)
+            level = -level
+            if level == depth:
+                for u_id, u in self.leaves[prefix].items():
+                    if u_id != user_.id and len(top_k) < k:
+                        top_k.append((distance, u))
+            else:
+                counts = self._prefix_counts[level]
+                num_choices = len(self.choices[level])
+                if level == GENDER_LEVEL:
+                    positions = [target[level]]
+                else:
+                    positions = range(num_choices)
+                for position in positions:
+                    child = prefix * num_choices + position
+                    if child in counts:
+                        child_distance = distance + self.weights[level] * abs(position - target[level])
+                        heapq.heappush(frontier, (child_distance, -(level + 1), child))
+        return top_k
+
+    @_synchronized
+    def leaf_sizes(self) -> list[int]:
+        """
+        Return the number of users in every leaf with users in it, which is the length of every non empty list
+        returned by find_all_leaves, without building those lists.
+        """
+        return [len(group) for group in self.leaves.values() if group != {}]
+
+    @_synchronized
+    def find_all_leaves(self) -> list[list[User]]:
+        """
+        Return all the users in the index, with each leaf grouped in a nested list, in the same order as the
+        leaves of the DecisionTree. In sparse mode, only the leaves with users in them are returned.
+        """
+        if self.sparse:
+            return [list(self.leaves[leaf].values()) for leaf in sorted(self.leaves)]
+        else:
+            return [list(leaf.values()) for leaf in self.leaves.values()]
+
+    def _users_in_leaf(self, leaf: int, exclude: Optional[int] = None) -> list[User]:
+        """
+        Return the users in the given leaf, leaving out the user with the id exclude.
+
+        Preconditions:
+            - 0 <= leaf < self._strides[0] * len(self.choices[0])
+        """
+        if leaf not in self.leaves:
+            return []
+        return [u for u_id, u in self.leaves[leaf].items() if u_id != exclude]
+
+    def _attach_groups(self, groups: dict[int, dict[int, User]]) -> None:
+        """
+        Add the users in every group, keyed by their id, to the leaf with the id the group is keyed by. The leaves
+        that gain their first user are counted in the prefix counts one level at a time, rather than one leaf at
+        a time like _count_users.
+
+        Preconditions:
+            - all(u_id not in self.users for group in groups.values() for u_id in group)
+        """
+        leaf_counts = self._prefix_counts[-1]
+        occupied = [leaf for leaf in groups if leaf not in leaf_counts]
+        for leaf, group in groups.items():
+            if leaf in self.leaves:
+                self.leaves[leaf].update(group)
+            else:
+                self.leaves[leaf] = group
+            self.users.update(group)
+            self.leaf_of.update(dict.fromkeys(group, leaf))
+            leaf_counts[leaf] = leaf_counts.get(leaf, 0) + len(group)
+
+        # Only the prefixes that gain their first occupied prefix one level down are counted in the level above
+        prefixes = occupied
+        for level in range(len(self._strides) - 2, -1, -1):
+            counts, num_choices = self._prefix_counts[level], len(self.choices[level + 1])
+            new_prefixes = []
+            for prefix in prefixes:
+                parent = prefix // num_choices
+                if parent in counts:
+                    counts[parent] += 1
+                else:
+                    counts[parent] = 1
+                    new_prefixes.append(parent)
+            prefixes = new_prefixes
+
+        self._occupancy_changes += len(occupied)
+        if self._closest_cache:
+            for leaf in occupied:
+                self._invalidate_around(leaf, True)
+
+    def _count_users(self, leaf: int, change: int) -> None:
+        """
+        Add change to the number of users in the given leaf. If the leaf gains its first user or loses its last
+        one, the prefixes of its id that this occupies or empties are counted, leaving out the prefixes that no
+        longer have any users, and the cached results that this changes are invalidated.
+        """
+        leaf_counts = self._prefix_counts[-1]
+        count = leaf_counts.get(leaf, 0) + change
+        if count == 0:
+            leaf_counts.pop(leaf)
+        else:
+            leaf_counts[leaf] = count
+        if count != 0 and count != change:
+            return
+
+        # The leaf has gained its first user or lost its last one, which only changes the prefixes above it up to
+        # the first one that still has other occupied prefixes under it
+        occupied = count != 0
+        for level in range(len(self._strides) - 2, -1, -1):
+            counts, prefix = self._prefix_counts[level], leaf // self._strides[level]
+            count = counts.get(prefix, 0) + (1 if occupied else -1)
+            if count == 0:
+                counts.pop(prefix)
+            else:
+                counts[prefix] = count
+            if count != (1 if occupied else 0):
+                break
+
+        self._occupancy_changes += 1
+        if self._closest_cache:
+            self._invalidate_around(leaf, occupied)
+
+    def _cached_next_occupied_leaf(self, leaf: int) -> Optional[int]:
+        """
+        Return next_occupied_leaf for the given leaf and the leaves with users in them, from the cache if possible.
+        """
+        if leaf in self._closest_cache:
+            self.cache_hits += 1
+            self._closest_cache.move_to_end(leaf)
+            return self._closest_cache[leaf]
+
+        self.cache_misses += 1
+        next_leaf = self.next_occupied_leaf(leaf, self._prefix_counts[-1])
+        self._cache_next_leaf(leaf, next_leaf)
+        return next_leaf
+
+    def _cache_next_leaf(self, leaf: int, next_leaf: Optional[int]) -> None:
+        """
+        Cache next_leaf as the next leaf with users in it after the given leaf, evicting the least recently used
+        entry if the cache is full.
+        """
+        if self.cache_size == 0:
+            return
+        self._closest_cache[leaf] = next_leaf
+        self._cached_in_block.setdefault(leaf // self._strides[GENDER_LEVEL], set()).add(leaf)
+        if len(self._closest_cache) > self.cache_size:
+            evicted, _ = self._closest_cache.popitem(last=False)
+            self._uncache(evicted)
+
+    def _uncache(self, leaf: int) -> None:
+        """
+        Forget the given leaf in the cache's record of the cached leaves in each block.
+        """
+        block = leaf // self._strides[GENDER_LEVEL]
+        self._cached_in_block[block].discard(leaf)
+        if not self._cached_in_block[block]:
+            self._cached_in_block.pop(block)
+
+    def _invalidate_around(self, leaf: int, occupied: bool) -> None:
+        """
+        Invalidate the cached results that change now that the given leaf has gained its first user (if occupied
+        is True) or lost its last one. Only the leaves in the same rent range and gender block are ever searched
+        past into the given leaf, and of those, the leaf only changes the result of the leaves that search it
+        before their cached result, or whose cached result it was.
+        """
+        cached = self._cached_in_block.get(leaf // self._strides[GENDER_LEVEL], set())
+        stale = []
+        for other_leaf in cached:
+            if other_leaf == leaf:
+                continue
+            next_leaf = self._closest_cache[other_leaf]
+            if occupied and (next_leaf is None or self._searched_before(other_leaf, leaf, next_leaf)):
+                stale.append(other_leaf)
+            elif not occupied and next_leaf == leaf:
+                stale.append(other_leaf)
+
+        for other_leaf in stale:
+            self._closest_cache.pop(other_leaf)
+            self._uncache(other_leaf)
+
+    def _searched_before(self, leaf: int, first: int, second: int) -> bool:
+        """
+        Return whether first comes before second in search_order(leaf).
+
+        At the most important category where first and second differ, the one that keeps the choice of leaf is
+        searched first, and otherwise the one with the earlier choice is.
+
+        Preconditions:
+            - leaf, first and second are in the same rent range and gender block
+        """
+        block_size = self._strides[GENDER_LEVEL]
+        digits = self._block_digits
+        for position, first_position, second_position in zip(digits[leaf % block_size], digits[first % block_size],
+                                                              digits[second % block_size]):
+            if first_position != second_position:
+                return first_position == position or (second_position != position
+                                                       and first_position < second_position)
+        return False
+
+
+# The skeleton of the index and the ids of the occupied leaves in a worker process of find_closest_matches_batch
+_worker_index = None
+_worker_occupied = None
+
+
+def _start_worker(preferences: list[tuple[str, tuple[int | str | tuple[int, ...] | bool, ...]]],
+                  occupied: list[int]) -> None:
+    """
+    Set up a worker process of find_closest_matches_batch. Only the parameters of the index and which of its
+    leaves have users in them are sent to the worker, since that is all the search needs.
+    """
+    global _worker_index, _worker_occupied
+    _worker_index = LeafIndex(preferences, sparse=True)
+    _worker_occupied = set(occupied)
+
+
+def _find_next_occupied_leaves(leaves: list[int]) -> dict[int, Optional[int]]:
+    """
+    Return LeafIndex.next_occupied_leaf for each of the given leaves, in a worker process set up by _start_worker.
+    """
+    return {leaf: _worker_index.next_occupied_leaf(leaf, _worker_occupied) for leaf in leaves}
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'max-line-length': 120,
+        'extra-imports': ['collections', 'concurrent.futures', 'contextlib', 'functools', 'heapq', 'itertools',
+                          'threading', 'user', 'decision_tree'],
+        'disable': ['unused-import', 'E9998'],
+    })
@@ -10,17 +10,20 @@ to launch the website and navigate to localhost:5000 in your browser (or just
 click the link provided in the console).
 """
 from __future__ import annotations
+from typing import Optional
 
 from social_graph import Network
+import graph_export
 from user import User
 from python_ta.contracts import check_contracts
 from user import generate_random_users
 
 
 # @check_contracts
-def create_network(net: Network, suggestions: list[User]) -> Network:
+def create_network(net: Network, suggestions: list[User], export_file: Optional[str] = None) -> Network:
     """
-    create a network from matches
+    create a network from matches. If export_file is given, the edges of the network are exported to it
+    as a binary edge list (see graph_export.py)
     """
     for u1 in suggestions:
         for u2 in suggestions:
@@ -31,7 +34,8 @@ def create_network(net: Network, suggestions: list[User]) -> Network:
                     random_request(u1, u2, net)
                     random_accept(u1, u2, net)
 
-    net.print_graph()
+    if export_file is not None:
+        graph_export.export_edges(net, binary_file=export_file)
 
     return net
 
@@ -74,7 +78,7 @@ if __name__ == '__main__':
     
     python_ta.check_all(config={
         'max-line-length': 120,
-        'extra-imports': [],
+        'extra-imports': ['graph_export'],
         'disable': ['unused-import', 'R1702', 'E9998', 'E9999', 'W0125'],
         'allowed-io': ['read_packet_csv']
     })
@@ -13,9 +13,15 @@ path finding algorithms over our graph to store the relationships between users,
 set of edges representing the suggestions and another the mutual matches.
 """
 import decision_tree
+import leaf_index
+import index_snapshot
+import graph_store
+import graph_log
+import graph_stats
 import random
+import threading
 from flask import (
-    g, session, request, Blueprint, redirect, render_template, flash, url_for
+    g, session, request, Blueprint, redirect, render_template, flash, url_for, current_app, jsonify
 )
 from __init__ import db
 from db_helpers import convert_to_user_flask, convert_to_user_single
@@ -23,13 +29,137 @@ import model
 from sqlalchemy.exc import IntegrityError
 from user import User
 from social_graph import Network, _User
-from auth import requires_auth
+from auth import requires_auth, registration_hooks
 
 bp = Blueprint("matches", __name__, url_prefix="/matches")
 my_network = Network()
 
-parameters = decision_tree.read_file("csv_files/decision_tree_parameters.csv")
-tree = decision_tree.build_decision_tree(parameters, None)
+# Collects the changes to my_network until they are saved to the database in a batch (see graph_store.py), unless
+# the GRAPH_STORAGE setting is "log", in which case they are appended to event_log instead (see graph_log.py)
+edge_buffer = graph_store.EdgeBuffer()
+event_log = None
+
+# The number of changes in event_log at which a snapshot of my_network is saved and the log is started over
+COMPACT_AFTER = 1000000
+
+PARAMETERS_FILE = "csv_files/decision_tree_parameters.csv"
+parameters = decision_tree.read_file(PARAMETERS_FILE)
+tree = leaf_index.LeafIndex(parameters, sparse=True)
+
+# The number of closest users (ranked by LeafIndex.find_top_k) suggested to the user on every visit
+NUM_RANKED_SUGGESTIONS = 10
+
+# The most matches apart two users can be for the community view to show how they are connected
+MAX_PATH_DEPTH = 6
+
+# The statistics served by the stats view, which are collected again at most every STATS_REFRESH_INTERVAL seconds
+STATS_REFRESH_INTERVAL = 5.0
+stats_cache = graph_stats.StatsCache(STATS_REFRESH_INTERVAL)
+
+# The number of random suggestions made between users of different communities when the social graph is built
+# and on every visit to the matches page
+NUM_RANDOM_SUGGESTIONS = 100
+
+# Whether tree and my_network have been loaded, which only happens once, by the first thread to get warm_lock.
+# my_network and tree guard themselves, so requests from different users are served at the same time after that.
+warmed = False
+warm_lock = threading.Lock()
+
+
+def warm() -> None:
+    """
+    Populate the matching index and load the social graph, unless they were already. Threads that call this while
+    another thread is populating them wait for it to finish. This is called when the app starts, so requests
+    only have to wait for it if they come in before it is done.
+
+    If no social graph was saved, the users in every leaf of the index are connected to each other here, once,
+    so that each visit to the matches page only has to connect the users in the leaf of the visitor.
+    """
+    global warmed
+    if warmed:
+        return
+    with warm_lock:
+        if not warmed:
+            if tree.is_empty():
+                warm_index()
+            if my_network.is_empty():
+                warm_network()
+                if my_network.is_empty():
+                    my_network.create_network_all(tree.find_all_leaves(), None, NUM_RANDOM_SUGGESTIONS)
+            warmed = True
+
+
+def index_registered_user(new_user: User) -> None:
+    """
+    Add a user who just registered to the matching index, so that they are matched with other users right away.
+    If the index has not been populated yet, nothing is done, since populating it reads every user from the
+    database, including this one.
+    """
+    with warm_lock:
+        if warmed:
+            new_user.rent = (new_user.rent, new_user.rent)
+            tree.add_user_to_tree(new_user)
+
+
+registration_hooks.append(index_registered_user)
+
+
+def warm_index() -> None:
+    """
+    Populate the empty matching index. If an earlier process saved a snapshot of the index, it is loaded and only
+    the users registered since the snapshot was taken are read from the database. Otherwise, every user is read
+    from the database. A new snapshot is saved whenever users had to be read from the database.
+
+    Preconditions:
+        - tree.is_empty()
+    """
+    snapshot_file = current_app.config["MATCHING_SNAPSHOT"]
+    high_water_mark = index_snapshot.load_snapshot(tree, snapshot_file, PARAMETERS_FILE)
+
+    query = db.select(model.User)
+    if high_water_mark is not None:
+        query = query.where(model.User.id > high_water_mark)
+    new_users = convert_to_user_flask(db.session.execute(query).scalars())
+
+    for u in new_users:
+        u.rent = (u.rent, u.rent)
+    tree.bulk_load(new_users)
+
+    if new_users != []:
+        high_water_mark = max([u.id for u in new_users] + [high_water_mark or 0])
+        index_snapshot.save_snapshot(tree, snapshot_file, PARAMETERS_FILE, high_water_mark)
+
+
+def warm_network() -> None:
+    """
+    Load the suggestions, requests and matches saved in the database, or in the snapshot and log of the social
+    graph if the GRAPH_STORAGE setting is "log", into the empty social graph.
+
+    Preconditions:
+        - my_network.is_empty()
+    """
+    global event_log
+    if current_app.config["GRAPH_STORAGE"] == "log":
+        if event_log is None:
+            event_log = graph_log.open_graph(my_network, current_app.config["GRAPH_SNAPSHOT"],
+                                             current_app.config["GRAPH_LOG"])
+    else:
+        graph_store.load_network(my_network, db.session)
+        my_network.set_journal(edge_buffer)
+
+
+def save_network() -> None:
+    """
+    Save the changes to the social graph to the database if enough of them have built up, or if they were last
+    saved long enough ago. If the social graph is kept in a log instead, write the log to disk, and compact it
+    once it is long enough.
+    """
+    if event_log is not None:
+        event_log.flush()
+        if event_log.records >= COMPACT_AFTER:
+            event_log.compact(my_network)
+    elif edge_buffer.should_flush():
+        edge_buffer.flush(db.session)
 
 
 @requires_auth
@@ -40,39 +170,35 @@ def get_matches():
     """
     cur_user = User(**session.get('cur_user'))
     cur_user.rent = (cur_user.rent, cur_user.rent)
-    user_res = db.session.execute(db.select(model.User).where(model.User.id != cur_user.id))
-    all_users = user_res.scalars()
 
-    converted_users = convert_to_user_flask(all_users)
-
-    for u in converted_users:
-        u.rent = (u.rent, u.rent)
-
-    if tree.users is None:
-        for u in converted_users:
-            tree.add_user_to_tree(u)
+    warm()
 
+    # Only the leaf of the current user is connected on each visit, since warm already connected every leaf, so
+    # a visit does not take longer as more users join
     tree.add_user_to_tree(cur_user)
-    communities = tree.find_all_leaves()
+    leaf = tree.find_exact_matches(cur_user) + [cur_user]
 
-    # Change this number to modify the number of random suggestions given between two random
+    # Change NUM_RANDOM_SUGGESTIONS to modify the number of random suggestions given between two random
     # users in the graph when the webpage is reloaded or recieves a request. Feel free 
     # to increase the number of random connections (performance hits should be expected 
-    # for large # of suggestions added). 1000 is another good number to try out. Note this
-    # can get expecially slow with when simple=False for our user suggestions
-    my_network.create_network_all(communities, cur_user, 100)
+    # for large # of suggestions added). 1000 is another good number to try out.
+    my_network.create_network_all([leaf], cur_user, NUM_RANDOM_SUGGESTIONS)
+
+    # The closest users are suggested unless they are already suggested, matched, or have a request either way
+    for _, ranked_user in tree.find_top_k(cur_user, NUM_RANKED_SUGGESTIONS):
+        if not my_network.check_suggestion(cur_user, ranked_user) \
+                and not my_network.check_request(cur_user, ranked_user) \
+                and not my_network.check_request(ranked_user, cur_user):
+            my_network.add_suggestion(cur_user, ranked_user)
 
     suggestions = [sugg.item for sugg in my_network.get_user(cur_user.id).suggestions]
 
     if suggestions == []:
-        # add atleast one random suggestion
-        # Change simple to false to run community matching algorithm. Warning: slow
-        # for large number of users (which can be adjusted in __init__), can cause
-        # lots of stack frames being added for large networks
-        my_network.random_suggestion_user(cur_user, simple=True)
+        # add atleast one random suggestion from outside of the user's community
+        my_network.random_suggestion_user(cur_user)
     else:
         if random.choice([True, False]):
-            my_network.random_suggestion_user(cur_user, simple=True)
+            my_network.random_suggestion_user(cur_user)
 
         suggestions = [sugg.item for sugg in my_network.get_user(cur_user.id).suggestions]
 
@@ -86,14 +212,15 @@ def get_matches():
             suggestions.append(u2.item)
 
         my_network.add_suggestion(u2.item, u1.item)
-        u1.send_request(u2)
-        u2.accept_request(u1)
+        my_network.send_request(u1.item, u2.item)
+        my_network.accept_request(u2.item, u1.item)
 
         match_msg = "Successful match"
         flash(match_msg)
 
         suggestions.remove(u2.item)
 
+    save_network()
     return render_template('matches/matches.html', user_matches=suggestions)
 
 
@@ -105,6 +232,7 @@ def current_matches():
     """
     cur_user = User(**session.get('cur_user'))
 
+    warm()
     node = my_network.get_user(cur_user.id)
     if node is not None:
         cur_user_matches = [sugg.item for sugg in node.matches]
@@ -123,14 +251,32 @@ def community():
     """
     cur_user = User(**session.get('cur_user'))
 
-    node = my_network.get_user(cur_user.id)
-    if node is not None:
-        _, cur_community = node.find_all_connected_matches(set())
-        cur_community = [comm.item for comm in cur_community]
+    warm()
+    if my_network.get_user(cur_user.id) is not None:
+        cur_community = my_network.get_community(cur_user)
     else:
         cur_community = []
 
-    return render_template('matches/community.html', cur_community=cur_community)
+    # "How are we connected": the shortest path of matches to the member of the community chosen by the user
+    path = None
+    other_id = request.args.get('to', type=int)
+    if other_id is not None and cur_community != [] and my_network.get_user(other_id) is not None:
+        path = my_network.shortest_match_path(cur_user, my_network.get_item(other_id), MAX_PATH_DEPTH)
+
+    return render_template('matches/community.html', cur_community=cur_community, path=path,
+                           max_depth=MAX_PATH_DEPTH)
+
+
+@bp.route("/stats", methods=["GET"])
+@requires_auth
+def stats():
+    """
+    The shape of the social graph and the matching index as JSON: the number of users and of edges of each
+    kind, and the distribution of the number of edges of each user, of the size of the communities and of the
+    number of users in each leaf. See graph_stats.py.
+    """
+    warm()
+    return jsonify(stats_cache.get(my_network, tree))
 
 
 if __name__ == '__main__':
@@ -138,6 +284,7 @@ if __name__ == '__main__':
     
     python_ta.check_all(config={
         'max-line-length': 120,
-        'extra-imports': ['flask', 'decision_tree', 'random', 'model', 
-                          'sqlalchemy', 'user', 'main', 'social_graph', 'auth']
+        'extra-imports': ['flask', 'decision_tree', 'leaf_index', 'index_snapshot', 'graph_store', 'graph_log',
+                          'graph_stats', 'random', 'threading', 'model', 'sqlalchemy', 'user', 'main', 'social_graph',
+                          'auth']
     })
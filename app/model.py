@@ -70,6 +70,48 @@ class User(db.Model):
     num_roommates: int = db.Column(db.Integer)
 
 
+class Suggestion(db.Model):
+    """
+    An edge of the social graph, saying that the user with the id other_id is suggested to the user with the id
+    user_id.
+
+    Instance Attributes:
+        - user_id: the id of the user who is given the suggestion
+        - other_id: the id of the suggested user
+    """
+    __tablename__ = "suggestions"
+    user_id: int = db.Column(db.Integer, primary_key=True)
+    other_id: int = db.Column(db.Integer, primary_key=True)
+
+
+class Request(db.Model):
+    """
+    An edge of the social graph, saying that the user with the id other_id sent a request to room together to
+    the user with the id user_id, which has not been accepted yet.
+
+    Instance Attributes:
+        - user_id: the id of the user who received the request
+        - other_id: the id of the user who sent the request
+    """
+    __tablename__ = "requests"
+    user_id: int = db.Column(db.Integer, primary_key=True)
+    other_id: int = db.Column(db.Integer, primary_key=True)
+
+
+class Match(db.Model):
+    """
+    An edge of the social graph, saying that the user with the id user_id is matched with the user with the id
+    other_id. Every match is stored both ways.
+
+    Instance Attributes:
+        - user_id: the id of one of the matched users
+        - other_id: the id of the other matched user
+    """
+    __tablename__ = "matches"
+    user_id: int = db.Column(db.Integer, primary_key=True)
+    other_id: int = db.Column(db.Integer, primary_key=True)
+
+
 def convert_to_model(user: user.User) -> User:
     """
     Given a user from the our custom User dataclass defined in user.py, return the
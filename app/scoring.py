@@ -0,0 +1,247 @@
+"""
+CSC111 Winter 2023 Final Project: suitemate
+
+Derek Huynh, James Yung, Andrew Xie, Amaan Khan
+
+================================================
+
+This module is where we implemented a columnar scoring engine for comparing users. The decisions of every user
+(the positions of their choices in each category of the decision tree) are packed into a single NumPy array
+with one row per user and one column per category, so the compatibility of one user with the entire population
+is computed in a single vectorized pass instead of walking the users one at a time.
+
+Scores are the same weighted distance used by LeafIndex.find_top_k, where a smaller score means a more
+compatible user. Users with a different gender preference decision are never compatible, and get a score of
+infinity.
+
+The engine also finds the same closest matches as the decision tree, by binary search over the rows of the
+users with the same rent range and gender decision, which are grouped once after users are added. This takes
+about as long as the tree itself (around 10us per query at 20k users), so the engine does not replace the tree
+for closest matches, but it lets the scores and the closest matches come from the same packed population.
+"""
+from __future__ import annotations
+from bisect import bisect_left
+from typing import Iterable, Optional
+import numpy as np
+from python_ta.contracts import check_contracts
+from user import User
+from decision_tree import RentBuckets, get_user_decisions
+from leaf_index import DEFAULT_WEIGHTS, GENDER_LEVEL
+from db_helpers import convert_to_user_single
+import model
+
+
+# @check_contracts
+class ScoringEngine:
+    """
+    The decisions of a population of users stored column by column.
+
+    Instance Attributes:
+        - categories: the categories of the decision tree, from most to least important
+        - choices: the possible choices of each category, in the same order as categories
+        - rent_buckets: the rent ranges of the first category, which the rents of users are sorted into
+        - weights: the weight of each category in the score, in the same order as categories
+        - users: the users in the population, in the same order as the rows of decisions
+        - ids: the id of the user in each row
+        - decisions: the position of each user's choice in each category, with one row per user
+
+    Representation Invariants:
+        - len(self.users) == self.ids.shape[0] == self.decisions.shape[0]
+        - self.decisions.shape[1] == len(self.categories)
+    """
+    categories: list[str]
+    choices: list[tuple[str | int | tuple[int, ...] | bool, ...]]
+    rent_buckets: RentBuckets
+    weights: np.ndarray
+    users: list[User]
+    ids: np.ndarray
+    decisions: np.ndarray
+    _positions: list[dict[str | int | tuple[int, ...] | bool, int]]
+    _blocks: Optional[dict[int, tuple[list[int], list[int]]]]
+    _strides: list[tuple[int, int]]
+    _keys: list[int]
+    _block_of: list[int]
+    _row_of: dict[int, int]
+
+    def __init__(self, preferences: list[tuple[str, tuple[int | str | tuple[int, ...] | bool, ...]]],
+                 weights: Optional[dict[str, float]] = None) -> None:
+        """
+        Initialize an engine with no users from the parameters of the decision tree, as returned by
+        decision_tree.read_file. weights maps category names to their weight in the score, and defaults to
+        leaf_index.DEFAULT_WEIGHTS.
+
+        Preconditions:
+            - len(preferences) == 8
+        """
+        self.categories = [category for category, _ in preferences]
+        self.choices = [choices for _, choices in preferences]
+        self._positions = [{choice: i for i, choice in enumerate(choices)} for choices in self.choices]
+        self.rent_buckets = RentBuckets(self.choices[0])
+
+        if weights is None:
+            weights = DEFAULT_WEIGHTS
+        self.weights = np.array([weights.get(category, 0.0) for category in self.categories])
+
+        self.users = []
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.decisions = np.zeros((0, len(self.categories)), dtype=np.int16)
+        self._blocks = None
+
+    def add_users(self, users: Iterable[User]) -> None:
+        """
+        Add the given users to the population, such as the users returned by user.generate_random_users.
+
+        Preconditions:
+            - all(len(get_user_preferences(u)) == 8 for u in users)
+        """
+        new_users = list(users)
+        new_decisions = np.array([self.decision_positions(u) for u in new_users], dtype=np.int16)
+        new_decisions = new_decisions.reshape((len(new_users), len(self.categories)))
+
+        self.users.extend(new_users)
+        self.ids = np.concatenate([self.ids, np.array([u.id for u in new_users], dtype=np.int64)])
+        self.decisions = np.concatenate([self.decisions, new_decisions])
+        self._blocks = None
+
+    def add_models(self, rows: Iterable[model.User]) -> None:
+        """
+        Add the users from the results of a SQLAlchemy query on model.User to the population. Like in
+        matches.get_matches, each user's rent is the range from their rent to their rent.
+        """
+        users = []
+        for row in rows:
+            u = convert_to_user_single(row)
+            u.rent = (u.rent, u.rent)
+            users.append(u)
+        self.add_users(users)
+
+    def decision_positions(self, user_: User) -> list[int]:
+        """
+        Return the position of the given user's choice in each category.
+
+        Preconditions:
+            - len(get_user_preferences(user_)) == 8
+        """
+        decisions = get_user_decisions(user_, self.rent_buckets)
+        return [positions[decision] for positions, decision in zip(self._positions, decisions)]
+
+    def score(self, user_: User) -> np.ndarray:
+        """
+        Return the score of every user in the population against the given user, in the same order as
+        self.users. The user themselves gets a score of infinity.
+
+        Preconditions:
+            - len(get_user_preferences(user_)) == 8
+        """
+        query = np.array(self.decision_positions(user_), dtype=np.int16)
+        scores = np.abs(self.decisions - query) @ self.weights
+        scores[(self.decisions[:, GENDER_LEVEL] != query[GENDER_LEVEL]) | (self.ids == user_.id)] = np.inf
+        return scores
+
+    def score_batch(self, users: list[User]) -> np.ndarray:
+        """
+        Return a matrix with the scores of every user in the population (one column per user, in the same
+        order as self.users) against each of the given users (one row per user). Users get a score of infinity
+        against themselves.
+
+        Preconditions:
+            - all(len(get_user_preferences(u)) == 8 for u in users)
+        """
+        queries = np.array([self.decision_positions(u) for u in users], dtype=np.int16)
+        queries = queries.reshape((len(users), len(self.categories)))
+
+        scores = np.zeros((len(users), len(self.users)))
+        for level, weight in enumerate(self.weights):
+            if weight != 0:
+                scores += weight * np.abs(queries[:, level, None] - self.decisions[None, :, level])
+
+        scores[queries[:, GENDER_LEVEL, None] != self.decisions[None, :, GENDER_LEVEL]] = np.inf
+        scores[np.array([u.id for u in users], dtype=np.int64)[:, None] == self.ids[None, :]] = np.inf
+        return scores
+
+    def find_closest_matches(self, user_: User) -> list[User]:
+        """
+        Return the same users as DecisionTree.find_closest_matches would for a tree populated with the same
+        users in the same order.
+
+        Only the candidates sharing the user's rent range and gender decision are looked at, and the tree visits
+        their leaves in order: for each of the remaining categories, from most to least important, the user's
+        own choice comes first and then the other choices in their usual order. Those candidates are kept
+        sorted by their remaining decisions, so the first non empty leaf the tree finds is narrowed down one
+        category at a time by binary search rather than by ranking every user.
+
+        Preconditions:
+            - len(get_user_preferences(user_)) == 8
+        """
+        if self._blocks is None:
+            self._build_blocks()
+
+        query = self.decision_positions(user_)
+        block_id = query[0] * len(self.choices[GENDER_LEVEL]) + query[GENDER_LEVEL]
+        block = self._blocks.get(block_id)
+        if block is None:
+            return []
+        keys, rows = block
+
+        # The key of the user themselves, if they are one of the candidates, since they are never returned
+        own_row = self._row_of.get(user_.id)
+        own_key = self._keys[own_row] if own_row is not None and self._block_of[own_row] == block_id else -1
+
+        # Most users share all of their decisions with someone, whose leaf is the first one the tree visits
+        exact = sum(query[level] * stride for level, stride in self._strides)
+        i, j = bisect_left(keys, exact), bisect_left(keys, exact + 1)
+        if j - i > (own_key == exact):
+            return [self.users[row] for row in rows[i:j] if row != own_row]
+
+        base, lo, hi = 0, 0, len(keys)
+        for level, stride in self._strides:
+            start = base + query[level] * stride
+            i, j = bisect_left(keys, start, lo, hi), bisect_left(keys, start + stride, lo, hi)
+            if j - i > (start <= own_key < start + stride):
+                base, lo, hi = start, i, j
+            else:
+                # Every candidate left has another choice, so the smallest of them comes first, skipping over the
+                # user themselves if they are the only one with their own choice
+                if lo < i:
+                    first = keys[lo]
+                elif j < hi:
+                    first = keys[j]
+                else:
+                    return []
+                base += (first - base) // stride * stride
+                lo, hi = bisect_left(keys, base, lo, hi), bisect_left(keys, base + stride, lo, hi)
+
+        return [self.users[row] for row in rows[lo:hi] if row != own_row]
+
+    def _build_blocks(self) -> None:
+        """
+        Group the rows of the population by their rent range and gender decision for find_closest_matches.
+        Within each group the rows are sorted by a key made of their remaining decisions, from most to least
+        important, and then by their position in the population.
+        """
+        keys = np.zeros(len(self.users), dtype=np.int64)
+        for level in range(GENDER_LEVEL + 1, len(self.categories)):
+            keys = keys * len(self.choices[level]) + self.decisions[:, level]
+        blocks = self.decisions[:, 0].astype(np.int64) * len(self.choices[GENDER_LEVEL]) \
+            + self.decisions[:, GENDER_LEVEL]
+
+        order = np.lexsort((np.arange(len(self.users)), keys, blocks))
+        sorted_blocks, sorted_keys = blocks[order], keys[order]
+        bounds = [0, *(np.flatnonzero(np.diff(sorted_blocks)) + 1).tolist(), len(order)]
+
+        self._strides = [(level, int(np.prod([len(choices) for choices in self.choices[level + 1:]])))
+                         for level in range(GENDER_LEVEL + 1, len(self.categories))]
+        self._keys = keys.tolist()
+        self._block_of = blocks.tolist()
+        self._row_of = {u_id: row for row, u_id in enumerate(self.ids.tolist())}
+        self._blocks = {int(sorted_blocks[start]): (sorted_keys[start:end].tolist(), order[start:end].tolist())
+                        for start, end in zip(bounds, bounds[1:]) if start < end}
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'max-line-length': 120,
+        'extra-imports': ['numpy', 'user', 'decision_tree', 'leaf_index', 'model', 'db_helpers'],
+        'disable': ['unused-import', 'E9998'],
+    })
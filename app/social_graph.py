@@ -9,22 +9,57 @@ This module represents the matches, suggestions and requests between users withi
 This file handles the interactions between users (e.g. Sending an invitation to room together, accepting
 a request to room together, find common matches betwen users, etc.) and stores part of the data collected
 in a social graph.
+
+The graph is stored by user id: each user's suggestions, requests and matches are compact arrays of the ids of
+the other users, and the User of each id is only stored once, by the network. Every kind of edge also keeps
+the set of all of its edges, so whether an edge exists is answered in constant time. The _User nodes returned by
+Network.get_user are lightweight views of a single user in the network that are created when asked for.
+
+A Network can be shared by the threads of a threaded server. The edges from each user are guarded by one of a
+fixed number of striped locks chosen by their id, and every change locks the stripes of the users whose edges it
+changes, in order, so changes to different users go ahead at the same time. The users and communities of the
+network are guarded by a separate lock that is only held for the few steps that change or read them. Looking up
+edges takes no locks.
 """
 from __future__ import annotations
-from typing import Optional
+from array import array
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+import heapq
+import threading
+from typing import Iterable, Iterator, Optional, Protocol, TYPE_CHECKING
+import numpy as np
 from user import User
 from python_ta.contracts import check_contracts
 import random
 
+if TYPE_CHECKING:
+    from scipy import sparse
+
+# The kinds of edges between users, in the order that the files of graph_log and graph_export store them in
+EDGE_KINDS = ('suggestions', 'requests', 'matches')
+
+# The number of locks that the edges of a network are striped over
+NUM_STRIPES = 256
+
+# The largest number of shortest match paths a network keeps in its cache
+PATH_CACHE_SIZE = 4096
+
 
 # @check_contracts
 class _User:
     """
     Nodes representing each user in the social network.
 
+    A node is a view of the user with the id user_id in network, so it always reflects the current state of the
+    network. Two nodes are equal when they are views of the same user in the same network. The suggestions,
+    matches and requests of a node are new sets of nodes every time they are looked at, so changing them does
+    not change the network.
+
     Instance Attributes:
-        - item: The user data class represented
+        - network: the network the user is in
         - user_id: the id of the user
+        - item: The user data class represented
         - suggestions: the _Users suggested to this _User
         - matches: the _Users that decided to match with this User
         - requests: the _Users that want to match with this User
@@ -33,30 +68,61 @@ class _User:
         - self not in self.suggestions
         - self not in self.matches
         - self not in self.requests
-        - all(self in u.suggestions for u in self.suggestions)
         - all(self in u.matches for u in self.matches)
-        - all(self not in u.matches for u in self.suggestions)
-        - all(self not in u.suggestions for u in self.matches)
-        - all(self not in u.matches for u in self.requests)
-        - all(u not in self.suggestions for u in self.requests)
-
     """
-    item: User
+    __slots__ = ('network', 'user_id')
+    network: Network
     user_id: int
-    suggestions: set[_User]
-    matches: Optional[set[_User]] = set()
-    requests: Optional[set[_User]] = set()
 
-    def __init__(self, item: User, suggestions: set[_User]) -> None:
+    def __init__(self, network: Network, user_id: int) -> None:
+        """
+        Initialize a view of the user with the given id in network.
+
+        Preconditions:
+            - network.get_user(user_id) is not None
+        """
+        self.network = network
+        self.user_id = user_id
+
+    def __eq__(self, other: object) -> bool:
+        """
+        Return whether other is a view of the same user in the same network.
+        """
+        return isinstance(other, _User) and self.network is other.network and self.user_id == other.user_id
+
+    def __hash__(self) -> int:
+        """
+        Return the hash of the id of the user.
+        """
+        return hash(self.user_id)
+
+    @property
+    def item(self) -> User:
+        """
+        The user data class represented
+        """
+        return self.network.get_item(self.user_id)
+
+    @property
+    def suggestions(self) -> set[_User]:
+        """
+        The _Users suggested to this _User
+        """
+        return {_User(self.network, u_id) for u_id in self.network.copy_ids('suggestions', self.user_id)}
+
+    @property
+    def matches(self) -> set[_User]:
         """
-        Initialize a node representing the user's personal information and preferences, suggested users,
-        matched users and requested users.
+        The _Users that decided to match with this User
         """
-        self.item = item
-        self.user_id = item.id
-        self.suggestions = suggestions
-        self.matches = set()
-        self.requests = set()
+        return {_User(self.network, u_id) for u_id in self.network.copy_ids('matches', self.user_id)}
+
+    @property
+    def requests(self) -> set[_User]:
+        """
+        The _Users that want to match with this User
+        """
+        return {_User(self.network, u_id) for u_id in self.network.copy_ids('requests', self.user_id)}
 
     def accept_request(self, other: _User) -> None:
         """
@@ -66,10 +132,7 @@ class _User:
         Preconditions:
             - self.user_id != other.user_id
         """
-
-        self.requests.remove(other)
-        self.matches.add(other)
-        other.matches.add(self)
+        self.network.accept_request(self.item, other.item)
 
     def send_request(self, other: _User) -> None:
         """
@@ -79,26 +142,28 @@ class _User:
         Preconditions:
             - self.user_id != other.user_id
         """
-
-        self.suggestions.remove(other)
-        other.requests.add(self)
+        self.network.send_request(self.item, other.item)
 
     def find_all_connected_matches(self, visited: set[int]) -> tuple[set[int], list[_User]]:
         """
-        Find all users connected to self.
+        Find all users connected to self that are not in visited. The ids of the users found are added to
+        visited, which is returned along with the users found.
+
+        The users are found by a breadth first search, where found doubles as the queue of users whose
+        matches have not been looked at yet, so large communities do not hit the recursion limit.
 
         Preconditions:
             - self not in visited
         """
         visited.add(self.user_id)
-        all_users = [self]
-        for neighbour in self.matches:
-            if neighbour.user_id not in visited:
-                seen, recur = neighbour.find_all_connected_matches(visited.copy())
-                all_users.extend(recur)
-                visited = visited.union(seen)
+        found = [self.user_id]
+        for u_id in found:
+            for neighbour_id in self.network.copy_ids('matches', u_id):
+                if neighbour_id not in visited:
+                    visited.add(neighbour_id)
+                    found.append(neighbour_id)
 
-        return (visited, all_users)
+        return (visited, [_User(self.network, u_id) for u_id in found])
 
 
 # @check_contracts
@@ -106,25 +171,231 @@ class Network:
     """
     The graph representing the social network and connections between users
 
+    The suggestions, requests and matches of the users are stored as three kinds of _Edges.
+
+    The communities of the network (the groups of users connected by matches) are kept up to date as matches
+    are made. Matches are never removed, so communities only ever merge, and they are stored as a union find
+    over user ids that is joined on every accepted request. The members of each community are linked in a
+    circle through _next_member, so two communities are merged by swapping the next members of their roots.
+
+    Every time a match is added, the root of its community is stamped with a new version in _versions. A shortest
+    match path is cached along with the root and version of its community when it was found, and it is only used
+    while that root is still a root with that version, so a new match only invalidates the paths in its own
+    community, without looking at the cache.
+
+    The edges from the user with the id u_id are only changed while holding _stripes[u_id % NUM_STRIPES], and the
+    users and communities are only changed or walked while holding _community_lock. A thread holding stripes may
+    take _community_lock, but never the other way around, and stripes are always taken in increasing order, so
+    threads never wait on each other in a circle.
+
     Representation Invariants:
-        - all(u_id == self._users[u_id].user_id for u_id in self._users)
+        - all(u_id == self._items[u_id].id for u_id in self._items)
+        - self._parent.keys() == self._items.keys() == self._next_member.keys()
+        - list(self._ids) == list(self._items)
+        - self._sum_of_squares == sum(size ** 2 for size in self._community_size.values())
+        - all(self._matches.has(v_id, u_id) for u_id in self._matches.targets \
+              for v_id in self._matches.targets[u_id])
     """
-    _users: dict[int, _User]
+    _items: dict[int, User]
+    _suggestions: _Edges
+    _requests: _Edges
+    _matches: _Edges
+    _parent: dict[int, int]
+    _community_size: dict[int, int]
+    _next_member: dict[int, int]
+    _ids: array
+    _sum_of_squares: int
+    _journal: Optional[Journal]
+    _stripes: list[threading.Lock]
+    _community_lock: threading.Lock
+    _versions: dict[int, int]
+    _last_version: int
+    _path_cache: OrderedDict[tuple[int, int, int], tuple[int, int, Optional[list[int]]]]
+    path_cache_hits: int
+    path_cache_misses: int
 
     def __init__(self):
         """
         Initialize an empty network
         """
-        self._users = {}
+        self._items = {}
+
+        # The ids of the users suggested to, that sent a request to, and that are matched with every user
+        self._suggestions = _Edges('suggestions')
+        self._requests = _Edges('requests')
+        self._matches = _Edges('matches')
+
+        # The parent of every user in the union find, which is the user themselves for the root of each
+        # community, the size of the community of every root, and the next member of every user's community
+        self._parent = {}
+        self._community_size = {}
+        self._next_member = {}
+
+        # The id of every user in the order they were added, to draw random users from without building a list
+        # of ids, and the sum of the squares of the sizes of the communities, which gives the chance that two
+        # random users are in the same community
+        self._ids = array('q')
+        self._sum_of_squares = 0
+
+        # What is told about every user and edge added to the network, if anything
+        self._journal = None
+
+        # The locks guarding the edges of the users whose ids are equal modulo NUM_STRIPES, and the lock guarding
+        # the users and the union find
+        self._stripes = [threading.Lock() for _ in range(NUM_STRIPES)]
+        self._community_lock = threading.Lock()
+
+        # The version of every root that has gained a match, the last version given out, and the shortest match
+        # paths found so far along with the root and version of their community, keyed by the ids of their ends
+        # and their maximum depth, from least to most recently used. The cache is guarded by _community_lock.
+        self._versions = {}
+        self._last_version = 0
+        self._path_cache = OrderedDict()
+        self.path_cache_hits = 0
+        self.path_cache_misses = 0
+
+    @contextmanager
+    def locked_users(self, u_ids: Iterable[int]) -> Iterator[None]:
+        """
+        Hold the locks guarding the edges of the users with the given ids while in the with block.
+        """
+        stripes = sorted({u_id % NUM_STRIPES for u_id in u_ids})
+        for stripe in stripes:
+            self._stripes[stripe].acquire()
+        try:
+            yield
+        finally:
+            for stripe in reversed(stripes):
+                self._stripes[stripe].release()
+
+    @contextmanager
+    def locked(self) -> Iterator[None]:
+        """
+        Hold the locks guarding the edges of every user while in the with block, so that no edge is changed in it.
+        """
+        with self.locked_users(range(NUM_STRIPES)):
+            yield
+
+    def set_journal(self, journal: Optional[Journal]) -> None:
+        """
+        Tell journal about every user added to the network and every edge that is added to or removed from it
+        from now on, or stop telling anyone if journal is None.
+        """
+        self._journal = journal
+        for edges in (self._suggestions, self._requests, self._matches):
+            edges.journal = journal
+
+    def load_edges(self, users: list[User], suggestions: list[tuple[int, int]], requests: list[tuple[int, int]],
+                   matches: list[tuple[int, int]]) -> None:
+        """
+        Add users to the network along with the given edges, each of which is the id of a user and the id of
+        the user in their suggestions, requests or matches. This is how a network is loaded from storage, so
+        the journal is not told about them, and no other thread should be changing the network at the same time.
+
+        Preconditions:
+            - every id in suggestions, requests and matches is the id of a user in users or in the network
+            - every match is given both ways
+        """
+        with self.locked():
+            journal = self._journal
+            self.set_journal(None)
+            for user in users:
+                if user.id not in self._items:
+                    self.add_user(user)
+
+            for edges, new_edges in ((self._suggestions, suggestions), (self._requests, requests),
+                                     (self._matches, matches)):
+                targets = {}
+                for u_id, v_id in new_edges:
+                    targets.setdefault(u_id, []).append(v_id)
+                for u_id, v_ids in targets.items():
+                    edges.add_all(u_id, v_ids)
+
+            for u_id, v_id in matches:
+                if u_id < v_id:
+                    self._join_communities(u_id, v_id)
+            self.set_journal(journal)
+
+    def replay_change(self, kind: str, u_id: int, v_id: int, added: bool) -> None:
+        """
+        Add the edge of the given kind from the user with the id u_id to the user with the id v_id if added is
+        True, or remove it if there is one and added is False, without telling the journal. This is how changes
+        recorded by a journal are played back, so playing back the same change twice does nothing. Like
+        load_edges, no other thread should be changing the network at the same time.
+
+        Preconditions:
+            - kind in EDGE_KINDS
+            - u_id in self._items and v_id in self._items
+            - added or kind != 'matches'
+        """
+        edges = self.edges(kind)
+        with self.locked_users((u_id,)):
+            journal, edges.journal = edges.journal, None
+            if added:
+                edges.add(u_id, v_id)
+                if kind == 'matches':
+                    self._join_communities(u_id, v_id)
+            else:
+                edges.discard(u_id, v_id)
+            edges.journal = journal
+
+    def users(self) -> list[User]:
+        """
+        Return every user in the network, in the order they were added.
+        """
+        return list(self._items.values())
+
+    def edges(self, kind: str) -> _Edges:
+        """
+        Return the edges of the given kind, which should not be changed.
+
+        Preconditions:
+            - kind in EDGE_KINDS
+        """
+        return {'suggestions': self._suggestions, 'requests': self._requests, 'matches': self._matches}[kind]
+
+    def count_users(self) -> int:
+        """
+        Return the number of users in the network.
+        """
+        return len(self._items)
+
+    def count_edges(self, kind: str) -> int:
+        """
+        Return the number of edges of the given kind. Every match is an edge both ways, so it is counted twice.
+
+        Preconditions:
+            - kind in EDGE_KINDS
+        """
+        return len(self.edges(kind).pairs)
+
+    def degrees(self, kind: str) -> np.ndarray:
+        """
+        Return the number of edges of the given kind from every user, in the order they were added.
+
+        Preconditions:
+            - kind in EDGE_KINDS
+        """
+        targets = self.edges(kind).targets
+        ids = list(self._items)
+        return np.fromiter((len(targets.get(u_id, _NO_EDGES)) for u_id in ids), dtype=np.int64, count=len(ids))
+
+    def community_sizes(self) -> list[int]:
+        """
+        Return the number of users in every community, which is the length of every list returned by
+        find_connected_communities, without building those lists.
+        """
+        with self._community_lock:
+            return list(self._community_size.values())
 
     def is_empty(self) -> bool:
         """
         Return whether the graph is empty or not
 
         Preconditions:
-            - isinstance(self._users, dict)
+            - isinstance(self._items, dict)
         """
-        return len(self._users) == 0
+        return len(self._items) == 0
 
     def get_user(self, id_of_user: int) -> Optional[_User]:
         """
@@ -133,19 +404,74 @@ class Network:
         Preconditions:
             - id_of_user >= 0
         """
-        if id_of_user in self._users:
-            return self._users[id_of_user]
+        if id_of_user in self._items:
+            return _User(self, id_of_user)
         else:
             return None
 
+    def get_item(self, id_of_user: int) -> User:
+        """
+        Return the User with the given id.
+
+        Preconditions:
+            - id_of_user in self._items
+        """
+        return self._items[id_of_user]
+
+    def suggestion_ids(self, id_of_user: int) -> array:
+        """
+        Return the ids of the users suggested to the user with the given id. The array must not be changed, and it
+        is only iterated safely while holding locked_users([id_of_user]) or locked(), since other threads change
+        it in place. Use copy_ids otherwise.
+        """
+        return self._suggestions.targets.get(id_of_user, _NO_EDGES)
+
+    def request_ids(self, id_of_user: int) -> array:
+        """
+        Return the ids of the users that sent a request to the user with the given id. The array must not be
+        changed, and it is only iterated safely while holding the same locks as for suggestion_ids.
+        """
+        return self._requests.targets.get(id_of_user, _NO_EDGES)
+
+    def match_ids(self, id_of_user: int) -> array:
+        """
+        Return the ids of the users matched with the user with the given id. The array must not be changed, and it
+        is only iterated safely while holding the same locks as for suggestion_ids.
+        """
+        return self._matches.targets.get(id_of_user, _NO_EDGES)
+
+    def copy_ids(self, kind: str, id_of_user: int) -> array:
+        """
+        Return a copy of the ids of the users that the edges of the given kind from the user with the given id go
+        to. The copy is taken while holding the lock guarding those edges, so it can be iterated while other
+        threads change them.
+
+        Preconditions:
+            - kind in EDGE_KINDS
+            - the calling thread does not hold the lock guarding the edges of the user with the given id
+        """
+        with self._stripes[id_of_user % NUM_STRIPES]:
+            return array('q', self.edges(kind).targets.get(id_of_user, _NO_EDGES))
+
     def add_user(self, user: User) -> None:
         """
-        Add a user to the graph
+        Add a user to the graph. If the user is already in the graph, only their data is replaced.
 
         Preconditions:
-            - user not in self._users
+            - user not in self._items
         """
-        self._users[user.id] = _User(user, set())
+        with self._community_lock:
+            if user.id not in self._items:
+                self._parent[user.id] = user.id
+                self._community_size[user.id] = 1
+                self._next_member[user.id] = user.id
+                self._ids.append(user.id)
+                self._sum_of_squares += 1
+            # The journal is told first, so that no other thread can see the user and record an edge of theirs
+            # before the user themselves is recorded
+            if self._journal is not None:
+                self._journal.user_added(user)
+            self._items[user.id] = user
 
     def add_suggestion(self, user1: User, user2: User) -> None:
         """
@@ -154,39 +480,189 @@ class Network:
         Preconditions:
             - user1 != user2
         """
-        if user1.id not in self._users:
+        if user1.id not in self._items:
             self.add_user(user1)
-        if user2.id not in self._users:
+        if user2.id not in self._items:
             self.add_user(user2)
-        u1 = self._users[user1.id]
-        u2 = self._users[user2.id]
 
-        u1.suggestions.add(u2)
-        u2.suggestions.add(u1)
+        with self.locked_users((user1.id, user2.id)):
+            self._suggestions.add(user1.id, user2.id)
+            self._suggestions.add(user2.id, user1.id)
 
     def send_request(self, user1: User, user2: User) -> None:
         """
-        Send a request to be matched from user1 to user2
+        Send a request to be matched from user1 to user2. The suggestion of user2 to user1 is removed, if it has
+        not been already, such as by another thread sending the same request.
 
         Preconditions:
             - user1 != user2
-            - user1.user_id in self._users and user2.user_id in self._users
+            - user1.user_id in self._items and user2.user_id in self._items
         """
-        u1 = self._users[user1.id]
-        u2 = self._users[user2.id]
-        u1.send_request(u2)
+        with self.locked_users((user1.id, user2.id)):
+            self._suggestions.discard(user1.id, user2.id)
+            self._requests.add(user2.id, user1.id)
 
     def accept_request(self, user1: User, user2: User) -> None:
         """
-        user1 accepts request from user2
+        user1 accepts request from user2. The request is removed, if it has not been already, such as by another
+        thread accepting the same request.
 
         Preconditions:
             - user1 != user2
-            - user1.user_id in self._users and user2.user_id in self._users
+            - user1.user_id in self._items and user2.user_id in self._items
+        """
+        with self.locked_users((user1.id, user2.id)):
+            self._requests.discard(user1.id, user2.id)
+            self._matches.add(user1.id, user2.id)
+            self._matches.add(user2.id, user1.id)
+            self._join_communities(user1.id, user2.id)
+
+    def community_of(self, user: User) -> int:
+        """
+        Return the id of the community of the given user, which is the id of one of its members. Two users are
+        in the same community exactly when they have the same community id.
+
+        Preconditions:
+            - user.id in self._items
+        """
+        with self._community_lock:
+            return self._find_root(user.id)
+
+    def community_size(self, user: User) -> int:
+        """
+        Return the number of users in the community of the given user, including the user themselves.
+
+        Preconditions:
+            - user.id in self._items
+        """
+        with self._community_lock:
+            return self._community_size[self._find_root(user.id)]
+
+    def get_community(self, user: User) -> list[User]:
+        """
+        Return the users in the community of the given user, including the user themselves.
+
+        Preconditions:
+            - user.id in self._items
         """
-        u1 = self._users[user1.id]
-        u2 = self._users[user2.id]
-        u1.accept_request(u2)
+        members = [user.id]
+        with self._community_lock:
+            u_id = self._next_member[user.id]
+            while u_id != user.id:
+                members.append(u_id)
+                u_id = self._next_member[u_id]
+        return [self._items[u_id] for u_id in members]
+
+    def _find_root(self, u_id: int) -> int:
+        """
+        Return the root of the community of the user with the given id, halving the path to it on the way. The
+        caller must hold _community_lock.
+        """
+        parent = self._parent
+        while parent[u_id] != u_id:
+            parent[u_id] = parent[parent[u_id]]
+            u_id = parent[u_id]
+        return u_id
+
+    def _join_communities(self, u1_id: int, u2_id: int) -> None:
+        """
+        Merge the communities of the users with the given ids, joining the smaller one under the larger one. This
+        is called for every new match, so the community is given a new version even if the users were already
+        in it.
+        """
+        with self._community_lock:
+            root1, root2 = self._find_root(u1_id), self._find_root(u2_id)
+            self._last_version += 1
+            if root1 == root2:
+                self._versions[root1] = self._last_version
+                return
+            if self._community_size[root1] < self._community_size[root2]:
+                root1, root2 = root2, root1
+
+            self._versions[root1] = self._last_version
+            self._versions.pop(root2, None)
+            self._parent[root2] = root1
+            self._sum_of_squares += 2 * self._community_size[root1] * self._community_size[root2]
+            self._community_size[root1] += self._community_size.pop(root2)
+            next_member = self._next_member
+            next_member[root1], next_member[root2] = next_member[root2], next_member[root1]
+
+    def shortest_match_path(self, user1: User, user2: User, max_depth: int = 6) -> Optional[list[User]]:
+        """
+        Return the users on a shortest path of matches from user1 to user2, starting with user1 and ending with
+        user2, or None if there is no such path with at most max_depth matches.
+
+        The path is found by a breadth first search from both ends at once, which always grows the side with the
+        smaller frontier by one level, so each side only searches about half as deep as a search from one end
+        would, which looks at far fewer users when each user has several matches. Users in different communities
+        are never connected, so no search is needed for them. Paths are cached until a match is added to their
+        community.
+
+        Preconditions:
+            - user1.id in self._items and user2.id in self._items
+            - max_depth >= 0
+        """
+        key = (user1.id, user2.id, max_depth)
+        with self._community_lock:
+            root = self._find_root(user1.id)
+            if root != self._find_root(user2.id):
+                return None
+            version = self._versions.get(root, 0)
+
+            cached = self._path_cache.get(key)
+            if cached is not None and cached[0] == root and cached[1] == version:
+                self.path_cache_hits += 1
+                self._path_cache.move_to_end(key)
+                path = cached[2]
+            else:
+                self.path_cache_misses += 1
+                path = None
+                cached = None
+
+        if cached is None:
+            path = self._search_match_path(user1.id, user2.id, max_depth)
+            with self._community_lock:
+                self._path_cache[key] = (root, version, path)
+                self._path_cache.move_to_end(key)
+                if len(self._path_cache) > PATH_CACHE_SIZE:
+                    self._path_cache.popitem(last=False)
+
+        if path is None:
+            return None
+        return [self._items[u_id] for u_id in path]
+
+    def _search_match_path(self, u1_id: int, u2_id: int, max_depth: int) -> Optional[list[int]]:
+        """
+        Return the ids of the users on a shortest path of matches from the user with the id u1_id to the user
+        with the id u2_id, or None if there is no such path with at most max_depth matches.
+        """
+        if u1_id == u2_id:
+            return [u1_id]
+
+        # The user before every user found from each end, on the way from that end, and how far they are from it
+        parents = ({u1_id: None}, {u2_id: None})
+        distances = ({u1_id: 0}, {u2_id: 0})
+        frontiers = ([u1_id], [u2_id])
+        depths = [0, 0]
+        while frontiers[0] != [] and frontiers[1] != [] and depths[0] + depths[1] < max_depth:
+            side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+            parent, distance, other_distance = parents[side], distances[side], distances[1 - side]
+            depths[side] += 1
+            next_frontier = []
+            meeting = None
+            for u_id in frontiers[side]:
+                for v_id in self.copy_ids('matches', u_id):
+                    if v_id not in parent:
+                        parent[v_id] = u_id
+                        distance[v_id] = depths[side]
+                        next_frontier.append(v_id)
+                        if v_id in other_distance and \
+                                (meeting is None or other_distance[v_id] < other_distance[meeting]):
+                            meeting = v_id
+            if meeting is not None:
+                return _join_paths(parents, meeting)
+            frontiers = (next_frontier, frontiers[1]) if side == 0 else (frontiers[0], next_frontier)
+        return None
 
     def check_suggestion(self, user1: User, user2: User) -> bool:
         """
@@ -195,9 +671,8 @@ class Network:
         Preconditions:
             - user1 != user2
         """
-        if user1.id in self._users and user2.id in self._users:
-            u1 = self._users[user1.id]
-            return any(u2.user_id == user2.id for u2 in u1.suggestions)
+        if user1.id in self._items and user2.id in self._items:
+            return self._suggestions.has(user1.id, user2.id)
         elif self.check_request(user1, user2):
             return True
         else:
@@ -209,12 +684,12 @@ class Network:
 
         Preconditions:
             - user1 != user2
-            - user1.user_id in self._users and user2.user_id in self._users
+            - user1.user_id in self._items and user2.user_id in self._items
         """
-        if user1.id in self._users and user2.id in self._users:
-            if self._users[user2.id] in self._users[user1.id].requests:
+        if user1.id in self._items and user2.id in self._items:
+            if self._requests.has(user1.id, user2.id):
                 return True
-            elif self._users[user2.id] in self._users[user1.id].matches:
+            elif self._matches.has(user1.id, user2.id):
                 return True
             else:
                 return False
@@ -226,56 +701,115 @@ class Network:
         return a set of user ids for the matches of the given user
 
         Preconditions:
-            - user.user_id in self._users
+            - user.user_id in self._items
         """
-        if user.id in self._users:
-            u = self._users[user.id]
-            return {suggestion.user_id for suggestion in u.suggestions}
+        if user.id in self._items:
+            return set(self.copy_ids('suggestions', user.id))
         else:
             raise ValueError
 
-    def find_new_suggestion(self, user: User) -> None:
+    def find_new_suggestion(self, user: User, min_common: int = 2, top_n: Optional[int] = None) -> None:
         """
-        if 2 or more matches of user have another user in common, suggest the common user to user. Common user cannot
-        already be a suggestion
+        if min_common or more matches of user have another user in common, suggest the common user to user. Common
+        user cannot already be a suggestion. If top_n is given, only the top_n users with the most matches in
+        common with user are suggested, breaking ties by the smaller id.
 
         Preconditions:
-            - user.user_id in self._users
+            - user.user_id in self._items
+            - min_common >= 1
+            - top_n is None or top_n >= 0
         """
-        u = self._users[user.id]
-        if len(u.matches) < 2:
+        if len(self.match_ids(user.id)) < min_common:
             return
-        else:
-            common_matches = set()
-            for u1 in u.matches:
-                for u2 in u.matches:
-                    if u1.user_id != u2.user_id:
-                        c = self._find_common_matches(u1, u2, u)
-                        common_matches = common_matches.union(c)
-            for suggested_user in common_matches:
-                self.add_suggestion(u.item, suggested_user.item)
 
-    def _find_common_matches(self, u1: _User, u2: _User, avoid: _User) -> set[_User]:
+        common_counts = self.count_common_matches(user)
+        candidates = [(count, u_id) for u_id, count in common_counts.items() if count >= min_common]
+        if top_n is not None:
+            candidates = heapq.nsmallest(top_n, candidates, key=lambda candidate: (-candidate[0], candidate[1]))
+        for _, u_id in candidates:
+            self.add_suggestion(user, self._items[u_id])
+
+    def count_common_matches(self, user: User) -> dict[int, int]:
         """
-        find all the common matches between users and return them in a set. avoid is not a common user.
+        Return the number of matches that user has in common with every other user that has at least one,
+        keyed by the id of the other user. Every match of every match of user is counted once, so this takes
+        time proportional to the number of matches of the matches of user.
 
         Preconditions:
-            - u1 != u2 and avoid != u1 and avoid != u2
+            - user.user_id in self._items
         """
-        common_matches = u1.matches.intersection(u2.matches)
-        if avoid in common_matches:
-            common_matches.remove(avoid)
-        return common_matches
+        common_counts = Counter(other_id for match_id in self.copy_ids('matches', user.id)
+                                for other_id in self.copy_ids('matches', match_id))
+        common_counts.pop(user.id, None)
+        return common_counts
 
-    def find_all_new_suggestions(self) -> None:
+    def find_all_new_suggestions(self, min_common: int = 2, top_n: Optional[int] = None) -> None:
         """
-        Find all new suggestions if they exist for every node.
+        Find all new suggestions if they exist for every node, using the same min_common and top_n as
+        find_new_suggestion.
 
         Preconditions:
             - u_id is unique
+            - min_common >= 1
+            - top_n is None or top_n >= 0
         """
-        for u_id in self._users:
-            self.find_new_suggestion(self._users[u_id].item)
+        for u_id in list(self._items):
+            self.find_new_suggestion(self._items[u_id], min_common, top_n)
+
+    def match_matrix(self) -> tuple[list[int], sparse.csr_matrix]:
+        """
+        Return the ids of the users in the network, in the order they were added, along with the adjacency matrix
+        of their matches. Row and column i of the matrix belong to the user with the i-th id, and the entry in
+        row i and column j is 1 if those users are matched, and 0 otherwise. The caller should hold locked() if
+        other threads may be adding matches.
+        """
+        # scipy is only needed by the batch suggestions, so it is not imported along with the rest of the network
+        from scipy import sparse
+
+        ids = list(self._items)
+        position_of = {u_id: i for i, u_id in enumerate(ids)}
+        rows = []
+        columns = []
+        for i, u_id in enumerate(ids):
+            matches = self.match_ids(u_id)
+            rows.extend([i] * len(matches))
+            columns.extend(position_of[match_id] for match_id in matches)
+
+        adjacency = sparse.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, columns)),
+                                      shape=(len(ids), len(ids)))
+        return (ids, adjacency)
+
+    def find_all_new_suggestions_batch(self, min_common: int = 2, top_n: Optional[int] = None) -> None:
+        """
+        Suggest every pair of users that have at least min_common matches in common and are not matched to each
+        other yet. If top_n is given, each user only gets the top_n users with the most matches in common with
+        them, breaking ties by the smaller id, along with the users who picked them in their own top_n.
+
+        This gives the same suggestions as find_all_new_suggestions, except that users who are already matched
+        are never suggested to each other, but the number of matches in common between every pair of users is
+        computed at once as the square of the sparse adjacency matrix of the matches, so it scales to the whole
+        network. The suggestions are then added to each user in a single update.
+
+        Preconditions:
+            - min_common >= 1
+            - top_n is None or top_n >= 0
+        """
+        with self.locked():
+            ids, adjacency = self.match_matrix()
+            common = (adjacency @ adjacency).tocsr()
+            common.setdiag(0)
+            common = common - common.multiply(adjacency)
+            common.data[common.data < min_common] = 0
+            common.eliminate_zeros()
+
+            if top_n is not None:
+                common = _keep_top_n(common, top_n, np.array(ids))
+            common = (common + common.T).tocsr()
+
+            for i, u_id in enumerate(ids):
+                suggested = common.indices[common.indptr[i]:common.indptr[i + 1]]
+                if len(suggested) > 0:
+                    self._suggestions.add_all(u_id, [ids[j] for j in suggested])
 
     def find_connected_communities(self) -> list[list[_User]]:
         """
@@ -284,66 +818,122 @@ class Network:
         Preconditions:
             - all u_id in self is unique
         """
-        communities = []
-        visited = set()
-        for u_id in self._users:
-            if u_id not in visited:
-                connected = self._users[u_id].find_all_connected_matches(set())
-                visited = visited.union(connected[0])
-                communities.append(connected[1])
-        return communities
+        _, members = self.find_components()
+        return [[_User(self, u_id) for u_id in component] for component in members]
 
-    def random_suggestions(self, n: Optional[int] = 1) -> None:
+    def find_components(self) -> tuple[dict[int, int], list[list[int]]]:
+        """
+        Return the id of the community of every user in the network, keyed by their id, along with the ids of
+        the members of each community, where a community is a group of users connected by matches. Communities
+        are numbered from 0 in the order their first user was added to the network, and their members are
+        listed in the order they were added.
+
+        >>> network = Network()
+        >>> users = [User(f"user {i}", f"user_{i}", i, 20, "Male") for i in range(4)]
+        >>> for u in users:
+        ...     network.add_user(u)
+        >>> network.add_suggestion(users[0], users[2])
+        >>> network.send_request(users[0], users[2])
+        >>> network.accept_request(users[2], users[0])
+        >>> network.find_components()
+        ({0: 0, 1: 1, 2: 0, 3: 2}, [[0, 2], [1], [3]])
+        """
+        component_of = {}
+        members = []
+        component_of_root = {}
+        with self._community_lock:
+            for u_id in self._items:
+                root = self._find_root(u_id)
+                if root not in component_of_root:
+                    component_of_root[root] = len(members)
+                    members.append([])
+                component_of[u_id] = component_of_root[root]
+                members[component_of_root[root]].append(u_id)
+        return (component_of, members)
+
+    def random_suggestions(self, n: Optional[int] = 1, generator: Optional[np.random.Generator] = None) -> None:
         """
-        Randomly suggest users to each other from different communities.
+        Randomly suggest users to each other from different communities. Fewer than n suggestions are made if
+        every user is in the same community. The pairs are drawn by generator, or by a generator seeded from the
+        random module if it is None.
 
         Preconditions:
             - all users in Network is unique
         """
-        for _ in range(n):
-            keys = list(self._users.keys())
-            u1 = self._users[random.choice(keys)]
-            u2 = self._users[random.choice(keys)]
-            self.add_suggestion(u1.item, u2.item)
+        for u1_id, u2_id in self.random_cross_community_pairs(n, generator):
+            self.add_suggestion(self._items[u1_id], self._items[u2_id])
 
-    def random_suggestion_user(self, user: User, simple: Optional[bool] = True) -> None:
+    def random_cross_community_pairs(self, n: int,
+                                     generator: Optional[np.random.Generator] = None) -> list[tuple[int, int]]:
         """
-        Randomly suggest across different communities for this user.
+        Return the ids of n random pairs of users from different communities, where every such pair is equally
+        likely, or no pairs if every user is in the same community.
+
+        Random pairs of users are drawn in batches with NumPy and the pairs within a community are thrown away.
+        The chance that a pair is kept is known from the sizes of the communities, so each batch is made large
+        enough to usually finish in one go, and the whole draw takes time proportional to n rather than to the
+        number of users. The draws are made by generator, which is seeded from the random module if it is None, so
+        seeding either one makes them repeatable.
 
         Preconditions:
-            - len(self._users) >= 2
+            - n >= 0
         """
-        if simple:
-            u1 = self._users[user.id]
-            keys = list(self._users.keys())
-            u2 = self._users[random.choice(keys)]
-            self.add_suggestion(u1.item, u2.item)
-        else:
-            u1 = self._users[user.id]
-            community = u1.find_all_connected_matches(set())
-            s = set(self._users.keys()).difference(community[0])
-            keys = list(self._users.keys())
-            u2 = self._users[random.choice(keys)]
-            random_user_id = random.choice(list(s))
-            u2 = self._users[random_user_id]
-            self.add_suggestion(u1.item, u2.item)
-
-    def print_graph(self):
+        if generator is None:
+            generator = np.random.default_rng(random.getrandbits(64))
+
+        with self._community_lock:
+            num_users = len(self._ids)
+            if n == 0 or self._sum_of_squares == num_users ** 2:
+                return []
+
+            cross_chance = 1 - self._sum_of_squares / num_users ** 2
+            ids = np.frombuffer(self._ids, dtype=np.int64)
+            pairs = []
+            while len(pairs) < n:
+                batch_size = int((n - len(pairs)) / cross_chance * 1.1) + 16
+                candidates = ids[generator.integers(0, num_users, size=(batch_size, 2))]
+                roots = np.array([self._find_root(u_id) for u_id in candidates.ravel().tolist()])
+                roots = roots.reshape((batch_size, 2))
+                kept = candidates[roots[:, 0] != roots[:, 1]][:n - len(pairs)]
+                pairs.extend(zip(kept[:, 0].tolist(), kept[:, 1].tolist()))
+
+            # Release the view of self._ids so that more users can be added to it
+            del ids
+        return pairs
+
+    def random_suggestion_user(self, user: User, simple: Optional[bool] = False) -> None:
         """
-        prints the network
+        Randomly suggest across different communities for this user. Unless simple is True, the suggested user
+        is always outside of the user's community, and nobody is suggested if everyone is in it.
+
+        Preconditions:
+            - len(self._items) >= 2
         """
-        for key in self._users:
-            vertex = self._users[key]
-            print(f"suggestions: {key}, {[u.user_id for u in vertex.suggestions]}")
-            print(f"matches: {key}, {[u.user_id for u in vertex.matches]}")
+        u1 = self._items[user.id]
+        ids = self._ids
+        with self._community_lock:
+            if simple:
+                u2_id = random.choice(ids)
+                while u2_id == user.id:
+                    u2_id = random.choice(ids)
+            else:
+                root = self._find_root(user.id)
+                if self._community_size[root] == len(ids):
+                    return
+                # Draw users until one is outside of the community, which takes len(ids) / (number of users
+                # outside of the community) draws on average
+                u2_id = random.choice(ids)
+                while self._find_root(u2_id) == root:
+                    u2_id = random.choice(ids)
+        self.add_suggestion(u1, self._items[u2_id])
 
     def random_request(self, u1: User, u2: User) -> None:
         """
         Send a request that is paired with random acceptence
 
         Precondition:
-            - u1.id in self._users
-            - u2.id in self._users
+            - u1.id in self._items
+            - u2.id in self._items
         """
         self.send_request(u1, u2)
 
@@ -352,43 +942,296 @@ class Network:
         ranomly accept a request
 
         Precondition:
-            - u1.id in self._users
-            - u2.id in self._users
+            - u1.id in self._items
+            - u2.id in self._items
         """
         if random.choice([True, False]):
             self.accept_request(u1, u2)
 
-    def create_network_single_community(self, suggestions: list[User], exclude: User) -> None:
+    def create_network_single_community(self, suggestions: list[User], exclude: User,
+                                        generator: Optional[np.random.Generator] = None) -> None:
         """
         Create a network from suggestions. Do not add any matches between any users in suggestions and
         exclude
 
+        Every pair of users in suggestions is suggested to each other, and every pair without exclude sends a
+        request that is accepted half of the time, as decided by generator. If generator is None, it is seeded
+        from the random module.
+
         Precondition:
             - exclude in suggestions
         """
-        if len(suggestions) == 1:
-            self.add_user(suggestions[0])
-        visited = set()
-        for u1 in suggestions:
-            for u2 in suggestions:
-                if u1.id != u2.id and (u1.id, u2.id) not in visited and (u2.id, u1.id) not in visited:
-                    if not self.check_suggestion(u1, u2):
-                        self.add_suggestion(u1, u2)
-                    if u1.id != exclude.id and u2.id != exclude.id and not self.check_request(u1, u2):
-                        self.random_request(u1, u2)
-                        self.random_accept(u2, u1)
+        if generator is None:
+            generator = np.random.default_rng(random.getrandbits(64))
+        self.add_group_edges(suggestions, exclude, generator)
+
+    def add_group_edges(self, group: list[User], exclude: Optional[User], generator: np.random.Generator) -> None:
+        """
+        Add every user in group to the network and suggest every pair of them to each other. Then, for each pair
+        of users in group that does not include exclude and that has neither a match nor a request from the
+        second user to the first, the first user sends a request to the second, which the second accepts if the
+        next draw of generator is below one half.
+
+        This gives the same edges as suggesting, requesting and accepting one pair at a time in the order of
+        group, but each pair is only looked at once, the pairs are generated as NumPy index arrays, all of the
+        acceptances are drawn at once, and the new edges of each user are added together. The locks of every
+        user in group are held while their edges are added.
 
-                visited.add((u1.id, u2.id))
+        Preconditions:
+            - all users in group are unique
+        """
+        for user in group:
+            if user.id not in self._items:
+                self.add_user(user)
+        if len(group) < 2:
+            return
 
-    def create_network_all(self, all_suggestions: list[list[User]], exclude: User, n: Optional[int] = 1000) -> None:
+        ids = [user.id for user in group]
+        with self.locked_users(ids):
+            exclude_id = None if exclude is None else exclude.id
+            suggestions, requests, matches = self._suggestions, self._requests, self._matches
+            new_suggestions = {}
+            requesting = []
+            firsts, seconds = np.triu_indices(len(ids), 1)
+            for u1_id, u2_id in zip(np.take(ids, firsts).tolist(), np.take(ids, seconds).tolist()):
+                requested = u1_id != exclude_id and u2_id != exclude_id \
+                    and not requests.has(u1_id, u2_id) and not matches.has(u1_id, u2_id)
+                if requested:
+                    requesting.append((u1_id, u2_id))
+
+                # A request from u1 to u2 takes the place of the suggestion of u2 to u1
+                if suggestions.has(u1_id, u2_id):
+                    if requested:
+                        suggestions.remove(u1_id, u2_id)
+                else:
+                    if not requested:
+                        new_suggestions.setdefault(u1_id, []).append(u2_id)
+                    new_suggestions.setdefault(u2_id, []).append(u1_id)
+
+            for u_id, v_ids in new_suggestions.items():
+                suggestions.add_all(u_id, v_ids)
+
+            new_requests = {}
+            new_matches = {}
+            accepted = generator.random(len(requesting)) < 0.5
+            for (u1_id, u2_id), accept in zip(requesting, accepted.tolist()):
+                if accept:
+                    if requests.has(u2_id, u1_id):
+                        requests.remove(u2_id, u1_id)
+                    new_matches.setdefault(u1_id, []).append(u2_id)
+                    new_matches.setdefault(u2_id, []).append(u1_id)
+                    self._join_communities(u2_id, u1_id)
+                else:
+                    new_requests.setdefault(u2_id, []).append(u1_id)
+
+            for u_id, v_ids in new_requests.items():
+                requests.add_all(u_id, v_ids)
+            for u_id, v_ids in new_matches.items():
+                matches.add_all(u_id, v_ids)
+
+    def create_network_all(self, all_suggestions: list[list[User]], exclude: Optional[User],
+                           n: Optional[int] = 1000, seed: Optional[int] = None) -> None:
         """
         Create a network from all suggestions. Do not add any matches between any users in all_suggestions and
-        exclude
+        exclude, if it is given
+
+        All of the random choices are made by one NumPy generator. Giving the same seed to a network with the
+        same edges makes the same network, which is seeded from the random module if seed is None.
 
         Precondition:
-            - any(exclude in suggestions for suggestions in all_suggestions)
+            - exclude is None or any(exclude in suggestions for suggestions in all_suggestions)
         """
+        generator = np.random.default_rng(random.getrandbits(64) if seed is None else seed)
         for suggestion in all_suggestions:
-            self.create_network_single_community(suggestion, exclude)
+            self.add_group_edges(suggestion, exclude, generator)
+
+        self.random_suggestions(n, generator)
+
+
+# The edges of a user with none of a kind of edge
+_NO_EDGES = array('q')
+
 
-        self.random_suggestions(n)
+# @check_contracts
+class Journal(Protocol):
+    """
+    Something that is told about every change to the users and edges of a network, such as a buffer of the
+    changes that have not been saved to the database yet. Threads changing different users tell it about their
+    changes at the same time, so it must be safe to call from more than one thread.
+    """
+
+    def user_added(self, user: User) -> None:
+        """
+        Record that user was added to the network, or that their data was replaced.
+        """
+        ...
+
+    def edge_added(self, kind: str, u_id: int, v_id: int) -> None:
+        """
+        Record that an edge of the given kind from the user with the id u_id to the user with the id v_id was
+        added.
+        """
+        ...
+
+    def edge_removed(self, kind: str, u_id: int, v_id: int) -> None:
+        """
+        Record that an edge of the given kind from the user with the id u_id to the user with the id v_id was
+        removed.
+        """
+        ...
+
+
+# @check_contracts
+class _Edges:
+    """
+    One kind of directed edge between users, such as suggestions.
+
+    The edges from each user are kept in an array, and every edge is also kept in pairs under a single key
+    along with its position in that array. Checking whether an edge exists takes constant time instead of a
+    scan of the array, and so does removing an edge, by moving the last edge of the array into its place.
+
+    An instance is not safe to change from more than one thread at a time. The Network it belongs to holds the
+    lock of the user an edge is from while changing it.
+
+    Instance Attributes:
+        - kind: the name of this kind of edge
+        - targets: the ids of the users that each user has an edge to, keyed by their id. Users with no edges
+          are left out.
+        - pairs: the position of every edge in its array, keyed by the key of the edge (see _edge_key)
+        - journal: what is told about every edge that is added or removed, if anything
+
+    Representation Invariants:
+        - all(len(self.targets[u_id]) > 0 for u_id in self.targets)
+        - len(self.pairs) == sum(len(self.targets[u_id]) for u_id in self.targets)
+        - all(self.pairs[_edge_key(u_id, v_id)] == i for u_id in self.targets \
+              for i, v_id in enumerate(self.targets[u_id]))
+    """
+    __slots__ = ('kind', 'targets', 'pairs', 'journal')
+    kind: str
+    targets: dict[int, array]
+    pairs: dict[int | tuple[int, int], int]
+    journal: Optional[Journal]
+
+    def __init__(self, kind: str) -> None:
+        """
+        Initialize a kind of edge with the given name and no edges.
+        """
+        self.kind = kind
+        self.targets = {}
+        self.pairs = {}
+        self.journal = None
+
+    def has(self, u_id: int, v_id: int) -> bool:
+        """
+        Return whether there is an edge from the user with the id u_id to the user with the id v_id.
+        """
+        return _edge_key(u_id, v_id) in self.pairs
+
+    def add(self, u_id: int, v_id: int) -> None:
+        """
+        Add an edge from the user with the id u_id to the user with the id v_id, if there is not one already.
+        """
+        key = _edge_key(u_id, v_id)
+        if key not in self.pairs:
+            if u_id in self.targets:
+                self.pairs[key] = len(self.targets[u_id])
+                self.targets[u_id].append(v_id)
+            else:
+                self.pairs[key] = 0
+                self.targets[u_id] = array('q', [v_id])
+            if self.journal is not None:
+                self.journal.edge_added(self.kind, u_id, v_id)
+
+    def add_all(self, u_id: int, v_ids: list[int]) -> None:
+        """
+        Add an edge from the user with the id u_id to each user with an id in v_ids, if there is not one already.
+        """
+        position = len(self.targets.get(u_id, _NO_EDGES))
+        new_ids = []
+        for v_id in v_ids:
+            key = _edge_key(u_id, v_id)
+            if key not in self.pairs:
+                self.pairs[key] = position + len(new_ids)
+                new_ids.append(v_id)
+
+        if u_id in self.targets:
+            self.targets[u_id].extend(new_ids)
+        elif new_ids != []:
+            self.targets[u_id] = array('q', new_ids)
+        if self.journal is not None:
+            for v_id in new_ids:
+                self.journal.edge_added(self.kind, u_id, v_id)
+
+    def remove(self, u_id: int, v_id: int) -> None:
+        """
+        Remove the edge from the user with the id u_id to the user with the id v_id. Raise a KeyError if there is
+        no such edge, like removing a missing element from a set.
+        """
+        position = self.pairs.pop(_edge_key(u_id, v_id))
+        targets = self.targets[u_id]
+        last_id = targets.pop()
+        if position < len(targets):
+            targets[position] = last_id
+            self.pairs[_edge_key(u_id, last_id)] = position
+        elif len(targets) == 0:
+            del self.targets[u_id]
+        if self.journal is not None:
+            self.journal.edge_removed(self.kind, u_id, v_id)
+
+    def discard(self, u_id: int, v_id: int) -> None:
+        """
+        Remove the edge from the user with the id u_id to the user with the id v_id, if there is one, like
+        discarding an element from a set.
+        """
+        if self.has(u_id, v_id):
+            self.remove(u_id, v_id)
+
+
+def _edge_key(u_id: int, v_id: int) -> int | tuple[int, int]:
+    """
+    Return the key of the edge from the user with the id u_id to the user with the id v_id. When v_id fits in 32
+    bits, which is the case for every id the database hands out, both ids are packed into a single integer,
+    since it takes less memory than a tuple.
+
+    >>> _edge_key(1, 2) == (1 << 32) + 2
+    True
+    >>> _edge_key(1, 2 ** 40)
+    (1, 1099511627776)
+    """
+    if 0 <= v_id < 1 << 32:
+        return (u_id << 32) | v_id
+    return (u_id, v_id)
+
+
+def _join_paths(parents: tuple[dict[int, Optional[int]], dict[int, Optional[int]]], meeting: int) -> list[int]:
+    """
+    Return the path from the start of the first search in parents to the start of the second, through the user
+    with the id meeting that both searches found, where parents has the user before every user found by each
+    search.
+    """
+    path = [meeting]
+    while parents[0][path[-1]] is not None:
+        path.append(parents[0][path[-1]])
+    path.reverse()
+    while parents[1][path[-1]] is not None:
+        path.append(parents[1][path[-1]])
+    return path
+
+
+def _keep_top_n(common: sparse.csr_matrix, top_n: int, ids: np.ndarray) -> sparse.csr_matrix:
+    """
+    Return a copy of common with only the top_n largest entries of every row, breaking ties by the smaller id,
+    where ids has the id of the user of each column.
+    """
+    from scipy import sparse
+
+    rows = []
+    columns = []
+    for i in range(common.shape[0]):
+        start, end = common.indptr[i], common.indptr[i + 1]
+        row_columns = common.indices[start:end]
+        best = np.lexsort((ids[row_columns], -common.data[start:end]))[:top_n]
+        rows.extend([i] * len(best))
+        columns.extend(row_columns[best])
+
+    return sparse.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, columns)), shape=common.shape)
@@ -0,0 +1,59 @@
+"""
+CSC111 Winter 2023 Final Project: suitemate
+
+Derek Huynh, James Yung, Andrew Xie, Amaan Khan
+
+================================================
+
+Tests for sorting users into the leaves of the decision tree. Run them with pytest from the app directory, like
+the app itself.
+"""
+import decision_tree
+import leaf_index
+from user import User
+
+PARAMETERS_FILE = "csv_files/decision_tree_parameters.csv"
+
+# Rents that are not whole numbers, next to the edges of the rent ranges in PARAMETERS_FILE. The middle of the
+# first one is 801, in the second range, but it would be 800, in the first range, if the rents were truncated.
+EDGE_RENTS = [(800.5, 801.5), (1100.5, 1100.5), (1099.5, 1102.5), (3200.5, 3201.5), (11999.5, 12000.5),
+              (12000.5, 12000.5)]
+
+
+def test_bulk_decisions_match_single_decisions() -> None:
+    """
+    get_users_decisions sorts every rent into the same range as get_user_decisions, including rents that are
+    not whole numbers at the edges of the ranges.
+    """
+    buckets = decision_tree.RentBuckets(decision_tree.read_file(PARAMETERS_FILE)[0][1])
+    users = [_user_with_rent(i, rent) for i, rent in enumerate(EDGE_RENTS)]
+
+    assert decision_tree.get_users_decisions(users, buckets) \
+        == [tuple(decision_tree.get_user_decisions(u, buckets)) for u in users]
+    assert decision_tree.get_users_decisions(users[:1], buckets)[0][0] == (801, 1100)
+
+
+def test_bulk_load_matches_adding_one_at_a_time() -> None:
+    """
+    Users with rents that are not whole numbers end up in the same leaves of a LeafIndex whether they are loaded
+    in bulk or added one at a time.
+    """
+    parameters = decision_tree.read_file(PARAMETERS_FILE)
+    users = [_user_with_rent(i, rent) for i, rent in enumerate(EDGE_RENTS)]
+
+    in_bulk = leaf_index.LeafIndex(parameters, sparse=True)
+    in_bulk.bulk_load(users)
+    one_at_a_time = leaf_index.LeafIndex(parameters, sparse=True)
+    for u in users:
+        one_at_a_time.add_user_to_tree(u)
+
+    assert in_bulk.leaf_of == one_at_a_time.leaf_of
+
+
+def _user_with_rent(user_id: int, rent: tuple[float, float]) -> User:
+    """
+    Return a user with the given id and rent, and the same other preferences as every other user made by this.
+    """
+    return User(f"user {user_id}", f"user_{user_id}", user_id, 20, "Male", gender_pref=False, smoke=False,
+                rent=rent, pets=False, contact=f"user{user_id}@gmail.com", location=('Toronto', 'Ontario'),
+                noise=1, guests=False, cleanliness=1, num_roommates=1)
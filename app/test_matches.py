@@ -0,0 +1,23 @@
+"""
+CSC111 Winter 2023 Final Project: suitemate
+
+Derek Huynh, James Yung, Andrew Xie, Amaan Khan
+
+================================================
+
+Tests for the views in matches.py. Run them with pytest from the app directory, like the app itself.
+"""
+from __init__ import create_app
+
+
+def test_stats_redirects_logged_out_users(tmp_path) -> None:
+    """
+    The statistics view sends a visitor who is not logged in to the login page, without collecting anything.
+    The view is called directly so that the users are not generated as they are before the first request.
+    """
+    app = create_app({"SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'suitemate.db'}", "TESTING": True})
+    with app.test_request_context("/matches/stats"):
+        response = app.view_functions["matches.stats"]()
+
+    assert response.status_code == 302
+    assert response.location.endswith("/auth/login")
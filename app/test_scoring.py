@@ -0,0 +1,47 @@
+"""
+CSC111 Winter 2023 Final Project: suitemate
+
+Derek Huynh, James Yung, Andrew Xie, Amaan Khan
+
+================================================
+
+Tests for the ScoringEngine in scoring.py. Run them with pytest from the app directory, like the app itself.
+"""
+import dataclasses
+import decision_tree
+import scoring
+from benchmarks import synthetic_users
+from user import User
+
+PARAMETERS_FILE = "csv_files/decision_tree_parameters.csv"
+NUM_USERS = 2000
+
+
+def test_closest_matches_match_the_tree() -> None:
+    """
+    The engine finds the same closest matches, in the same order, as a DecisionTree with the same users, both
+    before and after more users are added, and for users who are not in the population.
+    """
+    parameters = decision_tree.read_file(PARAMETERS_FILE)
+    users = synthetic_users(NUM_USERS)
+    tree = decision_tree.build_decision_tree(parameters, None)
+    engine = scoring.ScoringEngine(parameters)
+
+    for group in (users[:NUM_USERS // 2], users[NUM_USERS // 2:]):
+        for u in group:
+            tree.add_user_to_tree(u)
+        engine.add_users(group)
+        for u in users:
+            assert _ids(engine.find_closest_matches(u)) == _ids(tree.find_closest_matches(u))
+
+    outsiders = [dataclasses.replace(users[0], id=NUM_USERS, rent=(100000, 100000)),
+                 dataclasses.replace(users[1], id=NUM_USERS + 1, noise=users[1].noise % 3 + 1)]
+    for u in outsiders:
+        assert _ids(engine.find_closest_matches(u)) == _ids(tree.find_closest_matches(u))
+
+
+def _ids(users: list[User]) -> list[int]:
+    """
+    Return the ids of the given users, in the same order.
+    """
+    return [u.id for u in users]
@@ -0,0 +1,146 @@
+"""
+CSC111 Winter 2023 Final Project: suitemate
+
+Derek Huynh, James Yung, Andrew Xie, Amaan Khan
+
+================================================
+
+Tests for the Network in social_graph.py and the LeafIndex it is used with, when they are shared by the threads
+of a threaded server. Run them with pytest from the app directory, like the app itself. The larger version of
+these checks is benchmarks.stress_threads.
+"""
+from __future__ import annotations
+import random
+import sys
+import threading
+from typing import Optional
+import decision_tree
+import leaf_index
+import social_graph
+from user import User
+
+PARAMETERS_FILE = "csv_files/decision_tree_parameters.csv"
+NUM_THREADS = 8
+NUM_USERS = 200
+NUM_PAIRS = 20000
+
+# The number of times the threads make their changes, each time to a new network and index, since a race only
+# shows up in some runs
+NUM_ROUNDS = 3
+
+
+def test_threads_make_the_same_changes_as_one_thread() -> None:
+    """
+    NUM_THREADS threads sharing a network and an index end up with the same edges, communities and leaves as one
+    thread making all of the changes, and every representation invariant of _User holds afterwards. Each thread
+    adds its share of the users and matches its share of random pairs of users, which share users with the pairs
+    of the other threads, and threads are switched as often as possible to make races likelier. An error in any
+    thread fails the test.
+    """
+    users = _make_users(NUM_USERS)
+    rng = random.Random(1)
+    pairs = list({tuple(sorted(rng.sample(range(len(users)), 2))) for _ in range(NUM_PAIRS)})
+    rng.shuffle(pairs)
+    parameters = decision_tree.read_file(PARAMETERS_FILE)
+
+    def make_changes(network: social_graph.Network, index: leaf_index.LeafIndex, thread: int,
+                     barrier: Optional[threading.Barrier] = None) -> None:
+        if barrier is not None:
+            barrier.wait()
+        for u in users[thread::NUM_THREADS]:
+            index.add_user_to_tree(u)
+            index.find_closest_matches(u)
+        for i in range(thread, len(pairs), NUM_THREADS):
+            u1, u2 = users[pairs[i][0]], users[pairs[i][1]]
+            network.add_suggestion(u1, u2)
+            network.send_request(u1, u2)
+            if i % 2 == 0:
+                network.accept_request(u2, u1)
+
+    one_network, one_index = social_graph.Network(), leaf_index.LeafIndex(parameters, sparse=True)
+    for thread in range(NUM_THREADS):
+        make_changes(one_network, one_index, thread)
+
+    def run(network: social_graph.Network, index: leaf_index.LeafIndex, thread: int, barrier: threading.Barrier,
+            errors: list[Exception]) -> None:
+        try:
+            make_changes(network, index, thread, barrier)
+        except Exception as error:
+            errors.append(error)
+            raise
+
+    for _ in range(NUM_ROUNDS):
+        network, index = social_graph.Network(), leaf_index.LeafIndex(parameters, sparse=True)
+        barrier = threading.Barrier(NUM_THREADS)
+        errors = []
+        threads = [threading.Thread(target=run, args=(network, index, thread, barrier, errors))
+                   for thread in range(NUM_THREADS)]
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setswitchinterval(switch_interval)
+
+        assert errors == []
+        assert _edge_sets(network) == _edge_sets(one_network)
+        assert _communities(network) == _communities(one_network)
+        assert {leaf: set(group) for leaf, group in index.leaves.items()} \
+            == {leaf: set(group) for leaf, group in one_index.leaves.items()}
+        _check_invariants(network, users)
+
+
+def _check_invariants(network: social_graph.Network, users: list[User]) -> None:
+    """
+    Assert that the edges of every kind in network agree with each other, that the size of every community is
+    the number of users connected to its members, and that every representation invariant of _User holds.
+    """
+    for kind in social_graph.EDGE_KINDS:
+        edges = network.edges(kind)
+        assert len(edges.pairs) == sum(len(v_ids) for v_ids in edges.targets.values())
+        assert all(edges.has(u_id, v_id) for u_id, v_ids in edges.targets.items() for v_id in v_ids)
+
+    for u in users:
+        node = network.get_user(u.id)
+        if node is not None:
+            assert node not in node.suggestions
+            assert node not in node.matches
+            assert node not in node.requests
+            assert all(node in other.matches for other in node.matches)
+            assert network.community_size(u) == len(node.find_all_connected_matches(set())[1])
+
+
+def _make_users(num_user: int) -> list[User]:
+    """
+    Return num_user random users with the ids 0 to num_user - 1, always the same ones.
+    """
+    rng = random.Random(0)
+    users = []
+    for i in range(num_user):
+        low_bound_rent = rng.randint(500, 2500)
+        users.append(User(f"user {i}", f"user_{i}", i, rng.randint(17, 100), rng.choice(["Male", "Female", "other"]),
+                          gender_pref=rng.choice([True, False]), smoke=rng.choice([True, False]),
+                          rent=(low_bound_rent, low_bound_rent + rng.randint(0, 200)),
+                          pets=rng.choice([True, False]), contact=f"user{i}@gmail.com",
+                          location=('Toronto', 'Ontario'), noise=rng.randint(1, 3),
+                          guests=rng.choice([True, False]), cleanliness=rng.randint(1, 3),
+                          num_roommates=rng.randint(1, 4)))
+    return users
+
+
+def _edge_sets(network: social_graph.Network) -> list[set[tuple[int, int]]]:
+    """
+    Return the edges of each kind in network as pairs of the ids of the users they are from and to.
+    """
+    return [{(u_id, v_id) for u_id, v_ids in network.edges(kind).targets.items() for v_id in v_ids}
+            for kind in social_graph.EDGE_KINDS]
+
+
+def _communities(network: social_graph.Network) -> set[frozenset[int]]:
+    """
+    Return the ids of the members of every community of network.
+    """
+    return {frozenset(members) for members in network.find_components()[1]}